@@ -1,4 +1,9 @@
-from typing import List
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
 
 import pytest
 
@@ -96,3 +101,85 @@ def lorem_ipsum_docs() -> List[str]:
 @pytest.fixture(scope="function")
 def model_path() -> str:
     return "test_fixtures/test-olmo-model"
+
+
+class LocalFileServer:
+    """
+    A minimal local stand-in for a remote object store, serving the files in ``root`` over HTTP
+    with support for ``HEAD`` requests, ETags, and single byte-range ``GET`` requests.
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+        #: The ``(method, path, range)`` of every request received, in order.
+        self.requests: List[Tuple[str, str, Optional[str]]] = []
+        #: Seconds to wait before responding to each ``GET`` request.
+        self.delay: float = 0.0
+        #: Delays for the next ``GET`` requests, overriding ``delay`` until they're used up.
+        self.delays: List[float] = []
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _start_response(self) -> Optional[bytes]:
+                path = server.root / self.path.lstrip("/")
+                if not path.is_file():
+                    self.send_error(404)
+                    return None
+                data = path.read_bytes()
+                stat = path.stat()
+                match = re.fullmatch(r"bytes=(\d+)-(\d+)", self.headers.get("Range") or "")
+                if match is not None:
+                    data = data[int(match.group(1)) : int(match.group(2)) + 1]
+                    self.send_response(206)
+                else:
+                    self.send_response(200)
+                self.send_header("Content-Length", str(len(data) if match is not None else stat.st_size))
+                self.send_header("ETag", f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"')
+                self.end_headers()
+                return data
+
+            def do_HEAD(self):
+                server.requests.append((self.command, self.path, self.headers.get("Range")))
+                self._start_response()
+
+            def do_GET(self):
+                server.requests.append((self.command, self.path, self.headers.get("Range")))
+                with server._lock:
+                    delay = server.delays.pop(0) if server.delays else server.delay
+                if delay > 0:
+                    time.sleep(delay)
+                data = self._start_response()
+                if data is not None:
+                    self.wfile.write(data)
+
+        self.host = "127.0.0.1"
+        self._server = ThreadingHTTPServer((self.host, 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def url(self, name: str) -> str:
+        return f"http://{self.host}:{self._server.server_address[1]}/{name}"
+
+    def get_requests(self) -> List[Tuple[str, str, Optional[str]]]:
+        return [r for r in self.requests if r[0] == "GET"]
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+@pytest.fixture(scope="function")
+def local_file_server(tmp_path: Path) -> Iterator[LocalFileServer]:
+    root = tmp_path / "server"
+    root.mkdir()
+    server = LocalFileServer(root)
+    server.start()
+    yield server
+    server.stop()
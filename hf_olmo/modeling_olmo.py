@@ -96,10 +96,14 @@ class OLMoForCausalLM(PreTrainedModel, GenerationMixin):
         cache_position: Optional[
             Cache
         ] = None,  # This is a hack mitigation of an issue in transformers `4.39.x` https://github.com/huggingface/transformers/issues/29426
+        logits_positions: Optional[torch.Tensor] = None,
     ) -> Union[Tuple, CausalLMOutputWithPast]:
         if use_cache is None:
             use_cache = self.config.use_cache
 
+        if labels is not None and logits_positions is not None:
+            raise ValueError("labels can't be combined with logits_positions")
+
         if output_attentions:
             raise ValueError("output_attentions is not yet supported in OLMo")
 
@@ -114,6 +118,7 @@ class OLMoForCausalLM(PreTrainedModel, GenerationMixin):
             past_key_values=past_key_values,
             use_cache=use_cache,
             output_hidden_states=output_hidden_states,
+            logits_positions=logits_positions,
         )
 
         logits = outputs.logits
@@ -1,4 +1,5 @@
 import asyncio
+import inspect
 import json
 import os
 import time
@@ -106,6 +107,22 @@ def generate_completions(
     return generations
 
 
+def last_logits_only_kwargs(model, input_ids):
+    """
+    Keyword arguments for the forward pass of the model that skip computing logits for all but the last
+    position, if the model supports that.
+    """
+    parameters = inspect.signature(model.forward).parameters
+    if "logits_positions" in parameters:
+        # OLMo
+        return {"logits_positions": torch.tensor([input_ids.shape[1] - 1], device=input_ids.device)}
+    elif "logits_to_keep" in parameters:
+        return {"logits_to_keep": 1}
+    elif "num_logits_to_keep" in parameters:
+        return {"num_logits_to_keep": 1}
+    return {}
+
+
 @torch.no_grad()
 def get_next_word_predictions(
     model,
@@ -132,7 +149,9 @@ def get_next_word_predictions(
             batch_input_ids = batch_input_ids.cuda()
             attention_mask = attention_mask.cuda()
 
-        batch_logits = model(batch_input_ids, attention_mask).logits[:, -1, :]
+        batch_logits = model(
+            batch_input_ids, attention_mask, **last_logits_only_kwargs(model, batch_input_ids)
+        ).logits[:, -1, :]
         if candidate_token_ids is not None:
             batch_logits = batch_logits[:, candidate_token_ids]
         batch_probs = torch.softmax(batch_logits, dim=-1)
@@ -28,7 +28,7 @@ from torch.distributed._shard.sharded_tensor import ShardedTensor
 from torch.distributed.checkpoint.filesystem import WriteResult, _StorageInfo
 from torch.distributed.checkpoint.metadata import Metadata, MetadataIndex
 from torch.distributed.checkpoint.optimizer import load_sharded_optimizer_state_dict
-from torch.distributed.checkpoint.planner import LoadItemType, ReadItem
+from torch.distributed.checkpoint.planner import LoadItemType
 from torch.distributed.fsdp import FullyShardedDataParallel as FSDP
 from torch.distributed.fsdp import StateDictType
 from torch.distributed.fsdp.api import (
@@ -66,7 +66,7 @@ from .util import (
     _get_s3_client,
     default_thread_count,
     dir_is_empty,
-    get_bytes_range,
+    get_bytes_ranges_multi,
     get_progress_bar,
     resource_path,
     upload,
@@ -425,16 +425,11 @@ class RemoteFileSystemReader(dist_cp.StorageReader):
         self.storage_data: Dict[MetadataIndex, _StorageInfo] = dict()
         self._metadata: Optional[Metadata] = None
 
-    def _get_bytes(self, relative_path: str, offset: int, length: int) -> bytes:
+    def _get_source(self, relative_path: str) -> PathOrStr:
         if self.cache is not None and (path := self.cache / relative_path).is_file():
-            return get_bytes_range(path, offset, length)
+            return path
         else:
-            return get_bytes_range(f"{self.path}/{relative_path}", offset, length)
-
-    def _get_content_for_read(self, read_item: ReadItem) -> Tuple[ReadItem, bytes]:
-        sinfo = self.storage_data[read_item.storage_index]
-        content = self._get_bytes(sinfo.relative_path, sinfo.offset, sinfo.length)
-        return (read_item, content)
+            return f"{self.path}/{relative_path}"
 
     def read_data(self, plan: dist_cp.LoadPlan, planner: dist_cp.LoadPlanner) -> Future[None]:
         # Create the global S3 client up front to work around a threading issue in boto.
@@ -446,19 +441,18 @@ class RemoteFileSystemReader(dist_cp.StorageReader):
             elif self.path.startswith("weka://"):
                 _get_s3_client("weka")
 
-        with ThreadPoolExecutor(max_workers=self.thread_count) as executor:
-            read_item_content_futures = []
-            for read_item in plan.items:
-                read_item_content_futures.append(executor.submit(self._get_content_for_read, read_item))
-            read_item_content_results = []
-            for f in as_completed(read_item_content_futures):
-                try:
-                    read_item_content_results.append(f.result())
-                except BaseException:
-                    # NOTE: we might get an error here that can't be pickled, which causes a different failure
-                    # later when PyTorch tries to reduce that error across ranks. So here we just make
-                    # sure we're raising a simple error type that can be pickled.
-                    raise OLMoCheckpointError(f"Original error:\n{traceback.format_exc()}")
+        requests = []
+        for read_item in plan.items:
+            sinfo = self.storage_data[read_item.storage_index]
+            requests.append((self._get_source(sinfo.relative_path), sinfo.offset, sinfo.length))
+        try:
+            contents = get_bytes_ranges_multi(requests, num_threads=self.thread_count)
+        except BaseException:
+            # NOTE: we might get an error here that can't be pickled, which causes a different failure
+            # later when PyTorch tries to reduce that error across ranks. So here we just make
+            # sure we're raising a simple error type that can be pickled.
+            raise OLMoCheckpointError(f"Original error:\n{traceback.format_exc()}")
+        read_item_content_results = list(zip(plan.items, contents))
 
         # Modified from `FileSystemReader.read_data()`
         for read_item, content in read_item_content_results:
@@ -41,10 +41,12 @@ __all__ = [
     "SchedulerConfig",
     "DataConfig",
     "InstanceFilterConfig",
+    "BlockCacheConfig",
     "EvaluatorConfig",
     "TokenizerConfig",
     "TrainConfig",
     "PaddingDirection",
+    "ShuffleMode",
     "TruncationDirection",
     "SpeedMonitorConfig",
     "WandbConfig",
@@ -598,11 +600,96 @@ class PaddingDirection(StrEnum):
     left = "left"
 
 
+class ShuffleMode(StrEnum):
+    global_indices = "global_indices"
+    """
+    Shuffle all instances up front and save the order to a file in the save folder, which all ranks read from.
+    """
+
+    feistel = "feistel"
+    """
+    Compute the shuffled order on the fly with a keyed pseudo-random permutation. Nothing is written to disk
+    and no synchronization is needed, so this is just as fast for any dataset size.
+    Note that this gives a different order than ``global_indices`` for the same seed.
+    """
+
+    block = "block"
+    """
+    Like ``feistel``, but shuffle in two levels to keep reads local: first the order of blocks of
+    ``data.shuffle_block_size`` consecutive instances, then the instances within each window of
+    ``data.shuffle_buffer_size`` positions of that block order. Consecutive instances are usually
+    next to each other in the same data file, so each window only reads from a few contiguous
+    regions of the data, which works well with read-ahead and ``data.block_cache``.
+    The order is less random than with the other modes, since instances that are far apart
+    in the data can never end up close together in the order.
+    """
+
+
 @dataclass
 class InstanceFilterConfig(BaseConfig):
     repetition_max_period: int = 13
     repetition_min_period: int = 1
     repetition_max_count: int = 32
+    precomputed: bool = False
+    """
+    If ``True``, read which instances fail the filter from the bitmaps written next to each data file by
+    ``scripts/build_instance_filter_masks.py`` instead of checking every instance while training.
+    """
+
+
+@dataclass
+class BlockCacheConfig(BaseConfig):
+    """
+    Configuration for a local on-disk cache of blocks of remote data files.
+    """
+
+    dir: str
+    """
+    The local directory to cache blocks in. This can be shared by all processes on a node.
+    """
+
+    max_size_gb: float = 100.0
+    """
+    The maximum total size of the cache. Least recently used blocks are evicted beyond this.
+    """
+
+    block_size: int = 1024 * 1024
+    """
+    The size of each block in bytes.
+    """
+
+    read_ahead: int = 2
+    """
+    The number of subsequent blocks to download in the background after each read.
+    """
+
+    num_threads: int = 8
+    """
+    The number of background download threads per process.
+    """
+
+
+@dataclass
+class BatchCacheConfig(BaseConfig):
+    """
+    Configuration for recording the collated training batches of a range of steps to local files,
+    and replaying them in later runs with the same data order instead of loading them again.
+    """
+
+    dir: str
+    """
+    The local directory for the recorded batches. Each rank reads and writes its own files.
+    """
+
+    start_batch: int = 0
+    """
+    The first batch of each epoch to record, counting from 0.
+    """
+
+    num_batches: Optional[int] = None
+    """
+    The number of batches to record. By default the rest of the epoch is recorded.
+    """
 
 
 @dataclass
@@ -610,18 +697,68 @@ class DataConfig(BaseConfig):
     paths: Optional[List[str]] = None
     memmap_dtype: str = "uint16"
     datasets: Optional[Dict[str, List[str]]] = None
+    dataset_weights: Optional[Dict[str, float]] = None
+    """
+    Sampling weights for the sources in ``datasets``, by label. Each epoch covers ``round(weight * n)``
+    instances of a source with ``n`` instances, so a weight of 2 repeats a source twice and 0.5 samples
+    a random half of it. Sources without a weight get a weight of 1.
+    """
     label_mask_paths: Optional[List[str]] = None
+    manifest: Optional[str] = None
+    """
+    A dataset manifest from ``scripts/build_dataset_manifest.py`` with the sizes of all of the files in
+    ``paths``, ``datasets``, and ``label_mask_paths``, so that they don't have to be checked one by one.
+    """
     pad_direction: PaddingDirection = PaddingDirection.right
     generate_attention_mask: bool = False
     generate_doc_lengths: bool = False
+    use_document_index: bool = False
+    """
+    If ``True``, ``doc_lens`` are computed from the indices of EOS offsets written next to each data file by
+    ``scripts/prepare_memmap_dataset.py`` or ``scripts/build_document_indices.py`` instead of by scanning
+    every instance. Only used with ``generate_doc_lengths``.
+    """
+    pack_documents: bool = False
+    """
+    If ``True``, instances are made up of whole documents packed together, as listed by the packed indices
+    written next to each data file by ``scripts/build_packed_indices.py``, instead of fixed chunks of tokens.
+    """
     num_workers: int = 0
     drop_last: bool = False
     pin_memory: bool = False
     prefetch_factor: Optional[int] = None
     persistent_workers: bool = False
+    adaptive_threads: bool = False
+    """
+    If ``True``, the number of threads that fetch training instances within each data loading process
+    is adjusted as training goes, between 1 and ``max_threads``, to keep up with the trainer.
+    """
+    max_threads: int = 16
+    shared_memory_batches: bool = False
+    """
+    If ``True``, training batches are passed from data loader workers to the trainer through slots in shared
+    memory that are allocated once, instead of being pickled one at a time. Only used with ``num_workers > 0``.
+    Batches are then never in pinned memory, regardless of ``pin_memory``.
+    """
     timeout: int = 0
     seed: Optional[int] = None
+    shuffle_mode: ShuffleMode = ShuffleMode.global_indices
+    shuffle_block_size: int = 256
+    """
+    The number of consecutive instances that stay together with ``shuffle_mode=block``.
+    """
+    shuffle_buffer_size: int = 16384
+    """
+    The number of instances that are shuffled together with ``shuffle_mode=block``. The data for this
+    many instances should fit in ``data.block_cache`` to avoid downloading the same blocks more than once.
+    """
     instance_filter: Optional[InstanceFilterConfig] = None
+    block_cache: Optional[BlockCacheConfig] = None
+    batch_cache: Optional[BatchCacheConfig] = None
+    """
+    Record the training batches of a range of steps to local files, or replay them if they've already been
+    recorded by a run with the same data config, seed, and batch size. See :mod:`olmo.data.batch_cache`.
+    """
     custom_dataset: Optional[CustomDatasetConfig] = None
 
     @property
@@ -675,6 +812,12 @@ class EvaluatorConfig(BaseConfig):
     data: DataConfig = field(default_factory=DataConfig)
     device_eval_batch_size: Optional[int] = None
     subset_num_batches: Optional[int] = None
+    share_context: bool = False
+    """
+    For multiple-choice downstream evaluators, run the context of each document once and score all of its
+    continuations against its cached keys and values, instead of running the full context again for each
+    continuation. Metrics stay the same up to numerical noise.
+    """
 
 
 class TruncationDirection(StrEnum):
@@ -1301,6 +1444,13 @@ class TrainConfig(BaseConfig):
     Whether to use the fused CE loss function from `flash-attn`.
     """
 
+    loss_chunk_size: Optional[int] = None
+    """
+    If set, compute the CE loss and z-loss together with the output projection of the model, this many
+    positions at a time, so that the logits of the whole micro-batch are never materialized.
+    This works on any device, and can't be combined with `fused_loss`.
+    """
+
     hf_datasets_cache_dir: Optional[str] = None
     """
     Deprecated, HF datasets are now stored in `olmo_data.hf_datasets`.
@@ -9,18 +9,41 @@ from ..aliases import PathOrStr
 from ..config import DataConfig, TrainConfig
 from ..exceptions import OLMoConfigurationError
 from ..torch_util import barrier, get_global_rank, get_world_size
+from .batch_cache import BatchCache, BatchCacheDataLoader
+from .block_cache import BlockCache
 from .collator import CustomDatasetDataCollator, DataCollator
 from .custom_datasets import build_custom_dataset, extract_module_and_class
 from .iterable_dataset import IterableDataset
+from .manifest import DatasetManifest
 from .memmap_dataset import MemMapDataset
+from .mixture_dataset import MixtureDataset
+from .packed_dataset import PackedMemMapDataset
+from .shared_memory import SharedMemoryBatchRing, SharedMemoryDataLoader
 
-__all__ = ["MemMapDataset", "DataCollator", "IterableDataset", "build_eval_dataloader", "build_train_dataloader"]
+__all__ = [
+    "MemMapDataset",
+    "MixtureDataset",
+    "PackedMemMapDataset",
+    "BlockCache",
+    "BatchCache",
+    "BatchCacheDataLoader",
+    "DatasetManifest",
+    "DataCollator",
+    "IterableDataset",
+    "SharedMemoryBatchRing",
+    "SharedMemoryDataLoader",
+    "build_eval_dataloader",
+    "build_train_dataloader",
+]
 
 LOGGER = logging.getLogger(__name__)
 
 
 def build_memmap_dataset(
-    train_config: TrainConfig, data_config: DataConfig, include_instance_metadata: bool = True
+    train_config: TrainConfig,
+    data_config: DataConfig,
+    include_instance_metadata: bool = True,
+    include_source_ids: bool = False,
 ) -> MemMapDataset:
     paths: List[str]
     metadata: List[Dict[str, Any]] = []
@@ -38,18 +61,40 @@ def build_memmap_dataset(
             metadata.extend([{"label": label}] * len(label_paths))
     else:
         raise OLMoConfigurationError("One of DataConfig.paths or DataConfig.datasets is required")
+    if data_config.pack_documents:
+        return PackedMemMapDataset(
+            *paths,
+            chunk_size=train_config.model.max_sequence_length,
+            memmap_dtype=data_config.effective_memmap_dtype,
+            metadata=metadata,
+            include_instance_metadata=include_instance_metadata,
+            include_source_ids=include_source_ids,
+            pad_token_id=train_config.model.pad_token_id,
+            eos_token_id=train_config.model.eos_token_id,
+            generate_attention_mask=data_config.generate_attention_mask,
+            generate_doc_lengths=data_config.generate_doc_lengths,
+            label_mask_paths=cast(Optional[List[PathOrStr]], data_config.label_mask_paths),
+            instance_filter_config=data_config.instance_filter,
+            block_cache=None
+            if data_config.block_cache is None
+            else BlockCache.from_config(data_config.block_cache),
+        )
     return MemMapDataset(
         *paths,
         chunk_size=train_config.model.max_sequence_length,
         memmap_dtype=data_config.effective_memmap_dtype,
         metadata=metadata,
         include_instance_metadata=include_instance_metadata,
+        include_source_ids=include_source_ids,
         pad_token_id=train_config.model.pad_token_id,
         eos_token_id=train_config.model.eos_token_id,
         generate_attention_mask=data_config.generate_attention_mask,
         generate_doc_lengths=data_config.generate_doc_lengths,
+        use_document_index=data_config.use_document_index,
+        manifest=None if data_config.manifest is None else DatasetManifest.load(data_config.manifest),
         label_mask_paths=cast(Optional[List[PathOrStr]], data_config.label_mask_paths),
         instance_filter_config=data_config.instance_filter,
+        block_cache=None if data_config.block_cache is None else BlockCache.from_config(data_config.block_cache),
     )
 
 
@@ -84,9 +129,7 @@ def build_collator(train_config: TrainConfig) -> DataCollator:
             **train_config.data.custom_dataset.collate_config.asdict(),  # type: ignore
         )
     else:
-        return DataCollator(
-            pad_direction=train_config.data.pad_direction, pad_token_id=train_config.model.pad_token_id
-        )
+        return DataCollator.from_train_config(train_config)
 
 
 def build_eval_dataloader(
@@ -95,7 +138,10 @@ def build_eval_dataloader(
     batch_size: int,
     shuffle: bool = True,
 ) -> DataLoader:
-    dataset = build_memmap_dataset(train_config, data_config, include_instance_metadata=True)
+    # Instances only carry the ID of their source, the evaluator looks up the labels in the metadata table.
+    dataset = build_memmap_dataset(
+        train_config, data_config, include_instance_metadata=False, include_source_ids=True
+    )
     collator = DataCollator(pad_direction=data_config.pad_direction, pad_token_id=train_config.model.pad_token_id)
     if data_config.drop_last:
         # Make sure batch size is small enough.
@@ -142,8 +188,12 @@ def build_train_dataloader(
             )
         dataset = build_custom_dataset(train_config)
     else:
-        dataset = build_memmap_dataset(
-            train_config, train_config.data, include_instance_metadata=include_instance_metadata
+        dataset = MixtureDataset.from_data_config(
+            build_memmap_dataset(
+                train_config, train_config.data, include_instance_metadata=include_instance_metadata
+            ),
+            train_config.data,
+            seed=seed,
         )
     work_dir = Path(train_config.save_folder) / "train_data"
     if get_global_rank() == 0:
@@ -164,10 +214,14 @@ def build_train_dataloader(
         rank=rank,
         fs_local_rank=fs_local_rank,
         work_dir=work_dir,
+        shuffle_mode=train_config.data.shuffle_mode,
+        shuffle_block_size=train_config.data.shuffle_block_size,
+        shuffle_buffer_size=train_config.data.shuffle_buffer_size,
+        adaptive_threads=train_config.data.adaptive_threads,
+        max_threads=train_config.data.max_threads,
     )
     barrier()
-    out = DataLoader(
-        dataset,
+    kwargs: Dict[str, Any] = dict(
         batch_size=train_config.device_train_batch_size,
         drop_last=train_config.data.drop_last,
         collate_fn=collator,
@@ -177,4 +231,14 @@ def build_train_dataloader(
         persistent_workers=False if train_config.data.num_workers == 0 else train_config.data.persistent_workers,
         timeout=train_config.data.timeout,
     )
-    return out
+    if train_config.data.batch_cache is not None:
+        if train_config.data.shared_memory_batches:
+            raise OLMoConfigurationError(
+                "DataConfig.batch_cache can't be used together with DataConfig.shared_memory_batches"
+            )
+        return BatchCacheDataLoader(dataset, cache=BatchCache.from_train_config(train_config), **kwargs)
+    if train_config.data.shared_memory_batches and train_config.data.num_workers > 0:
+        return SharedMemoryDataLoader(
+            dataset, ring=SharedMemoryBatchRing.from_train_config(train_config), **kwargs
+        )
+    return DataLoader(dataset, **kwargs)
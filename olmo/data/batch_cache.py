@@ -0,0 +1,289 @@
+"""
+Recording and replaying training batches.
+
+Ablations often train on exactly the same data order as an earlier run, and each of them pays the full
+cost of reading, filtering, and collating it again. With ``data.batch_cache``, the first run writes the
+collated batches of a range of steps to a single local file per rank, along with an index of where each
+batch starts. Later runs whose data config, seed, and batch size have the same fingerprint read their
+batches straight from that memory-mapped file instead, starting from any step, and only go back to loading
+data the normal way after the recorded range.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+
+from ..aliases import PathOrStr
+from ..config import TrainConfig
+from .iterable_dataset import IterableDataset
+
+__all__ = ["BatchCache", "BatchCacheReader", "BatchCacheWriter", "BatchCacheDataLoader"]
+
+log = logging.getLogger(__name__)
+
+# Data config fields that change how batches are loaded, but not what's in them.
+_LOADER_FIELDS = (
+    "num_workers",
+    "pin_memory",
+    "prefetch_factor",
+    "persistent_workers",
+    "adaptive_threads",
+    "max_threads",
+    "shared_memory_batches",
+    "timeout",
+    "manifest",
+    "block_cache",
+    "batch_cache",
+)
+
+# The alignment of each tensor in the batches file.
+_ALIGNMENT = 64
+
+
+def _dtype_name(dtype: torch.dtype) -> str:
+    return str(dtype).replace("torch.", "")
+
+
+class BatchCacheWriter:
+    """
+    Writes the batches for consecutive steps to a batches file and its index. Nothing is visible under
+    the final paths until :meth:`close()`, which keeps whatever has been written.
+    """
+
+    def __init__(self, path: Path, header: Dict[str, Any]):
+        self.path = path
+        self.header = header
+        self.batches: List[Dict[str, Any]] = []
+        self._offset = 0
+        self._file: BinaryIO = open(self._tmp_path, "wb")
+
+    @property
+    def _tmp_path(self) -> Path:
+        return self.path.with_suffix(f".batches.tmp{os.getpid()}")
+
+    def write(self, batch: Dict[str, Any]):
+        """
+        Append a batch. Tensors are written as they are, all other values have to be JSON-serializable.
+        """
+        tensors: Dict[str, Dict[str, Any]] = {}
+        extras: Dict[str, Any] = {}
+        for name, value in batch.items():
+            if not isinstance(value, torch.Tensor):
+                extras[name] = value
+                continue
+            data = value.detach().cpu().contiguous().view(-1).view(torch.uint8).numpy()
+            tensors[name] = {"offset": self._offset, "dtype": _dtype_name(value.dtype), "shape": list(value.shape)}
+            self._file.write(data.tobytes())
+            padding = -len(data) % _ALIGNMENT
+            self._file.write(b"\0" * padding)
+            self._offset += len(data) + padding
+        # Fail here, rather than when the index is saved.
+        json.dumps(extras)
+        self.batches.append({"tensors": tensors, "extras": extras})
+
+    def close(self):
+        self._file.close()
+        if not self.batches:
+            os.remove(self._tmp_path)
+            return
+        os.replace(self._tmp_path, self.path.with_suffix(".batches"))
+        index_tmp_path = self.path.with_suffix(f".json.tmp{os.getpid()}")
+        with open(index_tmp_path, "w") as f:
+            json.dump({**self.header, "batches": self.batches}, f)
+        os.replace(index_tmp_path, self.path.with_suffix(".json"))
+
+    def discard(self):
+        self._file.close()
+        os.remove(self._tmp_path)
+
+
+class BatchCacheReader:
+    """
+    Reads recorded batches by their index within the epoch.
+    """
+
+    def __init__(self, path: Path):
+        with open(path.with_suffix(".json")) as f:
+            index = json.load(f)
+        self.header = {key: value for key, value in index.items() if key != "batches"}
+        self.batches: List[Dict[str, Any]] = index["batches"]
+        self.start_batch: int = index["start_batch"]
+        # Copy-on-write, so that tensors can be made from it without copying and without warnings.
+        self._data = np.memmap(path.with_suffix(".batches"), dtype=np.uint8, mode="c")
+
+    @property
+    def end_batch(self) -> int:
+        return self.start_batch + len(self.batches)
+
+    def __contains__(self, batch_index: int) -> bool:
+        return self.start_batch <= batch_index < self.end_batch
+
+    def __getitem__(self, batch_index: int) -> Dict[str, Any]:
+        if batch_index not in self:
+            raise IndexError(
+                f"Batch {batch_index} isn't in the recorded range [{self.start_batch}, {self.end_batch})"
+            )
+        entry = self.batches[batch_index - self.start_batch]
+        batch: Dict[str, Any] = {}
+        for name, tensor in entry["tensors"].items():
+            dtype = getattr(torch, tensor["dtype"])
+            num_bytes = int(np.prod(tensor["shape"], dtype=np.int64)) * torch.empty(0, dtype=dtype).element_size()
+            data = torch.from_numpy(self._data[tensor["offset"] : tensor["offset"] + num_bytes])
+            batch[name] = data.view(dtype).view(tensor["shape"])
+        batch.update(entry["extras"])
+        return batch
+
+
+class BatchCache:
+    """
+    The recorded batches of a training data config, in one pair of files per epoch and rank: the batches
+    file with the raw tensors of all batches back to back, and a JSON index with the offset, dtype, and shape
+    of each of them. The files are named after a fingerprint of everything that determines the batches,
+    so runs with a different data order never see each other's files.
+
+    :param dir: The directory of the files.
+    :param fingerprint: The fingerprint of the config, see :meth:`from_train_config()`.
+    :param start_batch: The first batch of each epoch to record.
+    :param num_batches: The number of batches to record, or ``None`` for the rest of the epoch.
+    """
+
+    def __init__(self, dir: PathOrStr, fingerprint: str, start_batch: int = 0, num_batches: Optional[int] = None):
+        self.dir = Path(dir)
+        self.fingerprint = fingerprint
+        self.start_batch = start_batch
+        self.num_batches = num_batches
+
+    @classmethod
+    def from_train_config(cls, train_config: TrainConfig) -> BatchCache:
+        config = train_config.data.batch_cache
+        assert config is not None
+        return cls(
+            config.dir,
+            fingerprint(train_config),
+            start_batch=config.start_batch,
+            num_batches=config.num_batches,
+        )
+
+    @property
+    def end_batch(self) -> Optional[int]:
+        return None if self.num_batches is None else self.start_batch + self.num_batches
+
+    def path(self, epoch: int, rank: int, world_size: int) -> Path:
+        """
+        The path of the files for an epoch and rank, without their suffix.
+        """
+        return self.dir / f"{self.fingerprint}-epoch{epoch}-rank{rank}of{world_size}"
+
+    def open(self, epoch: int, rank: int, world_size: int) -> Optional[BatchCacheReader]:
+        path = self.path(epoch, rank, world_size)
+        if not path.with_suffix(".json").is_file():
+            return None
+        return BatchCacheReader(path)
+
+    def writer(self, epoch: int, rank: int, world_size: int) -> BatchCacheWriter:
+        self.dir.mkdir(parents=True, exist_ok=True)
+        header = {
+            "fingerprint": self.fingerprint,
+            "epoch": epoch,
+            "rank": rank,
+            "world_size": world_size,
+            "start_batch": self.start_batch,
+        }
+        return BatchCacheWriter(self.path(epoch, rank, world_size), header)
+
+
+def fingerprint(train_config: TrainConfig) -> str:
+    """
+    A fingerprint of the parts of a config that determine the training batches of each epoch and rank.
+    """
+    assert train_config.device_train_batch_size is not None
+    key = {
+        "data": train_config.data.asdict(exclude=_LOADER_FIELDS),
+        "seed": train_config.seed,
+        "global_train_batch_size": train_config.global_train_batch_size,
+        "device_train_batch_size": train_config.device_train_batch_size,
+        "max_sequence_length": train_config.model.max_sequence_length,
+        "pad_token_id": train_config.model.pad_token_id,
+        "eos_token_id": train_config.model.eos_token_id,
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+class BatchCacheDataLoader(DataLoader):
+    """
+    A :class:`~torch.utils.data.DataLoader` over an :class:`~olmo.data.iterable_dataset.IterableDataset`
+    that replays batches from a :class:`BatchCache` when they've been recorded for the current epoch and
+    ``start_index`` of the dataset, and otherwise loads them as usual and records the configured range.
+
+    :param cache: The recorded batches.
+
+    All other arguments are passed to :class:`~torch.utils.data.DataLoader`.
+    """
+
+    def __init__(self, dataset: IterableDataset, *args, cache: BatchCache, **kwargs):
+        super().__init__(dataset, *args, **kwargs)
+        self.cache = cache
+
+    def __iter__(self) -> Iterator[Any]:  # type: ignore[override]
+        dataset = self.dataset
+        assert isinstance(dataset, IterableDataset)
+        global_batch_size = dataset.device_batch_size * dataset.world_size
+        batch_index = dataset.start_index // global_batch_size
+        key = (dataset.epoch, dataset.rank, dataset.world_size)
+
+        reader = self.cache.open(*key)
+        if reader is not None and batch_index in reader:
+            log.info(f"Replaying batches {batch_index:,d} to {reader.end_batch:,d} from '{self.cache.path(*key)}'")
+            return self._replay(reader, batch_index, global_batch_size)
+
+        writer: Optional[BatchCacheWriter] = None
+        if reader is None and batch_index <= self.cache.start_batch:
+            log.info(f"Recording batches from {self.cache.start_batch:,d} to '{self.cache.path(*key)}'")
+            writer = self.cache.writer(*key)
+        return self._record(super().__iter__(), writer, batch_index)
+
+    def _replay(self, reader: BatchCacheReader, batch_index: int, global_batch_size: int) -> Iterator[Any]:
+        for i in range(batch_index, reader.end_batch):
+            yield reader[i]
+
+        # Load the rest of the epoch as usual.
+        dataset = self.dataset
+        assert isinstance(dataset, IterableDataset)
+        start_index = dataset.start_index
+        dataset.start_index = reader.end_batch * global_batch_size
+        try:
+            batches = super().__iter__()
+        finally:
+            dataset.start_index = start_index
+        yield from batches
+
+    def _record(
+        self, batches: Iterator[Any], writer: Optional[BatchCacheWriter], batch_index: int
+    ) -> Iterator[Any]:
+        end_batch = self.cache.end_batch
+        try:
+            for batch in batches:
+                if writer is not None and batch_index >= self.cache.start_batch:
+                    try:
+                        writer.write(batch)
+                    except (TypeError, ValueError) as e:
+                        log.warning(f"Not recording batches, since they can't be written: {e}")
+                        writer.discard()
+                        writer = None
+                if writer is not None and end_batch is not None and batch_index + 1 >= end_batch:
+                    writer.close()
+                    writer = None
+                batch_index += 1
+                yield batch
+        finally:
+            if writer is not None:
+                writer.close()
@@ -0,0 +1,432 @@
+"""
+Measuring the throughput of the training data path.
+
+:func:`instrument_data_loader()` times the stages of loading each batch of a data loader from
+:func:`~olmo.data.build_train_dataloader()`, and :func:`benchmark_data_loader()` reads batches from it and
+summarizes the results. :class:`LocalObjectStore` serves local files over HTTP, including S3 requests,
+with added latency, so that remote storage can be benchmarked on a single machine.
+Use ``scripts/benchmark_dataloader.py`` to run these over a matrix of settings.
+"""
+
+from __future__ import annotations
+
+import email.utils
+import os
+import random
+import re
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Sequence
+from urllib.parse import unquote, urlparse
+
+import numpy as np
+from torch.utils.data import DataLoader
+
+from ..aliases import PathOrStr
+from .memmap_dataset import MemMapDataset
+from .mixture_dataset import MixtureDataset
+from .shared_memory import _SharedMemoryCollator
+
+__all__ = [
+    "STAGES",
+    "LocalObjectStore",
+    "BenchmarkResult",
+    "instrument_data_loader",
+    "benchmark_data_loader",
+]
+
+#: The stages of loading a batch that are timed:
+#:
+#: - ``index``: mapping instance indices to files and offsets.
+#: - ``read``: reading tokens from storage.
+#: - ``filter``: checking instances against the instance filter.
+#: - ``collate``: collating instances into a batch.
+#: - ``ipc``: from the end of collating a batch to receiving it in the main process, including the time
+#:   it spends queued behind other batches.
+#: - ``wait``: how long the main process waits for each batch.
+STAGES = ("index", "read", "filter", "collate", "ipc", "wait")
+
+# The key that timings are added to batches under.
+_BENCHMARK_KEY = "benchmark"
+
+# The time spent in each stage in this process since the last batch was collated.
+_stage_times: Dict[str, float] = defaultdict(float)
+_stage_times_lock = threading.Lock()
+
+
+def _record_stage_time(stage: str, seconds: float):
+    with _stage_times_lock:
+        _stage_times[stage] += seconds
+
+
+def _drain_stage_times() -> Dict[str, float]:
+    with _stage_times_lock:
+        times = dict(_stage_times)
+        _stage_times.clear()
+    return times
+
+
+class _TimedMethod:
+    def __init__(self, stage: str, fn: Callable):
+        self.stage = stage
+        self.fn = fn
+
+    def __call__(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self.fn(*args, **kwargs)
+        finally:
+            _record_stage_time(self.stage, time.perf_counter() - start)
+
+
+class _TimedCollator:
+    def __init__(self, collate_fn: Callable[[List[Any]], Dict[str, Any]]):
+        self.collate_fn = collate_fn
+
+    def __call__(self, items: List[Any]) -> Dict[str, Any]:
+        start = time.perf_counter()
+        batch = self.collate_fn(items)
+        _record_stage_time("collate", time.perf_counter() - start)
+        # Stages that ran in background threads are attributed to whichever batch is collated next.
+        batch[_BENCHMARK_KEY] = {"stage_times": _drain_stage_times(), "collated_at": time.time()}
+        return batch
+
+
+def instrument_data_loader(data_loader: DataLoader):
+    """
+    Time the stages of loading each batch from a data loader built by
+    :func:`~olmo.data.build_train_dataloader()`. This has to be called before iterating over it.
+
+    Each batch gets an extra ``"benchmark"`` field with the times, which :func:`benchmark_data_loader()`
+    removes again. Stages that are spread over several threads are counted once per thread.
+    """
+    collator = data_loader.collate_fn
+    if isinstance(collator, _SharedMemoryCollator):
+        collator.collate_fn = _TimedCollator(collator.collate_fn)
+    else:
+        data_loader.collate_fn = _TimedCollator(collator)
+
+    dataset: Any = data_loader.dataset
+    while dataset is not None:
+        timed_methods: Dict[str, str] = {}
+        if isinstance(dataset, MixtureDataset):
+            timed_methods = {"get_dataset_indices": "index"}
+        elif isinstance(dataset, MemMapDataset):
+            timed_methods = {
+                "get_memmap_indices": "index",
+                "_read_many_chunks_from_memmaps": "read",
+                "_read_ranges": "read",
+                "_validate_instances": "filter",
+                "_read_instance_masks": "filter",
+            }
+        for name, stage in timed_methods.items():
+            method = getattr(dataset, name, None)
+            if method is not None and not isinstance(method, _TimedMethod):
+                setattr(dataset, name, _TimedMethod(stage, method))
+        dataset = getattr(dataset, "dataset", None)
+
+
+@dataclass
+class BenchmarkResult:
+    num_batches: int
+    num_instances: int
+    num_bytes: int
+    """The number of bytes of tokens in all batches, in the dtype they're stored as."""
+
+    seconds: float
+    """The time from starting to iterate to receiving the last batch."""
+
+    seconds_to_first_batch: float
+    cpu_seconds: float
+    """The CPU time of this process and its data loader workers."""
+
+    stage_seconds: Dict[str, List[float]] = field(default_factory=dict)
+    """The time spent in each stage for each batch."""
+
+    @property
+    def instances_per_second(self) -> float:
+        return self.num_instances / self.seconds
+
+    @property
+    def bytes_per_second(self) -> float:
+        return self.num_bytes / self.seconds
+
+    @property
+    def cpu_utilization(self) -> float:
+        """The average number of busy cores."""
+        return self.cpu_seconds / self.seconds
+
+    def percentiles(self, stage: str, percentiles: Sequence[float] = (50, 90, 99)) -> List[float]:
+        """
+        Percentiles of the per-batch time of a stage in seconds, counting batches where it didn't run as 0.
+        """
+        times = self.stage_seconds.get(stage, [])
+        times = times + [0.0] * (self.num_batches - len(times))
+        if not times:
+            return [0.0] * len(percentiles)
+        return np.percentile(times, percentiles).tolist()
+
+    def summary(self, percentiles: Sequence[float] = (50, 90, 99)) -> Dict[str, float]:
+        summary = {
+            "instances_per_second": self.instances_per_second,
+            "bytes_per_second": self.bytes_per_second,
+            "cpu_utilization": self.cpu_utilization,
+            "seconds_to_first_batch": self.seconds_to_first_batch,
+        }
+        for stage in STAGES:
+            for percentile, value in zip(percentiles, self.percentiles(stage, percentiles)):
+                summary[f"{stage}_p{percentile:g}_ms"] = 1000 * value
+        return summary
+
+
+def _cpu_seconds() -> float:
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def benchmark_data_loader(data_loader: DataLoader, num_batches: int, bytes_per_token: int = 2) -> BenchmarkResult:
+    """
+    Read up to ``num_batches`` batches from a data loader that's been set up with
+    :func:`instrument_data_loader()`.
+
+    Data loader workers have to be shut down at the end for their CPU time to be counted,
+    so don't use this with ``persistent_workers``.
+
+    :param data_loader: The data loader.
+    :param num_batches: The number of batches to read.
+    :param bytes_per_token: The size of each token in storage.
+    """
+    stage_seconds: Dict[str, List[float]] = defaultdict(list)
+    num_instances = 0
+    num_bytes = 0
+    num_batches_read = 0
+    seconds_to_first_batch = 0.0
+
+    start_cpu = _cpu_seconds()
+    start = time.perf_counter()
+    batches = iter(data_loader)
+    while num_batches_read < num_batches:
+        wait_start = time.perf_counter()
+        try:
+            batch = next(batches)
+        except StopIteration:
+            break
+        received = time.perf_counter()
+        if num_batches_read == 0:
+            seconds_to_first_batch = received - start
+        else:
+            stage_seconds["wait"].append(received - wait_start)
+
+        info = batch.pop(_BENCHMARK_KEY, None)
+        if info is not None:
+            stage_seconds["ipc"].append(max(time.time() - info["collated_at"], 0.0))
+            for stage, seconds in info["stage_times"].items():
+                stage_seconds[stage].append(seconds)
+        num_instances += len(batch["input_ids"])
+        num_bytes += batch["input_ids"].numel() * bytes_per_token
+        num_batches_read += 1
+    seconds = time.perf_counter() - start
+    # Shut down the workers so that their CPU time is counted.
+    del batches
+    cpu_seconds = _cpu_seconds() - start_cpu
+
+    return BenchmarkResult(
+        num_batches=num_batches_read,
+        num_instances=num_instances,
+        num_bytes=num_bytes,
+        seconds=seconds,
+        seconds_to_first_batch=seconds_to_first_batch,
+        cpu_seconds=cpu_seconds,
+        stage_seconds=dict(stage_seconds),
+    )
+
+
+class _ObjectStoreServer(ThreadingHTTPServer):
+    daemon_threads = True
+    store: LocalObjectStore
+
+
+class _ObjectStoreRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and bodies are written separately, which would otherwise add the delayed ACK timeout to each request.
+    disable_nagle_algorithm = True
+    server: _ObjectStoreServer
+
+    def do_HEAD(self):
+        self._respond(send_body=False)
+
+    def do_GET(self):
+        self._respond(send_body=True)
+
+    def _respond(self, send_body: bool):
+        store = self.server.store
+        store._delay()
+        path = store._resolve(self.path)
+        if path is None:
+            self._send_empty(404)
+            return
+
+        stat = os.stat(path)
+        size = stat.st_size
+        start, end = 0, size - 1
+        status = 200
+        range_header = self.headers.get("Range")
+        if range_header is not None:
+            match = re.fullmatch(r"bytes=(\d+)-(\d*)", range_header.strip())
+            if match is not None:
+                start = int(match[1])
+                end = min(int(match[2]), size - 1) if match[2] else size - 1
+                if start > end:
+                    self._send_empty(416)
+                    return
+                status = 206
+
+        # Count the request before responding, so that the counts are final once the client has the response.
+        store._count(end - start + 1 if send_body else 0)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", f'"{size:x}-{stat.st_mtime_ns:x}"')
+        self.send_header("Last-Modified", email.utils.formatdate(stat.st_mtime, usegmt=True))
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.end_headers()
+        if send_body:
+            with open(path, "rb") as f:
+                f.seek(start)
+                data = f.read(end - start + 1)
+            self.wfile.write(data)
+
+    def _send_empty(self, status: int):
+        self.server.store._count(0)
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format: str, *args: Any):
+        pass
+
+
+class LocalObjectStore:
+    """
+    A stand-in for remote storage that serves the files under a local directory over HTTP, with
+    ``HEAD`` requests and ``GET`` requests with byte ranges, which is all that remote
+    :class:`~olmo.data.memmap_dataset.MemMapDataset` paths need.
+
+    The same files can be read as ``http://`` URLs and as ``s3://`` URLs, where the first directory under
+    ``root`` is the bucket, once the environment from :meth:`s3_environ()` is set in the process that
+    creates the S3 client.
+
+    Use it as a context manager:
+
+    .. code-block:: python
+
+        with LocalObjectStore("/data", latency=0.02) as store:
+            dataset = MemMapDataset(store.http_url("/data/part-0.npy"))
+
+    :param root: The directory to serve.
+    :param latency: The minimum time in seconds before each request gets a response.
+    :param jitter: The maximum random time in seconds that's added to ``latency`` for each request.
+    :param host: The address to listen on.
+    :param port: The port to listen on. By default a free port is picked.
+    """
+
+    def __init__(
+        self,
+        root: PathOrStr,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        self.root = os.path.realpath(root)
+        self.latency = latency
+        self.jitter = jitter
+        self.host = host
+        self.port = port
+        self.num_requests = 0
+        self.num_bytes = 0
+        self._lock = threading.Lock()
+        self._server: Optional[_ObjectStoreServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> LocalObjectStore:
+        server = _ObjectStoreServer((self.host, self.port), _ObjectStoreRequestHandler)
+        server.store = self
+        self.port = server.server_address[1]
+        self._server = server
+        self._thread = threading.Thread(target=server.serve_forever, name="local object store", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self) -> LocalObjectStore:
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def _relative_path(self, path: PathOrStr) -> str:
+        relative_path = os.path.relpath(os.path.realpath(path), self.root)
+        if relative_path == os.curdir or relative_path.startswith(os.pardir):
+            raise ValueError(f"'{path}' isn't a file under '{self.root}'")
+        return relative_path.replace(os.sep, "/")
+
+    def http_url(self, path: PathOrStr) -> str:
+        """
+        The ``http://`` URL of a local file under ``root``.
+        """
+        return f"{self.url}/{self._relative_path(path)}"
+
+    def s3_url(self, path: PathOrStr) -> str:
+        """
+        The ``s3://`` URL of a local file in a subdirectory of ``root``.
+        """
+        relative_path = self._relative_path(path)
+        if "/" not in relative_path:
+            raise ValueError(f"'{path}' has to be in a subdirectory of '{self.root}' to be in a bucket")
+        return f"s3://{relative_path}"
+
+    def s3_environ(self) -> Dict[str, str]:
+        """
+        The environment variables that point S3 clients at this store. S3 clients are cached per process,
+        so these need to be set before the first S3 request.
+        """
+        return {
+            "AWS_ENDPOINT_URL": self.url,
+            "AWS_ACCESS_KEY_ID": "local",
+            "AWS_SECRET_ACCESS_KEY": "local",
+            "AWS_DEFAULT_REGION": "us-east-1",
+        }
+
+    def _resolve(self, request_path: str) -> Optional[str]:
+        path = os.path.realpath(os.path.join(self.root, unquote(urlparse(request_path).path).lstrip("/")))
+        if not path.startswith(self.root + os.sep) or not os.path.isfile(path):
+            return None
+        return path
+
+    def _delay(self):
+        delay = self.latency + (random.uniform(0, self.jitter) if self.jitter > 0 else 0.0)
+        if delay > 0:
+            time.sleep(delay)
+
+    def _count(self, num_bytes: int):
+        with self._lock:
+            self.num_requests += 1
+            self.num_bytes += num_bytes
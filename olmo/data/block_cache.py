@@ -0,0 +1,272 @@
+from __future__ import annotations
+
+import concurrent.futures
+import hashlib
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from ..aliases import PathOrStr
+from ..config import BlockCacheConfig
+from ..util import FileInfo, get_bytes_range, get_file_info
+
+__all__ = ["BlockCache"]
+
+log = logging.getLogger(__name__)
+
+# The fraction of 'max_size' that eviction goes down to.
+_EVICTION_LOW_WATER_MARK = 0.9
+
+
+class BlockCache:
+    """
+    A local on-disk cache for byte ranges of remote files.
+
+    Files are split into fixed-size blocks which are downloaded whole on first access and stored under
+    ``cache_dir``, keyed by the file's path and ETag, so a new version of a file never hits stale blocks.
+    The total size of the cache is kept under ``max_size`` bytes by evicting the least recently used
+    blocks, down to 90% of ``max_size`` at a time so that a full cache doesn't need to evict on every write. Blocks are written atomically, so any number of processes on the same node
+    (data loader workers, ranks, or subsequent runs) can share the same cache directory.
+
+    After a read, the next ``read_ahead`` blocks of the same file are downloaded in the background.
+    Callers that know which ranges they'll need next can also request them explicitly with :meth:`prefetch()`.
+
+    :param cache_dir: The local directory to store blocks in.
+    :param max_size: The maximum total size of the cached blocks, in bytes.
+    :param block_size: The size of each block, in bytes. Larger blocks mean fewer requests for
+        sequential access patterns, but more wasted bandwidth for random access.
+    :param read_ahead: The number of blocks to download in the background following each read.
+    :param num_threads: The number of background download threads.
+    """
+
+    def __init__(
+        self,
+        cache_dir: PathOrStr,
+        *,
+        max_size: int,
+        block_size: int = 1024 * 1024,
+        read_ahead: int = 2,
+        num_threads: int = 8,
+    ):
+        if block_size <= 0:
+            raise ValueError("'block_size' must be positive")
+        if max_size < block_size:
+            raise ValueError("'max_size' must be at least 'block_size'")
+        self.cache_dir = Path(cache_dir)
+        self.max_size = max_size
+        self.block_size = block_size
+        self.read_ahead = read_ahead
+        self.num_threads = num_threads
+        self._init_process_state()
+
+    @classmethod
+    def from_config(cls, config: BlockCacheConfig) -> BlockCache:
+        return cls(
+            config.dir,
+            max_size=int(config.max_size_gb * 1024**3),
+            block_size=config.block_size,
+            read_ahead=config.read_ahead,
+            num_threads=config.num_threads,
+        )
+
+    def _init_process_state(self):
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        self._pending: Dict[str, concurrent.futures.Future] = {}
+        self._file_infos: Dict[str, FileInfo] = {}
+        # Our running estimate of the total size of the cache. 'None' means we need to scan the directory.
+        self._cache_size: Optional[int] = None
+        self._writes_since_scan = 0
+        self._scanning = False
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # Threads, locks, and futures can't be shared with other processes.
+        return {
+            "cache_dir": self.cache_dir,
+            "max_size": self.max_size,
+            "block_size": self.block_size,
+            "read_ahead": self.read_ahead,
+            "num_threads": self.num_threads,
+        }
+
+    def __setstate__(self, state: Dict[str, Any]):
+        self.__dict__.update(state)
+        self._init_process_state()
+
+    def _check_pid(self):
+        if self._pid != os.getpid():
+            # We've been forked, so our threads don't exist here.
+            self._init_process_state()
+
+    def get_bytes_range(self, path: PathOrStr, bytes_start: int, num_bytes: int) -> bytes:
+        """
+        A drop-in replacement for :func:`olmo.util.get_bytes_range()` that goes through the cache.
+        """
+        self._check_pid()
+        info = self._get_file_info(path)
+        if num_bytes <= 0:
+            return b""
+        first_block = bytes_start // self.block_size
+        last_block = (bytes_start + num_bytes - 1) // self.block_size
+
+        parts: List[bytes] = []
+        for block_index in range(first_block, last_block + 1):
+            block_start = block_index * self.block_size
+            start = max(bytes_start, block_start) - block_start
+            end = min(bytes_start + num_bytes, block_start + self.block_size) - block_start
+            parts.append(self._read_block(path, info, block_index, start, end))
+
+        num_blocks = self._num_blocks(info)
+        for block_index in range(last_block + 1, min(last_block + 1 + self.read_ahead, num_blocks)):
+            self._prefetch_block(path, info, block_index)
+
+        return parts[0] if len(parts) == 1 else b"".join(parts)
+
+    def prefetch(self, path: PathOrStr, bytes_start: int, num_bytes: int):
+        """
+        Start downloading the blocks covering the given range in the background, if they aren't cached already.
+        """
+        self._check_pid()
+        if num_bytes <= 0:
+            return
+        info = self._get_file_info(path)
+        first_block = bytes_start // self.block_size
+        last_block = min((bytes_start + num_bytes - 1) // self.block_size, self._num_blocks(info) - 1)
+        for block_index in range(first_block, last_block + 1):
+            self._prefetch_block(path, info, block_index)
+
+    def _get_file_info(self, path: PathOrStr) -> FileInfo:
+        key = str(path)
+        info = self._file_infos.get(key)
+        if info is None:
+            info = get_file_info(path)
+            self._file_infos[key] = info
+        return info
+
+    def _num_blocks(self, info: FileInfo) -> int:
+        return (info.size + self.block_size - 1) // self.block_size
+
+    def _block_path(self, path: PathOrStr, info: FileInfo, block_index: int) -> Path:
+        key = hashlib.sha256(f"{path}\0{info.etag}\0{self.block_size}".encode()).hexdigest()[:32]
+        return self.cache_dir / f"{key}-{block_index:08d}.block"
+
+    def _read_block(self, path: PathOrStr, info: FileInfo, block_index: int, start: int, end: int) -> bytes:
+        block_path = self._block_path(path, info, block_index)
+        try:
+            with open(block_path, "rb") as f:
+                f.seek(start)
+                data = f.read(end - start)
+            # Mark the block as recently used.
+            os.utime(block_path)
+            return data
+        except FileNotFoundError:
+            pass
+
+        with self._lock:
+            future = self._pending.get(str(block_path))
+        if future is not None:
+            try:
+                return future.result()[start:end]
+            except Exception:
+                # The prefetch failed, which has been logged already, so fetch the block ourselves.
+                pass
+        return self._fetch_block(path, info, block_index, block_path)[start:end]
+
+    def _prefetch_block(self, path: PathOrStr, info: FileInfo, block_index: int):
+        block_path = self._block_path(path, info, block_index)
+        if block_path.is_file():
+            return
+        with self._lock:
+            if str(block_path) in self._pending:
+                return
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.num_threads, thread_name_prefix="block-cache"
+                )
+            future = self._executor.submit(self._fetch_block, path, info, block_index, block_path)
+            self._pending[str(block_path)] = future
+
+        def on_done(f: concurrent.futures.Future):
+            with self._lock:
+                self._pending.pop(str(block_path), None)
+            if f.exception() is not None:
+                # The block will be fetched again if it's actually needed.
+                log.warning("Failed to prefetch block %d of '%s': %s", block_index, path, f.exception())
+
+        future.add_done_callback(on_done)
+
+    def _fetch_block(self, path: PathOrStr, info: FileInfo, block_index: int, block_path: Path) -> bytes:
+        block_start = block_index * self.block_size
+        data = get_bytes_range(path, block_start, min(self.block_size, info.size - block_start))
+
+        # Write to a temporary file first so other processes never see a partial block.
+        block_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = block_path.with_name(f".{block_path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, block_path)
+
+        self._on_block_written(len(data))
+        return data
+
+    def _on_block_written(self, size: int):
+        with self._lock:
+            self._writes_since_scan += 1
+            if self._cache_size is not None:
+                self._cache_size += size
+            # Other processes may be writing to the same directory, so our estimate will drift.
+            # We rescan once in a while to correct for that.
+            scan = not self._scanning and (
+                self._cache_size is None
+                or self._cache_size > self.max_size
+                or self._writes_since_scan >= max(1, self.max_size // (16 * self.block_size))
+            )
+            if not scan:
+                return
+            self._scanning = True
+            self._writes_since_scan = 0
+
+        # Scan the directory without holding the lock, which every cache miss needs.
+        cache_size: Optional[int] = None
+        try:
+            cache_size = self._evict()
+        finally:
+            with self._lock:
+                self._cache_size = cache_size
+                self._scanning = False
+
+    def _evict(self) -> int:
+        """
+        Delete the least recently used blocks until the cache fits within its budget, if it doesn't.
+        Returns the resulting size of the cache.
+        """
+        entries = []
+        total_size = 0
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if entry.name.startswith(".") or not entry.name.endswith(".block"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total_size += stat.st_size
+
+        if total_size > self.max_size:
+            target_size = int(_EVICTION_LOW_WATER_MARK * self.max_size)
+            entries.sort()
+            for _, size, path in entries:
+                if total_size <= target_size:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    # Probably evicted by another process.
+                    pass
+                total_size -= size
+
+        return total_size
@@ -15,19 +15,125 @@ __all__ = ["DataCollator"]
 class DataCollator:
     pad_direction: PaddingDirection
     pad_token_id: int
+    pin_memory: bool = False
+    """
+    Allocate the output tensors in pinned memory. This only helps when collating in the main process,
+    since tensors coming from data loader workers are copied into shared memory anyway.
+    """
+    metadata_table: Optional[List[Dict[str, Any]]] = None
+    """
+    The :data:`~olmo.data.MemMapDataset.metadata_table` of the dataset. If set, the ``metadata`` of each
+    instance in the batch is looked up from its ``source_id``.
+    """
 
     @classmethod
     def from_train_config(cls, config: TrainConfig) -> DataCollator:
-        return cls(pad_direction=config.data.pad_direction, pad_token_id=config.model.pad_token_id)
+        return cls(
+            pad_direction=config.data.pad_direction,
+            pad_token_id=config.model.pad_token_id,
+            pin_memory=config.data.pin_memory and config.data.num_workers == 0,
+        )
 
     def __call__(self, items: Union[List[Dict[str, Any]], List[torch.Tensor]]) -> Dict[str, Any]:
         assert items
+        out = self._collate_fixed_length(items)
+        if out is None:
+            out = self._collate_padded(items)
+            if self._should_pin_memory():
+                out = {k: v.pin_memory() if isinstance(v, torch.Tensor) else v for k, v in out.items()}
+        if self.metadata_table is not None and "source_id" in out and "metadata" not in out:
+            out["metadata"] = [self.metadata_table[source_id] for source_id in out["source_id"].tolist()]
+        return out
+
+    def _should_pin_memory(self) -> bool:
+        return self.pin_memory and torch.cuda.is_available()
+
+    def _collate_fixed_length(
+        self, items: Union[List[Dict[str, Any]], List[torch.Tensor]]
+    ) -> Optional[Dict[str, Any]]:
+        """
+        A fast path for the common case where all instances are tensors of the same length, so
+        nothing needs padding. Each output tensor is allocated once and filled with one copy per instance.
+
+        Returns ``None`` if the items don't qualify, in which case :meth:`_collate_padded()` should be used.
+        """
+        all_input_ids = [x["input_ids"] if isinstance(x, dict) else x for x in items]
+        if not all(isinstance(x, torch.Tensor) and x.dim() == 1 for x in all_input_ids):
+            return None
+        seq_len = all_input_ids[0].shape[0]
+        if any(x.shape[0] != seq_len for x in all_input_ids):
+            return None
+
+        fields: Dict[str, List[Any]] = {}
+        for name in (
+            "attention_mask",
+            "attention_bias",
+            "label_mask",
+            "index",
+            "instance_mask",
+            "doc_lens",
+            "source_id",
+            "metadata",
+        ):
+            values = [x.get(name) if isinstance(x, dict) else None for x in items]
+            num_present = sum(v is not None for v in values)
+            if num_present == 0:
+                continue
+            elif num_present < len(items):
+                return None
+            fields[name] = values
+        if "attention_bias" in fields:
+            return None
+        for name in ("attention_mask", "label_mask"):
+            if name in fields and not all(
+                isinstance(v, torch.Tensor) and v.shape == (seq_len,) for v in fields[name]
+            ):
+                return None
+        if "doc_lens" in fields and not all(isinstance(v, torch.Tensor) for v in fields["doc_lens"]):
+            return None
+
+        out: Dict[str, Any] = {"input_ids": self._stack_rows(all_input_ids, torch.long)}
+        if "attention_mask" in fields:
+            out["attention_mask"] = self._stack_rows(fields["attention_mask"], torch.float)
+        if "label_mask" in fields:
+            out["label_mask"] = self._stack_rows(fields["label_mask"], torch.bool)
+        if "index" in fields:
+            out["index"] = _stack_scalars(fields["index"])
+        if "instance_mask" in fields:
+            out["instance_mask"] = _stack_scalars(fields["instance_mask"])
+        if "doc_lens" in fields:
+            all_doc_lens = fields["doc_lens"]
+            max_docs = max(len(doc_lens) for doc_lens in all_doc_lens)
+            doc_lens_out = torch.zeros(
+                (len(items), max_docs), dtype=all_doc_lens[0].dtype, pin_memory=self._should_pin_memory()
+            )
+            for i, doc_lens in enumerate(all_doc_lens):
+                doc_lens_out[i, : len(doc_lens)] = doc_lens
+            out["doc_lens"] = doc_lens_out
+            out["max_doc_lens"] = doc_lens_out.max(dim=1).values.tolist()
+        if "source_id" in fields:
+            out["source_id"] = _stack_scalars(fields["source_id"])
+        if "metadata" in fields:
+            out["metadata"] = fields["metadata"]
+        return out
+
+    def _stack_rows(self, rows: List[torch.Tensor], dtype: torch.dtype) -> torch.Tensor:
+        out = torch.empty((len(rows), rows[0].shape[0]), dtype=dtype, pin_memory=self._should_pin_memory())
+        if all(row.dtype == dtype for row in rows):
+            torch.stack(rows, out=out)
+        else:
+            for i, row in enumerate(rows):
+                out[i].copy_(row)
+        return out
+
+    def _collate_padded(self, items: Union[List[Dict[str, Any]], List[torch.Tensor]]) -> Dict[str, Any]:
         max_len = max((len(x["input_ids"] if isinstance(x, dict) else x) for x in items))
         all_input_ids = []
         all_attention_mask = []
         all_attention_bias = []
         all_label_mask = []
         all_indices = []
+        all_source_ids = []
         all_metadata = []
         all_instance_mask = []
         all_doc_lens = []
@@ -114,6 +220,11 @@ class DataCollator:
                 all_doc_lens.append(F.pad(doc_lens, doc_pad_shape, value=0))
                 all_max_doc_lens.append(int(doc_lens.max()))
 
+            # Source IDs.
+            source_id = x.get("source_id") if isinstance(x, dict) else None
+            if source_id is not None:
+                all_source_ids.append(torch.as_tensor(source_id))
+
             # Metadata.
             metadata = x.get("metadata") if isinstance(x, dict) else None
             if metadata is not None:
@@ -134,6 +245,8 @@ class DataCollator:
             out["doc_lens"] = torch.stack(all_doc_lens)
         if all_max_doc_lens:
             out["max_doc_lens"] = all_max_doc_lens
+        if all_source_ids:
+            out["source_id"] = torch.stack(all_source_ids)
         if all_metadata:
             out["metadata"] = all_metadata
 
@@ -172,3 +285,9 @@ class CustomDatasetDataCollator(DataCollator):
         if not isinstance(items[0], torch.Tensor):
             items = self._relabel_fields(items)
         return super().__call__(items)
+
+
+def _stack_scalars(values: List[Any]) -> torch.Tensor:
+    if any(isinstance(v, torch.Tensor) for v in values):
+        return torch.stack([torch.as_tensor(v) for v in values])
+    return torch.tensor(values)
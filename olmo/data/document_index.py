@@ -0,0 +1,85 @@
+"""
+Precomputed document boundaries.
+
+Generating ``doc_lens`` for an instance normally means scanning all of its tokens for EOS tokens.
+Instead, the offsets of every EOS token in a memmap array can be found once, when the array is written
+(``scripts/prepare_memmap_dataset.py``) or afterwards (``scripts/build_document_indices.py``), and saved
+next to the array as a sorted array of ``int64`` token offsets. The document lengths of any chunk
+can then be found with a binary search, see :func:`~olmo.data.util.get_document_lengths_from_offsets()`.
+
+For data where documents aren't simply separated by EOS tokens, like multi-turn SFT examples, the index can
+list the offset of the last token of each document instead.
+"""
+
+from typing import Any, Optional
+
+import numpy as np
+
+from ..aliases import PathOrStr
+from ..util import file_size, get_bytes_range, is_url
+from .util import write_array_file
+
+__all__ = [
+    "document_index_path",
+    "build_document_index",
+    "write_document_index",
+    "read_document_index",
+]
+
+#: The dtype of the EOS offsets in a document index.
+DOCUMENT_INDEX_DTYPE = np.int64
+
+
+def document_index_path(path: PathOrStr, eos_token_id: int) -> str:
+    """
+    Get the path of the document index for the memmap array at ``path``.
+    """
+    return f"{path}.docs-eos{eos_token_id}.idx"
+
+
+def build_document_index(
+    path: PathOrStr, eos_token_id: int, dtype: Any, block_size: int = 64 * 1024 * 1024
+) -> np.ndarray:
+    """
+    Find the offsets of all EOS tokens in the memmap array at ``path``, reading ``block_size`` tokens at a time.
+    """
+    item_size = np.dtype(dtype).itemsize
+    num_tokens = file_size(path) // item_size
+    local_path: Optional[str] = None
+    if not is_url(path):
+        local_path = str(path)
+    elif str(path).startswith("file://"):
+        local_path = str(path).replace("file://", "", 1)
+
+    memmap = None
+    if local_path is not None and num_tokens > 0:
+        # Trailing bytes that don't make up a whole item are left out, like in `MemMapDataset`.
+        memmap = np.memmap(local_path, dtype=dtype, mode="r", shape=(num_tokens,))
+    offsets = []
+    for start in range(0, num_tokens, block_size):
+        num_block_tokens = min(block_size, num_tokens - start)
+        if memmap is not None:
+            tokens = memmap[start : start + num_block_tokens]
+        else:
+            tokens = np.frombuffer(
+                get_bytes_range(path, start * item_size, num_block_tokens * item_size), dtype=dtype
+            )
+        offsets.append(np.flatnonzero(tokens == eos_token_id).astype(DOCUMENT_INDEX_DTYPE) + start)
+    return np.concatenate(offsets) if offsets else np.zeros(0, dtype=DOCUMENT_INDEX_DTYPE)
+
+
+def write_document_index(eos_offsets: np.ndarray, target: PathOrStr, save_overwrite: bool = False):
+    """
+    Save an index from :func:`build_document_index()` to a local or remote ``target``.
+    """
+    write_array_file(eos_offsets.astype(DOCUMENT_INDEX_DTYPE, copy=False), target, save_overwrite=save_overwrite)
+
+
+def read_document_index(path: PathOrStr) -> np.ndarray:
+    """
+    Read a whole document index written by :func:`write_document_index()`.
+    """
+    num_bytes = file_size(path)
+    if num_bytes == 0:
+        return np.zeros(0, dtype=DOCUMENT_INDEX_DTYPE)
+    return np.frombuffer(get_bytes_range(path, 0, num_bytes), dtype=DOCUMENT_INDEX_DTYPE)
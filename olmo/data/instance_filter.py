@@ -0,0 +1,128 @@
+"""
+Precomputed instance filter masks.
+
+Checking every instance against an :class:`~olmo.config.InstanceFilterConfig` while training means
+redoing the same work on every epoch and every restart. Instead, the filter can be run once over
+each memmap array ahead of time (see ``scripts/build_instance_filter_masks.py``) and the result saved
+next to the array as a bitmap with one bit per instance, which is set when the instance fails the filter.
+The name of the bitmap includes the filter parameters, the chunk size, and the dtype, so bitmaps
+built with different settings can live side by side.
+"""
+
+from typing import Any, Optional
+
+import numpy as np
+
+from ..aliases import PathOrStr
+from ..config import InstanceFilterConfig
+from ..util import file_size, get_bytes_range, is_url
+from .util import find_max_repetitions, write_array_file
+
+__all__ = [
+    "validate_instances",
+    "instance_filter_mask_path",
+    "build_instance_filter_mask",
+    "write_instance_filter_mask",
+    "read_instance_filter_mask",
+    "instances_failed",
+]
+
+
+def validate_instances(input_ids: np.ndarray, config: InstanceFilterConfig) -> np.ndarray:
+    """
+    Check a ``(batch_size, seq_len)`` array of token IDs against the filter, returning
+    a boolean array that's ``False`` for instances that should be filtered out.
+    """
+    # Check for too many repeated ngrams.
+    # TODO: update `max_period` per Luca's suggestion.
+    max_repetitions = find_max_repetitions(
+        input_ids,
+        max_period=config.repetition_max_period,
+        min_period=config.repetition_min_period,
+    )
+    return (max_repetitions == 0) | (max_repetitions < config.repetition_max_count)
+
+
+def instance_filter_mask_path(path: PathOrStr, config: InstanceFilterConfig, chunk_size: int, dtype: Any) -> str:
+    """
+    Get the path of the filter bitmap for the memmap array at ``path``.
+    """
+    key = (
+        f"rep-p{config.repetition_min_period}-{config.repetition_max_period}"
+        f"-n{config.repetition_max_count}-c{chunk_size}-{np.dtype(dtype).name}"
+    )
+    return f"{path}.filter-{key}.bits"
+
+
+def _num_bitmap_bytes(num_instances: int) -> int:
+    return (num_instances + 7) // 8
+
+
+def build_instance_filter_mask(
+    path: PathOrStr,
+    config: InstanceFilterConfig,
+    chunk_size: int,
+    dtype: Any,
+    batch_size: int = 256,
+) -> np.ndarray:
+    """
+    Run the filter over every instance of the memmap array at ``path``.
+
+    :returns: The packed bitmap, with the bit for each instance that fails the filter set.
+    """
+    item_size = np.dtype(dtype).itemsize
+    num_instances = file_size(path) // (item_size * chunk_size)
+    local_path: Optional[str] = None
+    if not is_url(path):
+        local_path = str(path)
+    elif str(path).startswith("file://"):
+        local_path = str(path).replace("file://", "", 1)
+
+    failed = np.zeros(num_instances, dtype=np.bool_)
+    memmap = None
+    if local_path is not None and num_instances > 0:
+        # Only map the whole instances, so that trailing bytes or tokens don't matter.
+        memmap = np.memmap(local_path, dtype=dtype, mode="r", shape=(num_instances * chunk_size,))
+    for start in range(0, num_instances, batch_size):
+        num_chunks = min(batch_size, num_instances - start)
+        if memmap is not None:
+            array = np.asarray(memmap[start * chunk_size : (start + num_chunks) * chunk_size])
+        else:
+            buffer = get_bytes_range(path, start * chunk_size * item_size, num_chunks * chunk_size * item_size)
+            array = np.frombuffer(buffer, dtype=dtype)
+        failed[start : start + num_chunks] = ~validate_instances(array.reshape(num_chunks, chunk_size), config)
+    return np.packbits(failed, bitorder="little")
+
+
+def write_instance_filter_mask(bitmap: np.ndarray, target: PathOrStr, save_overwrite: bool = False):
+    """
+    Save a bitmap from :func:`build_instance_filter_mask()` to a local or remote ``target``.
+    """
+    write_array_file(bitmap, target, save_overwrite=save_overwrite)
+
+
+def read_instance_filter_mask(path: PathOrStr, num_instances: int) -> np.ndarray:
+    """
+    Read a bitmap written by :func:`write_instance_filter_mask()` for a memmap array with ``num_instances``
+    instances.
+
+    :returns: The packed bitmap. Use :func:`instances_failed()` to look up instances in it.
+    """
+    num_bytes = _num_bitmap_bytes(num_instances)
+    actual_num_bytes = file_size(path)
+    if actual_num_bytes != num_bytes:
+        raise ValueError(
+            f"Instance filter mask '{path}' has {actual_num_bytes} bytes, expected {num_bytes} "
+            f"for {num_instances} instances"
+        )
+    if num_bytes == 0:
+        return np.zeros(0, dtype=np.uint8)
+    return np.frombuffer(get_bytes_range(path, 0, num_bytes), dtype=np.uint8)
+
+
+def instances_failed(bitmap: np.ndarray, indices: np.ndarray) -> np.ndarray:
+    """
+    Look up the bits for the given instance indices in a packed bitmap.
+    """
+    indices = np.asarray(indices, dtype=np.int64)
+    return ((bitmap[indices >> 3] >> (indices & 7).astype(np.uint8)) & 1).astype(np.bool_)
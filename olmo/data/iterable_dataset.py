@@ -2,15 +2,17 @@ import dataclasses
 import logging
 import math
 from pathlib import Path
-from typing import Any, Dict, Iterator, List, Optional, Sequence, Union
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Union
 
 import numpy as np
 import torch
 import torch.utils.data
 
 from ..aliases import PathOrStr
+from ..config import ShuffleMode
 from ..torch_util import barrier, get_fs_local_rank, get_global_rank, get_world_size
-from ..util import roundrobin, threaded_generator
+from ..util import adaptive_threaded_map, roundrobin, threaded_generator
+from .permutation import FeistelPermutation
 
 __all__ = ["IterableDataset"]
 
@@ -23,6 +25,14 @@ class IterableDataset(torch.utils.data.IterableDataset[Dict[str, Any]]):
     as an IterableDataset that can be deterministically restarted at any point by setting `start_index`,
     which should be a multiple of your global batch size.
     Similarly `max_examples`, if set, should be a multiple of global batch size.
+
+    With ``adaptive_threads=True`` instances are fetched by a pool of between 1 and ``max_threads`` threads
+    that's resized as it goes to keep up with the consumer, starting from ``num_threads`` threads.
+    The order of instances is the same regardless of the number of threads.
+
+    With ``shuffle_mode=ShuffleMode.feistel`` or ``ShuffleMode.block`` the data order isn't saved to
+    ``work_dir``. Instead each rank computes the dataset index for each position of its share of the global
+    order when it's needed.
     """
 
     def __init__(
@@ -41,6 +51,11 @@ class IterableDataset(torch.utils.data.IterableDataset[Dict[str, Any]]):
         fs_local_rank: Optional[int] = None,
         work_dir: Optional[PathOrStr] = None,
         num_threads: Optional[int] = None,
+        shuffle_mode: ShuffleMode = ShuffleMode.global_indices,
+        shuffle_block_size: int = 256,
+        shuffle_buffer_size: int = 16384,
+        adaptive_threads: bool = False,
+        max_threads: int = 16,
     ):
         self.dataset = dataset
         self.seed = seed
@@ -64,12 +79,18 @@ class IterableDataset(torch.utils.data.IterableDataset[Dict[str, Any]]):
             num_samples = math.ceil(len(self.dataset) / self.world_size)  # type: ignore[arg-type]
         self.total_size = num_samples * self.world_size
         self.num_threads = num_threads
+        self.adaptive_threads = adaptive_threads
+        self.max_threads = max_threads
         assert global_batch_size % self.world_size == 0
         self.device_batch_size = global_batch_size // self.world_size
         self.global_indices_file: Optional[Path] = None
         self.work_dir = work_dir
+        self.shuffle_mode = ShuffleMode(shuffle_mode)
+        assert shuffle_block_size > 0 and shuffle_buffer_size > 0
+        self.shuffle_block_size = shuffle_block_size
+        self.shuffle_buffer_size = shuffle_buffer_size
 
-        if work_dir is not None:
+        if work_dir is not None and self.shuffle_mode == ShuffleMode.global_indices:
             self._build_and_save_global_indices()
 
     def _build_and_save_global_indices(self):
@@ -114,17 +135,97 @@ class IterableDataset(torch.utils.data.IterableDataset[Dict[str, Any]]):
         return indices
 
     def get_global_indices(self) -> np.ndarray:
-        if self.global_indices_file is not None:
+        if self.shuffle_mode != ShuffleMode.global_indices:
+            return self._positions_to_indices(np.arange(self.total_size))
+        elif self.global_indices_file is not None:
             return np.memmap(self.global_indices_file, mode="r", dtype=np.uint32)  # type: ignore
         else:
             return self._build_global_indices()
 
     def reshuffle(self, epoch: int):
         self.epoch = epoch
-        if self.work_dir is not None:
+        if self.work_dir is not None and self.shuffle_mode == ShuffleMode.global_indices:
             self._build_and_save_global_indices()
 
+    def _positions_to_indices(self, positions: np.ndarray) -> np.ndarray:
+        """
+        Get the dataset indices at the given positions of the global data order for ``ShuffleMode.feistel``
+        and ``ShuffleMode.block``.
+        """
+        dataset_size = len(self.dataset)  # type: ignore[arg-type]
+        # Without 'drop_last' the order is padded by repeating it from the start.
+        positions = positions % dataset_size
+        if not self.shuffle:
+            return positions
+        elif self.shuffle_mode == ShuffleMode.block:
+            return self._block_shuffle(positions, dataset_size)
+        else:
+            return FeistelPermutation(dataset_size, np.array([self.seed, self.epoch]))(positions)
+
+    def _block_shuffle(self, positions: np.ndarray, dataset_size: int) -> np.ndarray:
+        # First shuffle within windows of 'shuffle_buffer_size' positions. Every full window uses a different
+        # permutation of the same size, and the last window, which may be partial, gets its own.
+        buffer_size = min(self.shuffle_buffer_size, dataset_size)
+        num_full_windows = dataset_size // buffer_size
+        windows, offsets = np.divmod(positions, buffer_size)
+        full = windows < num_full_windows
+        offsets[full] = FeistelPermutation(buffer_size, np.array([self.seed, self.epoch, 1]))(
+            offsets[full], windows[full]
+        )
+        if not full.all():
+            last_window_size = dataset_size - num_full_windows * buffer_size
+            last_window_permutation = FeistelPermutation(last_window_size, np.array([self.seed, self.epoch, 2]))
+            offsets[~full] = last_window_permutation(offsets[~full])
+        positions = windows * buffer_size + offsets
+
+        # Then map those positions through the shuffled order of blocks. A partial block at the end of
+        # the dataset always stays at the end.
+        block_size = min(self.shuffle_block_size, dataset_size)
+        num_full_blocks = dataset_size // block_size
+        blocks, offsets = np.divmod(positions, block_size)
+        full = blocks < num_full_blocks
+        blocks[full] = FeistelPermutation(num_full_blocks, np.array([self.seed, self.epoch, 0]))(blocks[full])
+        return blocks * block_size + offsets
+
+    def _get_lazy_indices(self, worker_info: Any) -> "_LazyIndices":
+        """
+        The same sequence of indices that :meth:`__iter__()` would slice out of the global indices
+        for this rank and worker, but computed on demand.
+        """
+        stop = self.total_size
+        if self.max_examples is not None:
+            assert self.max_examples % self.world_size == 0
+            stop = min(self.max_examples, stop)
+        rank_positions = range(self.start_index + self.rank, stop, self.world_size)
+
+        def rank_indices(offsets: np.ndarray) -> np.ndarray:
+            return self._positions_to_indices(rank_positions.start + offsets * rank_positions.step)
+
+        if worker_info is None:
+            return _LazyIndices(rank_indices, range(len(rank_positions)))
+
+        # This mirrors how the global indices are split up between workers in '__iter__()'.
+        batch_size = self.device_batch_size
+        num_batches = len(rank_positions) // batch_size
+        worker_full_size = len(range(worker_info.id, num_batches, worker_info.num_workers)) * batch_size
+        worker_left_over_size = len(
+            range(num_batches * batch_size + worker_info.id, len(rank_positions), worker_info.num_workers)
+        )
+
+        def worker_indices(offsets: np.ndarray) -> np.ndarray:
+            batch = worker_info.id + (offsets // batch_size) * worker_info.num_workers
+            full_offsets = batch * batch_size + offsets % batch_size
+            left_over_offsets = (
+                num_batches * batch_size + worker_info.id + (offsets - worker_full_size) * worker_info.num_workers
+            )
+            return rank_indices(np.where(offsets < worker_full_size, full_offsets, left_over_offsets))
+
+        return _LazyIndices(worker_indices, range(worker_full_size + worker_left_over_size))
+
     def __iter__(self) -> Iterator[Dict[str, Any]]:
+        if self.shuffle_mode != ShuffleMode.global_indices:
+            return self._iter_indices(self._get_lazy_indices(torch.utils.data.get_worker_info()))
+
         indices = self.get_global_indices()
 
         # Truncate to max_examples.
@@ -140,10 +241,6 @@ class IterableDataset(torch.utils.data.IterableDataset[Dict[str, Any]]):
         # Slice indices by rank to avoid duplicates.
         indices = indices[self.rank : self.total_size : self.world_size]
 
-        # Separate from data loading workers (which use multiprocessing), we also have the option
-        # to use multi-threading (within workers).
-        num_threads = self.num_threads
-
         # Slice the indices by data loader worker rank to avoid duplicates.
         worker_info = torch.utils.data.get_worker_info()
         if worker_info is not None:
@@ -159,7 +256,17 @@ class IterableDataset(torch.utils.data.IterableDataset[Dict[str, Any]]):
                 .reshape((-1,))
             )
             indices = np.concatenate([indices, left_overs])
-        elif num_threads is None:
+
+        return self._iter_indices(indices)
+
+    def _iter_indices(self, indices: Union[np.ndarray, "_LazyIndices"]) -> Iterator[Dict[str, Any]]:
+        if self.adaptive_threads:
+            return self._iter_indices_adaptive(indices)
+
+        # Separate from data loading workers (which use multiprocessing), we also have the option
+        # to use multi-threading (within workers).
+        num_threads = self.num_threads
+        if num_threads is None and torch.utils.data.get_worker_info() is None:
             # If `num_threads` hasn't been specified and we're not using multiprocessing we'll try to guess
             # a good number of threads.
             num_threads = 4
@@ -172,20 +279,83 @@ class IterableDataset(torch.utils.data.IterableDataset[Dict[str, Any]]):
 
             thread_generators = []
             for i in range(num_threads):
-                generator = (self._get_dataset_item(int(idx)) for idx in indices[i::num_threads])
+                generator = self._get_dataset_items(indices[i::num_threads], queue_size)
                 thread_generators.append(
                     threaded_generator(generator, maxsize=queue_size, thread_name=f"data thread {i}")
                 )
 
             return (x for x in roundrobin(*thread_generators))
         else:
-            return (self._get_dataset_item(int(idx)) for idx in indices)
+            return self._get_dataset_items(indices, self.device_batch_size)
+
+    def _iter_indices_adaptive(self, indices: Union[np.ndarray, "_LazyIndices"]) -> Iterator[Dict[str, Any]]:
+        # Fetch in groups of a quarter batch, with up to two batches fetched ahead, like with a fixed
+        # number of threads.
+        group_size = max(1, math.ceil(self.device_batch_size / 4))
+
+        def fetch_group(group: int) -> List[Dict[str, Any]]:
+            group_indices = indices[group * group_size : (group + 1) * group_size]
+            return list(self._get_dataset_items(group_indices, group_size))
+
+        groups = adaptive_threaded_map(
+            fetch_group,
+            math.ceil(len(indices) / group_size),
+            max_threads=self.max_threads,
+            initial_threads=self.num_threads or 4,
+            max_ahead=8,
+            thread_name="data thread",
+        )
+        return (item for group in groups for item in group)
+
+    def _get_dataset_items(
+        self, indices: Union[np.ndarray, "_LazyIndices"], batch_size: int
+    ) -> Iterator[Dict[str, Any]]:
+        # Datasets that implement `__getitems__` (like `MemMapDataset`) can fetch many instances
+        # more efficiently than one at a time, so we request them in groups of `batch_size`.
+        if not hasattr(self.dataset, "__getitems__"):
+            for start in range(0, len(indices), batch_size):
+                for idx in np.asarray(indices[start : start + batch_size]):
+                    yield self._get_dataset_item(int(idx))
+            return
+
+        prefetch = getattr(self.dataset, "prefetch", None)
+        for start in range(0, len(indices), batch_size):
+            batch_indices = [int(idx) for idx in np.asarray(indices[start : start + batch_size])]
+            if prefetch is not None:
+                # Let the dataset start fetching the following group in the background.
+                prefetch(np.asarray(indices[start + batch_size : start + 2 * batch_size]))
+            for idx, item in zip(batch_indices, self.dataset.__getitems__(batch_indices)):  # type: ignore
+                yield self._as_dict(item, idx)
 
     def _get_dataset_item(self, idx: int) -> Dict[str, Any]:
-        item = self.dataset[idx]
+        return self._as_dict(self.dataset[idx], idx)
+
+    def _as_dict(self, item: Any, idx: int) -> Dict[str, Any]:
         if isinstance(item, dict):
             return dict(**item, index=idx)
         elif dataclasses.is_dataclass(item):
             return dict(**dataclasses.asdict(item), index=idx)  # type: ignore
         else:
             return {"input_ids": item, "index": idx}
+
+
+class _LazyIndices:
+    """
+    A sequence of dataset indices that are only computed when it's converted to an array, by applying
+    ``fn`` to the array of ``offsets``. Slicing is lazy and just slices the offsets.
+    """
+
+    def __init__(self, fn: Callable[[np.ndarray], np.ndarray], offsets: range):
+        self.fn = fn
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def __getitem__(self, key: slice) -> "_LazyIndices":
+        return _LazyIndices(self.fn, self.offsets[key])
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        offsets = np.arange(self.offsets.start, self.offsets.stop, self.offsets.step, dtype=np.int64)
+        indices = self.fn(offsets)
+        return indices if dtype is None else indices.astype(dtype)
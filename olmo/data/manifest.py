@@ -0,0 +1,137 @@
+"""
+Dataset manifests.
+
+Building a :class:`~olmo.data.memmap_dataset.MemMapDataset` requires the size of every data file, which
+for remote data means a request per file, on every rank, every time. A manifest records the size and
+version of each file once, so that every rank can load all of it with a single read instead.
+Use ``scripts/build_dataset_manifest.py`` to create one and ``data.manifest`` to use it.
+"""
+
+from __future__ import annotations
+
+import concurrent.futures
+import json
+import os
+import tempfile
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from ..aliases import PathOrStr
+from ..exceptions import OLMoConfigurationError
+from ..util import (
+    default_thread_count,
+    file_size,
+    get_bytes_range,
+    get_file_info,
+    is_url,
+    upload,
+)
+
+__all__ = ["ManifestEntry", "DatasetManifest"]
+
+
+@dataclass
+class ManifestEntry:
+    path: str
+    """The path of the file, exactly as it appears in the data config."""
+
+    size: int
+    """The size of the file in bytes."""
+
+    etag: Optional[str]
+    """The version of the file when the manifest was built, see :class:`~olmo.util.FileInfo`."""
+
+    num_tokens: int
+    """The number of items of type ``dtype`` in the file."""
+
+    dtype: str
+    """The numpy dtype of the file's items."""
+
+
+class DatasetManifest:
+    """
+    The sizes, versions, and dtypes of a set of data files, stored as JSON lines with one :class:`ManifestEntry`
+    per line.
+    """
+
+    def __init__(self, entries: Iterable[ManifestEntry]):
+        self.entries: Dict[str, ManifestEntry] = {entry.path: entry for entry in entries}
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    @classmethod
+    def build(cls, paths: Iterable[PathOrStr], dtype: Any, num_threads: Optional[int] = None) -> DatasetManifest:
+        """
+        Build a manifest for the given files, which all have items of type ``dtype``.
+        """
+        dtype = np.dtype(dtype)
+        path_strs = [str(path) for path in paths]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=num_threads or default_thread_count()) as executor:
+            infos = list(executor.map(get_file_info, path_strs))
+        return cls(
+            ManifestEntry(
+                path=path, size=info.size, etag=info.etag, num_tokens=info.size // dtype.itemsize, dtype=dtype.name
+            )
+            for path, info in zip(path_strs, infos)
+        )
+
+    def merge(self, other: DatasetManifest) -> DatasetManifest:
+        return DatasetManifest(list(self.entries.values()) + list(other.entries.values()))
+
+    @classmethod
+    def load(cls, path: PathOrStr) -> DatasetManifest:
+        num_bytes = file_size(path)
+        data = get_bytes_range(path, 0, num_bytes).decode() if num_bytes > 0 else ""
+        return cls(ManifestEntry(**json.loads(line)) for line in data.splitlines() if line.strip())
+
+    def save(self, path: PathOrStr, save_overwrite: bool = False):
+        data = "".join(json.dumps(asdict(entry)) + "\n" for entry in self.entries.values())
+        if is_url(path) and not str(path).startswith("file://"):
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                tmp_path = os.path.join(tmp_dir, "manifest.jsonl")
+                with open(tmp_path, "w") as f:
+                    f.write(data)
+                upload(tmp_path, str(path), save_overwrite=save_overwrite)
+        else:
+            path = str(path).replace("file://", "", 1)
+            if not save_overwrite and os.path.exists(path):
+                raise FileExistsError(path)
+            with open(path, "w") as f:
+                f.write(data)
+
+    def get(self, path: PathOrStr, dtype: Any) -> ManifestEntry:
+        """
+        Get the entry for ``path``, checking that it was recorded with the expected dtype.
+
+        :raises OLMoConfigurationError: If the file isn't in the manifest or has a different dtype.
+        """
+        entry = self.entries.get(str(path))
+        if entry is None:
+            raise OLMoConfigurationError(f"'{path}' is missing from the dataset manifest")
+        if entry.dtype != np.dtype(dtype).name:
+            raise OLMoConfigurationError(
+                f"'{path}' has dtype '{entry.dtype}' in the dataset manifest, expected '{np.dtype(dtype).name}'"
+            )
+        return entry
+
+    def verify(self, num_threads: Optional[int] = None) -> List[str]:
+        """
+        Check every file against its current size and version.
+
+        :returns: The paths of the files that have changed or are missing.
+        """
+
+        def is_stale(entry: ManifestEntry) -> bool:
+            try:
+                info = get_file_info(entry.path)
+            except FileNotFoundError:
+                return True
+            return info.size != entry.size or info.etag != entry.etag
+
+        entries = list(self.entries.values())
+        with concurrent.futures.ThreadPoolExecutor(max_workers=num_threads or default_thread_count()) as executor:
+            stale = list(executor.map(is_stale, entries))
+        return [entry.path for entry, is_stale_entry in zip(entries, stale) if is_stale_entry]
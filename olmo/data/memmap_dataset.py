@@ -1,7 +1,21 @@
 from __future__ import annotations
 
+import os
+from collections import OrderedDict
 from copy import deepcopy
-from typing import Any, Dict, List, Optional, Tuple, Type, Union
+from typing import (
+    Any,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+    Union,
+    cast,
+)
+from urllib.parse import urlparse
 
 import numpy as np
 import torch
@@ -11,8 +25,23 @@ from olmo.exceptions import OLMoEnvironmentError
 
 from ..aliases import PathOrStr
 from ..config import InstanceFilterConfig
-from ..util import _get_s3_client, file_size, get_bytes_range
-from .util import find_periodic_sequences, get_document_lengths
+from ..util import (
+    _get_s3_client,
+    file_size,
+    get_bytes_range,
+    get_bytes_ranges_multi,
+    is_url,
+)
+from .block_cache import BlockCache
+from .document_index import document_index_path, read_document_index
+from .instance_filter import (
+    instance_filter_mask_path,
+    instances_failed,
+    read_instance_filter_mask,
+    validate_instances,
+)
+from .manifest import DatasetManifest
+from .util import get_document_lengths, get_document_lengths_from_offsets
 
 __all__ = ["MemMapDataset"]
 
@@ -37,12 +66,31 @@ class MemMapDataset(Dataset[Dict[str, Any]]):
         with the same number of items as there are paths.
     :param include_instance_metadata: If ``True`` (the default), each instance returned from `__getitem__` will
         include the metadata from its source.
+    :param include_source_ids: If ``True``, each instance will include a ``source_id`` tensor, which is the
+        index of its source's metadata in :data:`metadata_table`. This is much cheaper than including
+        the metadata itself, since it's just one integer per instance.
     :param generate_attention_mask: If ``True``, each instance returned from ``__getitem__`` will include an
         attention mask generated by masking each padding token.
     :param pad_token_id: The ID of the padding token. Required if ``generate_attention_mask`` is ``True``.
     :param label_mask_paths: Optional paths to ``np.bool_`` memory-mapped arrays of label masks.
+    :param use_document_index: If ``True``, ``doc_lens`` are computed from the precomputed offsets of the
+        EOS tokens next to each path (see :mod:`olmo.data.document_index`) instead of by scanning each instance.
+    :param instance_filter_config: Optional filter for degenerate instances. Instances that fail the filter
+        get an ``instance_mask`` of ``False``. If :data:`~olmo.config.InstanceFilterConfig.precomputed` is set,
+        the results are read from the bitmaps next to each path (see :mod:`olmo.data.instance_filter`).
+    :param block_cache: An optional local cache to read remote paths through.
+    :param manifest: An optional manifest to look up the sizes of the files in, instead of checking each file.
+
+    .. note::
+        Local paths are read through a per-process cache of :class:`numpy.memmap` handles
+        which are opened lazily on first access. The cache is dropped when the dataset is pickled
+        and whenever the process ID changes, so each data loader worker opens its own handles
+        instead of sharing them across a fork.
     """
 
+    #: The maximum number of memory-mapped files to keep open at once within a single process.
+    max_open_memmaps: int = 512
+
     def __init__(
         self,
         *paths: PathOrStr,
@@ -50,12 +98,16 @@ class MemMapDataset(Dataset[Dict[str, Any]]):
         memmap_dtype: Union[Type[np.uint8], Type[np.uint16], Type[np.uint32], Type[np.uint64]] = np.uint16,
         metadata: Optional[Union[List[Dict[str, Any]], Dict[str, Any]]] = None,
         include_instance_metadata: bool = True,
+        include_source_ids: bool = False,
         generate_attention_mask: bool = False,
         generate_doc_lengths: bool = False,
         pad_token_id: Optional[int] = None,
         eos_token_id: Optional[int] = None,
         label_mask_paths: Optional[List[PathOrStr]] = None,
         instance_filter_config: Optional[InstanceFilterConfig] = None,
+        block_cache: Optional[BlockCache] = None,
+        use_document_index: bool = False,
+        manifest: Optional[DatasetManifest] = None,
     ):
         if not paths:
             raise ValueError("At least one path is required")
@@ -80,14 +132,49 @@ class MemMapDataset(Dataset[Dict[str, Any]]):
         self._label_mask_paths = label_mask_paths
         self._chunk_size = chunk_size
         self._mmap_offsets: Optional[List[Tuple[int, int]]] = None
+        self._mmap_cumulative_offsets: Optional[np.ndarray] = None
         self._num_instances: Optional[int] = None
         self.dtype = memmap_dtype
         self._include_instance_metadata = include_instance_metadata
+        self._include_source_ids = include_source_ids
+        # Sources that share the same metadata object, like all paths with the same label, share a source ID.
+        self._metadata_table: List[Dict[str, Any]] = []
+        source_ids_by_object: Dict[int, int] = {}
+        self._source_ids: List[int] = []
+        for source_metadata in metadata:
+            if id(source_metadata) not in source_ids_by_object:
+                source_ids_by_object[id(source_metadata)] = len(self._metadata_table)
+                self._metadata_table.append(source_metadata)
+            self._source_ids.append(source_ids_by_object[id(source_metadata)])
         self._generate_attention_mask = generate_attention_mask
         self._generate_doc_lengths = generate_doc_lengths
         self._pad_token_id = pad_token_id
         self._eos_token_id = eos_token_id
         self.instance_filter_config = instance_filter_config
+        self.block_cache = block_cache
+        self._use_document_index = use_document_index
+        self.manifest = manifest
+        self._document_indices: OrderedDict[int, np.ndarray] = OrderedDict()
+        self._memmaps: OrderedDict[Tuple[str, str], np.memmap] = OrderedDict()
+        self._memmaps_pid: Optional[int] = None
+        self._instance_filter_masks: Dict[int, np.ndarray] = {}
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state = self.__dict__.copy()
+        # Memory maps are process-local, so don't send them to data loader workers.
+        state["_memmaps"] = OrderedDict()
+        state["_memmaps_pid"] = None
+        # Each process only loads the filter masks it actually needs.
+        state["_instance_filter_masks"] = {}
+        state["_document_indices"] = OrderedDict()
+        return state
+
+    @property
+    def metadata_table(self) -> List[Dict[str, Any]]:
+        """
+        The distinct metadata of the sources of this dataset, which the ``source_id`` of an instance indexes.
+        """
+        return self._metadata_table
 
     @property
     def chunk_size(self) -> int:
@@ -100,24 +187,13 @@ class MemMapDataset(Dataset[Dict[str, Any]]):
 
     @property
     def offsets(self) -> List[Tuple[int, int]]:
-        # Create the global S3 client up front to work around a threading issue in boto.
-        _get_s3_client("s3")
-        try:
-            _get_s3_client("r2")
-        except OLMoEnvironmentError:
-            # R2 might not be needed, so ignore this error. We will get an error
-            # later if R2 is needed.
-            pass
-        try:
-            _get_s3_client("weka")
-        except OLMoEnvironmentError:
-            # Weka might not be needed, so ignore this error. We will get an error
-            # later if Weka is needed.
-            pass
+        if self._mmap_offsets is None and self.manifest is not None:
+            self._mmap_offsets = self._offsets_from_manifest(self.manifest)
 
         if self._mmap_offsets is None:
             import concurrent.futures
 
+            self._create_s3_clients()
             self._mmap_offsets = []
 
             path_to_length: Dict[PathOrStr, int] = {}
@@ -154,17 +230,168 @@ class MemMapDataset(Dataset[Dict[str, Any]]):
                 start_offset += length
         return self._mmap_offsets
 
+    def _create_s3_clients(self):
+        # Create the global S3 clients up front to work around a threading issue in boto.
+        schemes = {urlparse(str(path)).scheme for path in self._memmap_paths + tuple(self._label_mask_paths or ())}
+        if "s3" in schemes:
+            _get_s3_client("s3")
+        for scheme in ("r2", "weka"):
+            if scheme in schemes:
+                try:
+                    _get_s3_client(scheme)
+                except OLMoEnvironmentError:
+                    # This might not be configured here, so ignore this error. We will get an error
+                    # later if it is actually needed.
+                    pass
+
+    def _offsets_from_manifest(self, manifest: DatasetManifest) -> List[Tuple[int, int]]:
+        offsets = []
+        start_offset = 0
+        for i, path in enumerate(self._memmap_paths):
+            length = manifest.get(path, self.dtype).num_tokens // self._chunk_size
+            if self._label_mask_paths is not None:
+                mask_path = self._label_mask_paths[i]
+                if manifest.get(mask_path, np.bool_).num_tokens // self._chunk_size != length:
+                    raise ValueError(f"masking file '{mask_path}' should be the same size as '{path}'")
+            offsets.append((start_offset, start_offset + length))
+            start_offset += length
+        return offsets
+
+    @property
+    def cumulative_offsets(self) -> np.ndarray:
+        """
+        The offsets from :data:`offsets` as a single array of ``len(offsets) + 1`` boundaries, so that
+        the instances of the ``i``-th memmap array are ``cumulative_offsets[i]`` to ``cumulative_offsets[i + 1]``.
+        """
+        if self._mmap_cumulative_offsets is None:
+            self._mmap_cumulative_offsets = np.array(
+                [0] + [end_offset for _, end_offset in self.offsets], dtype=np.int64
+            )
+        return self._mmap_cumulative_offsets
+
+    def get_memmap_index(self, index: int) -> Tuple[int, int]:
+        """
+        Get the index of the memmap array that ``index`` falls in along with the index
+        of the instance relative to the start of that array.
+        """
+        pos_index = index if index >= 0 else len(self) + index
+        if not 0 <= pos_index < len(self):
+            raise IndexError(f"{index} is out of bounds for dataset of size {len(self)}")
+        cumulative_offsets = self.cumulative_offsets
+        # The first array that ends after 'pos_index'. Empty arrays are skipped this way too.
+        memmap_index = int(np.searchsorted(cumulative_offsets[1:], pos_index, side="right"))
+        return memmap_index, pos_index - int(cumulative_offsets[memmap_index])
+
+    def get_memmap_indices(self, indices: Union[Sequence[int], np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        A vectorized version of :meth:`get_memmap_index()` that resolves a whole batch of indices at once.
+
+        :returns: A tuple of arrays with the memmap array index and the local instance index
+            for each of the given indices.
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        pos_indices = np.where(indices >= 0, indices, len(self) + indices)
+        out_of_bounds = (pos_indices < 0) | (pos_indices >= len(self))
+        if out_of_bounds.any():
+            raise IndexError(f"{indices[out_of_bounds][0]} is out of bounds for dataset of size {len(self)}")
+        cumulative_offsets = self.cumulative_offsets
+        memmap_indices = np.searchsorted(cumulative_offsets[1:], pos_indices, side="right")
+        return memmap_indices, pos_indices - cumulative_offsets[memmap_indices]
+
     def _read_chunk_from_memmap(self, path: PathOrStr, index: int, dtype=None) -> torch.Tensor:
+        return _array_to_tensor(self._read_chunks_from_memmap(path, index, 1, dtype=dtype)[0])
+
+    def _read_chunks_from_memmap(self, path: PathOrStr, index: int, num_chunks: int, dtype=None) -> np.ndarray:
+        """
+        Read ``num_chunks`` contiguous chunks starting at chunk ``index`` with a single read.
+        Returns an array of shape ``(num_chunks, chunk_size)`` in the file's native dtype.
+        """
         dtype = dtype or self.dtype
-        item_size = dtype(0).itemsize
-        bytes_start = index * item_size * self._chunk_size
-        num_bytes = item_size * self._chunk_size
-        buffer = get_bytes_range(path, bytes_start, num_bytes)
-        array = np.frombuffer(buffer, dtype=dtype)
-        if dtype == np.bool_:
-            return torch.tensor(array)
+        local_path = _local_path(path)
+        array: np.ndarray
+        if local_path is not None:
+            start = index * self._chunk_size
+            array = self._get_memmap(local_path, dtype)[start : start + num_chunks * self._chunk_size]
+        else:
+            item_size = dtype(0).itemsize
+            bytes_start = index * item_size * self._chunk_size
+            num_bytes = item_size * self._chunk_size * num_chunks
+            if self.block_cache is not None:
+                buffer = self.block_cache.get_bytes_range(path, bytes_start, num_bytes)
+            else:
+                buffer = get_bytes_range(path, bytes_start, num_bytes)
+            array = np.frombuffer(buffer, dtype=dtype)
+        return array.reshape(num_chunks, self._chunk_size)
+
+    def _read_many_chunks_from_memmaps(self, reads: Sequence[Tuple[PathOrStr, int, int, Any]]) -> List[np.ndarray]:
+        """
+        Like :meth:`_read_chunks_from_memmap()` for many ``(path, index, num_chunks, dtype)`` reads at once.
+        Remote reads that don't go through the block cache are issued concurrently.
+        """
+        out: List[Optional[np.ndarray]] = [None] * len(reads)
+        remote_reads: List[int] = []
+        for i, (path, index, num_chunks, dtype) in enumerate(reads):
+            if _local_path(path) is not None or self.block_cache is not None:
+                out[i] = self._read_chunks_from_memmap(path, index, num_chunks, dtype=dtype)
+            else:
+                remote_reads.append(i)
+
+        if remote_reads:
+            requests = []
+            for i in remote_reads:
+                path, index, num_chunks, dtype = reads[i]
+                item_size = dtype(0).itemsize
+                requests.append(
+                    (path, index * item_size * self._chunk_size, num_chunks * item_size * self._chunk_size)
+                )
+            for i, buffer in zip(remote_reads, get_bytes_ranges_multi(requests)):
+                out[i] = np.frombuffer(buffer, dtype=reads[i][3]).reshape(reads[i][2], self._chunk_size)
+
+        return cast(List[np.ndarray], out)
+
+    def prefetch(self, indices: Union[Sequence[int], np.ndarray]):
+        """
+        Hint that the given instances will be requested soon. When remote paths are read through
+        a :class:`BlockCache` this starts downloading them in the background.
+        """
+        if self.block_cache is None or len(indices) == 0:
+            return
+        memmap_indices, local_indices = self.get_memmap_indices(indices)
+        for memmap_index, local_start, num_chunks, _, _ in _group_contiguous_chunks(memmap_indices, local_indices):
+            paths_and_dtypes: List[Tuple[PathOrStr, Any]] = [(self._memmap_paths[memmap_index], self.dtype)]
+            if self._label_mask_paths is not None:
+                paths_and_dtypes.append((self._label_mask_paths[memmap_index], np.bool_))
+            for path, dtype in paths_and_dtypes:
+                if _local_path(path) is not None:
+                    continue
+                item_size = dtype(0).itemsize
+                self.block_cache.prefetch(
+                    path, local_start * item_size * self._chunk_size, num_chunks * item_size * self._chunk_size
+                )
+
+    def _get_memmap(self, path: str, dtype) -> np.memmap:
+        pid = os.getpid()
+        if self._memmaps_pid != pid:
+            # Either this is the first read in this process or we've been forked,
+            # so we need to (re)open our own handles.
+            self._memmaps = OrderedDict()
+            self._memmaps_pid = pid
+
+        key = (path, np.dtype(dtype).str)
+        memmap = self._memmaps.get(key)
+        if memmap is None:
+            # Copy-on-write mode gives writeable views without ever touching the underlying file,
+            # which means tensors can be created from them without a copy.
+            # Any trailing bytes that don't make up a whole item are left out, like in `_get_file_length()`.
+            memmap = np.memmap(
+                path, dtype=dtype, mode="c", shape=(os.path.getsize(path) // np.dtype(dtype).itemsize,)
+            )
+            self._memmaps[key] = memmap
+            while len(self._memmaps) > self.max_open_memmaps:
+                self._memmaps.popitem(last=False)
         else:
-            return torch.tensor(array.astype(np.int_), dtype=torch.long)
+            self._memmaps.move_to_end(key)
+        return memmap
 
     def _get_file_length(self, path, dtype=None) -> Tuple[PathOrStr, int]:
         dtype = dtype or self.dtype
@@ -178,36 +405,106 @@ class MemMapDataset(Dataset[Dict[str, Any]]):
 
     def __getitem__(self, index: int) -> Dict[str, Any]:
         index = int(index)  # in case this is a numpy int type.
-        pos_index = index if index >= 0 else len(self) + index
-
-        # The index of the memmap array within 'self.memmaps'
-        memmap_index: Optional[int] = None
-        # The 'index' relative to the corresponding memmap array.
-        memmap_local_index: Optional[int] = None
-        for i, (offset_start, offset_end) in enumerate(self.offsets):
-            if offset_start <= pos_index < offset_end:
-                memmap_index = i
-                memmap_local_index = pos_index - offset_start
 
-        if memmap_index is None or memmap_local_index is None:
-            raise IndexError(f"{index} is out of bounds for dataset of size {len(self)}")
+        # The index of the memmap array within 'self.memmaps' and the 'index' relative to
+        # the corresponding memmap array.
+        memmap_index, memmap_local_index = self.get_memmap_index(index)
 
         # Read the data from file.
         input_ids = self._read_chunk_from_memmap(self._memmap_paths[memmap_index], memmap_local_index)
-        out: Dict[str, Any] = {"input_ids": input_ids}
-        if self.instance_filter_config is not None:
-            out["instance_mask"] = self._validate_instance(input_ids)
-
+        label_mask: Optional[torch.Tensor] = None
         if self._label_mask_paths is not None:
             label_mask = self._read_chunk_from_memmap(
                 self._label_mask_paths[memmap_index], memmap_local_index, dtype=np.bool_
             )
+        instance_mask: Optional[bool] = None
+        if self.instance_filter_config is not None and self.instance_filter_config.precomputed:
+            instance_mask = bool(
+                self._read_instance_masks(np.array([memmap_index]), np.array([memmap_local_index]))[0]
+            )
+        doc_lens: Optional[torch.Tensor] = None
+        if self._generate_doc_lengths and self._use_document_index:
+            doc_lens = self._get_document_lengths(memmap_index, memmap_local_index)
+        return self._build_instance(memmap_index, input_ids, label_mask, instance_mask, doc_lens)
+
+    def __getitems__(self, indices: Sequence[int]) -> List[Dict[str, Any]]:
+        """
+        Get a batch of instances at once. This is called by PyTorch's
+        :class:`~torch.utils.data.DataLoader` in place of :meth:`__getitem__()` when it's defined.
+
+        The requested chunks are grouped by memmap array and runs of adjacent chunks are fetched
+        with a single range read, along with the corresponding label mask ranges. The tensors of the
+        returned instances are rows of batch tensors that are only allocated once.
+        """
+        memmap_indices, local_indices = self.get_memmap_indices(indices)
+        input_ids = torch.empty((len(memmap_indices), self._chunk_size), dtype=torch.long)
+        label_mask: Optional[torch.Tensor] = None
+        if self._label_mask_paths is not None:
+            label_mask = torch.empty((len(memmap_indices), self._chunk_size), dtype=torch.bool)
+
+        runs = list(_group_contiguous_chunks(memmap_indices, local_indices))
+        reads: List[Tuple[PathOrStr, int, int, Any]] = [
+            (self._memmap_paths[memmap_index], local_start, num_chunks, self.dtype)
+            for memmap_index, local_start, num_chunks, _, _ in runs
+        ]
+        if self._label_mask_paths is not None:
+            reads.extend(
+                (self._label_mask_paths[memmap_index], local_start, num_chunks, np.bool_)
+                for memmap_index, local_start, num_chunks, _, _ in runs
+            )
+        all_chunks = self._read_many_chunks_from_memmaps(reads)
+
+        for (_, _, _, positions, chunk_offsets), chunks in zip(runs, all_chunks):
+            # This widens to int64 in the same copy.
+            input_ids.numpy()[positions] = chunks[chunk_offsets]
+        if label_mask is not None:
+            for (_, _, _, positions, chunk_offsets), mask_chunks in zip(runs, all_chunks[len(runs) :]):
+                label_mask.numpy()[positions] = mask_chunks[chunk_offsets]
+
+        instance_mask: Optional[np.ndarray] = None
+        if self.instance_filter_config is not None:
+            if self.instance_filter_config.precomputed:
+                instance_mask = self._read_instance_masks(memmap_indices, local_indices)
+            else:
+                instance_mask = self._validate_instances(input_ids)
+
+        return [
+            self._build_instance(
+                int(memmap_index),
+                input_ids[i],
+                None if label_mask is None else label_mask[i],
+                None if instance_mask is None else bool(instance_mask[i]),
+                (
+                    self._get_document_lengths(int(memmap_index), int(local_indices[i]))
+                    if self._generate_doc_lengths and self._use_document_index
+                    else None
+                ),
+            )
+            for i, memmap_index in enumerate(memmap_indices)
+        ]
+
+    def _build_instance(
+        self,
+        memmap_index: int,
+        input_ids: torch.Tensor,
+        label_mask: Optional[torch.Tensor],
+        instance_mask: Optional[bool] = None,
+        doc_lens: Optional[torch.Tensor] = None,
+    ) -> Dict[str, Any]:
+        out: Dict[str, Any] = {"input_ids": input_ids}
+        if self.instance_filter_config is not None:
+            out["instance_mask"] = self._validate_instance(input_ids) if instance_mask is None else instance_mask
+
+        if label_mask is not None:
             out["label_mask"] = label_mask
 
         if self._include_instance_metadata:
             metadata = self._metadata[memmap_index]
             out["metadata"] = deepcopy(metadata)
 
+        if self._include_source_ids:
+            out["source_id"] = torch.tensor(self._source_ids[memmap_index])
+
         if self._generate_attention_mask:
             assert self._pad_token_id is not None
             attn_mask = torch.ones_like(input_ids)
@@ -216,10 +513,38 @@ class MemMapDataset(Dataset[Dict[str, Any]]):
 
         if self._generate_doc_lengths:
             assert self._eos_token_id is not None
-            out["doc_lens"] = get_document_lengths(input_ids, self._eos_token_id)
+            out["doc_lens"] = get_document_lengths(input_ids, self._eos_token_id) if doc_lens is None else doc_lens
 
         return out
 
+    def _get_document_lengths(self, memmap_index: int, local_index: int) -> torch.Tensor:
+        start = local_index * self._chunk_size
+        return get_document_lengths_from_offsets(
+            self._get_document_index(memmap_index), start, start + self._chunk_size
+        )
+
+    def _get_document_index(self, memmap_index: int) -> np.ndarray:
+        assert self._eos_token_id is not None
+        path = document_index_path(self._memmap_paths[memmap_index], self._eos_token_id)
+        local_path = _local_path(path)
+        if local_path is not None:
+            try:
+                return self._get_memmap(local_path, np.int64)
+            except ValueError:
+                # Memory-mapping an empty file fails, which means there are no EOS tokens.
+                return np.zeros(0, dtype=np.int64)
+
+        # Remote indices are small enough to just read whole, but we don't want to keep all of them around.
+        eos_offsets = self._document_indices.get(memmap_index)
+        if eos_offsets is None:
+            eos_offsets = read_document_index(path)
+            self._document_indices[memmap_index] = eos_offsets
+            while len(self._document_indices) > self.max_open_memmaps:
+                self._document_indices.popitem(last=False)
+        else:
+            self._document_indices.move_to_end(memmap_index)
+        return eos_offsets
+
     def __add__(self, other: MemMapDataset) -> MemMapDataset:
         """
         Concatenate one :class:`MemMapDataset` with another.
@@ -231,17 +556,102 @@ class MemMapDataset(Dataset[Dict[str, Any]]):
             chunk_size=self._chunk_size,
             memmap_dtype=self.dtype,
             metadata=self._metadata + other._metadata,
+            block_cache=self.block_cache,
         )
 
     def _validate_instance(self, input_ids: torch.Tensor) -> bool:
-        # Check for too many repeated ngrams.
-        # TODO: update `max_period` per Luca's suggestion.
-        if self.instance_filter_config is not None:
-            for m in find_periodic_sequences(
-                input_ids.numpy(),
-                max_period=self.instance_filter_config.repetition_max_period,
-                min_period=self.instance_filter_config.repetition_min_period,
-            ):
-                if m.times >= self.instance_filter_config.repetition_max_count:
-                    return False
-        return True
+        return bool(self._validate_instances(input_ids.unsqueeze(0))[0])
+
+    def _validate_instances(self, input_ids: torch.Tensor) -> np.ndarray:
+        """
+        Check a whole ``(batch_size, seq_len)`` batch of instances at once, returning
+        a boolean array that's ``False`` for instances that should be filtered out.
+        """
+        if self.instance_filter_config is None:
+            return np.ones(input_ids.shape[0], dtype=np.bool_)
+        return validate_instances(input_ids.numpy(), self.instance_filter_config)
+
+    def _read_instance_masks(self, memmap_indices: np.ndarray, local_indices: np.ndarray) -> np.ndarray:
+        """
+        Like :meth:`_validate_instances()`, but looks up the results in the precomputed filter bitmaps.
+        """
+        instance_mask = np.ones(len(memmap_indices), dtype=np.bool_)
+        for memmap_index in np.unique(memmap_indices):
+            selected = memmap_indices == memmap_index
+            bitmap = self._get_instance_filter_mask(int(memmap_index))
+            instance_mask[selected] = ~instances_failed(bitmap, local_indices[selected])
+        return instance_mask
+
+    def _get_instance_filter_mask(self, memmap_index: int) -> np.ndarray:
+        bitmap = self._instance_filter_masks.get(memmap_index)
+        if bitmap is None:
+            assert self.instance_filter_config is not None
+            path = instance_filter_mask_path(
+                self._memmap_paths[memmap_index], self.instance_filter_config, self._chunk_size, self.dtype
+            )
+            start_offset, end_offset = self.offsets[memmap_index]
+            try:
+                bitmap = read_instance_filter_mask(path, end_offset - start_offset)
+            except FileNotFoundError as e:
+                raise FileNotFoundError(
+                    f"Missing instance filter mask '{path}', use 'scripts/build_instance_filter_masks.py' "
+                    "to create it"
+                ) from e
+            self._instance_filter_masks[memmap_index] = bitmap
+        return bitmap
+
+
+def _local_path(path: PathOrStr) -> Optional[str]:
+    """
+    Returns the local file system path for ``path``, or ``None`` if it's a remote path.
+    """
+    if not is_url(path):
+        return str(path)
+    elif str(path).startswith("file://"):
+        return str(path).replace("file://", "", 1)
+    else:
+        return None
+
+
+def _group_contiguous_chunks(
+    memmap_indices: np.ndarray, local_indices: np.ndarray
+) -> Iterator[Tuple[int, int, int, np.ndarray, np.ndarray]]:
+    """
+    Group the requested chunks into runs of adjacent chunks within the same memmap array.
+
+    Yields tuples of ``(memmap_index, local_start, num_chunks, positions, chunk_offsets)``, meaning that
+    the chunks ``local_start`` through ``local_start + num_chunks`` should be read from memmap array
+    ``memmap_index``, and that row ``chunk_offsets[j]`` of that read belongs at position ``positions[j]``
+    of the output. Duplicate requests are served from the same read.
+    """
+    order = np.lexsort((local_indices, memmap_indices))
+    sorted_memmap_indices = memmap_indices[order]
+    sorted_local_indices = local_indices[order]
+    run_starts = np.flatnonzero((np.diff(sorted_memmap_indices) != 0) | (np.diff(sorted_local_indices) > 1)) + 1
+    for run in np.split(np.arange(len(order)), run_starts):
+        if len(run) == 0:
+            continue
+        local_start = int(sorted_local_indices[run[0]])
+        num_chunks = int(sorted_local_indices[run[-1]]) - local_start + 1
+        yield (
+            int(sorted_memmap_indices[run[0]]),
+            local_start,
+            num_chunks,
+            order[run],
+            sorted_local_indices[run] - local_start,
+        )
+
+
+def _array_to_tensor(array: np.ndarray) -> torch.Tensor:
+    """
+    Converts a chunk of tokens or a label mask into a tensor, copying at most once.
+    """
+    if array.dtype == np.bool_:
+        return torch.from_numpy(array if array.flags.writeable else array.copy())
+    elif array.dtype == np.uint64:
+        # Token IDs always fit in an int64, so we can just reinterpret the bytes.
+        array = array.view(np.int64)
+        return torch.from_numpy(array if array.flags.writeable else array.copy())
+    else:
+        # Smaller unsigned types need to be widened, which gives us a fresh writeable array.
+        return torch.from_numpy(array.astype(np.int64))
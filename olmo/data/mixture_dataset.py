@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from torch.utils.data import Dataset
+
+from ..config import DataConfig
+from ..exceptions import OLMoConfigurationError
+from .memmap_dataset import MemMapDataset
+from .permutation import FeistelPermutation
+
+__all__ = ["MixtureDataset"]
+
+
+class MixtureDataset(Dataset[Dict[str, Any]]):
+    """
+    Up- or down-samples the sources of a :class:`MemMapDataset` by a weight per source, without listing
+    the same paths more than once.
+
+    Each source is a contiguous group of the dataset's paths. A source with ``n`` instances and weight ``w``
+    takes up ``round(w * n)`` indices of this dataset. The first ``n`` of those map to the source's instances
+    in order, the next ``n`` map to them again, and so on. For fractional weights, the last partial
+    pass over the source is a pseudo-random subset of it, chosen by ``seed``.
+    Since the mapping is just index arithmetic, a weight of 2 costs no more memory or startup time than 1.
+
+    :param dataset: The dataset to sample from.
+    :param paths_per_source: The number of consecutive paths of ``dataset`` in each source.
+    :param weights: The weight of each source.
+    :param seed: The seed for picking the subsets of sources with fractional weights.
+    """
+
+    def __init__(
+        self,
+        dataset: MemMapDataset,
+        paths_per_source: Sequence[int],
+        weights: Sequence[float],
+        seed: int = 0,
+    ):
+        if len(paths_per_source) != len(weights):
+            raise ValueError("There must be a weight for each source")
+        if any(w < 0 for w in weights):
+            raise ValueError("Weights must be non-negative")
+        self.dataset = dataset
+        self.paths_per_source = list(paths_per_source)
+        self.weights = list(weights)
+        self.seed = seed
+        self._offsets: Optional[Tuple[np.ndarray, np.ndarray]] = None
+
+    @classmethod
+    def from_data_config(
+        cls, dataset: MemMapDataset, data_config: DataConfig, seed: int = 0
+    ) -> Union[MemMapDataset, MixtureDataset]:
+        """
+        Apply the ``dataset_weights`` of a data config to a dataset built from that config
+        with :func:`~olmo.data.build_memmap_dataset()`. Returns ``dataset`` as is if there are no weights.
+        """
+        if not data_config.dataset_weights:
+            return dataset
+        if not data_config.datasets:
+            raise OLMoConfigurationError("DataConfig.dataset_weights requires DataConfig.datasets")
+        unknown = set(data_config.dataset_weights.keys()) - set(data_config.datasets.keys())
+        if unknown:
+            raise OLMoConfigurationError(f"DataConfig.dataset_weights has unknown datasets {sorted(unknown)}")
+        # This needs to match the order in 'build_memmap_dataset()'.
+        labels = sorted(data_config.datasets.keys())
+        return cls(
+            dataset,
+            [len(data_config.datasets[label]) for label in labels],
+            [data_config.dataset_weights.get(label, 1.0) for label in labels],
+            seed=seed,
+        )
+
+    @property
+    def source_offsets(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The boundaries of each source within the underlying dataset and within this dataset,
+        as two arrays of ``len(weights) + 1`` offsets.
+        """
+        if self._offsets is None:
+            path_boundaries = np.cumsum([0] + self.paths_per_source)
+            if path_boundaries[-1] != len(self.dataset.offsets):
+                raise ValueError("The sources must cover all of the paths of the dataset")
+            dataset_offsets = self.dataset.cumulative_offsets[path_boundaries]
+            sizes = np.diff(dataset_offsets)
+            mixture_sizes = np.round(sizes * np.array(self.weights)).astype(np.int64)
+            self._offsets = (dataset_offsets, np.concatenate([[0], np.cumsum(mixture_sizes)]))
+        return self._offsets
+
+    def __len__(self) -> int:
+        return int(self.source_offsets[1][-1])
+
+    def get_dataset_indices(self, indices: Union[Sequence[int], np.ndarray]) -> np.ndarray:
+        """
+        Map indices of this dataset to indices of the underlying dataset.
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        indices = np.where(indices >= 0, indices, len(self) + indices)
+        out_of_bounds = (indices < 0) | (indices >= len(self))
+        if out_of_bounds.any():
+            raise IndexError(f"{indices[out_of_bounds][0]} is out of bounds for dataset of size {len(self)}")
+
+        dataset_offsets, mixture_offsets = self.source_offsets
+        sources = np.searchsorted(mixture_offsets[1:], indices, side="right")
+        dataset_indices = np.empty_like(indices)
+        for source in np.unique(sources):
+            selected = sources == source
+            size = int(dataset_offsets[source + 1] - dataset_offsets[source])
+            local_indices = indices[selected] - mixture_offsets[source]
+            num_full_passes = int(mixture_offsets[source + 1] - mixture_offsets[source]) // size
+            passes, local_indices = np.divmod(local_indices, size)
+            partial = passes == num_full_passes
+            if partial.any():
+                permutation = FeistelPermutation(size, np.array([self.seed, source]))
+                local_indices[partial] = permutation(local_indices[partial])
+            dataset_indices[selected] = dataset_offsets[source] + local_indices
+        return dataset_indices
+
+    def __getitem__(self, index: int) -> Dict[str, Any]:
+        return self.dataset[int(self.get_dataset_indices([index])[0])]
+
+    def __getitems__(self, indices: Sequence[int]) -> List[Dict[str, Any]]:
+        return self.dataset.__getitems__(self.get_dataset_indices(indices).tolist())
+
+    def prefetch(self, indices: Union[Sequence[int], np.ndarray]):
+        if len(indices) > 0:
+            self.dataset.prefetch(self.get_dataset_indices(indices))
@@ -0,0 +1,225 @@
+from __future__ import annotations
+
+import concurrent.futures
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Type, Union
+
+import numpy as np
+import torch
+
+from ..aliases import PathOrStr
+from ..config import InstanceFilterConfig
+from ..util import get_bytes_ranges_multi
+from .block_cache import BlockCache
+from .memmap_dataset import MemMapDataset, _local_path
+from .packing import (
+    packed_index_path,
+    read_packed_index,
+    read_packed_index_size,
+    split_packed_index,
+)
+
+__all__ = ["PackedMemMapDataset"]
+
+
+class PackedMemMapDataset(MemMapDataset):
+    """
+    A :class:`MemMapDataset` whose instances are whole documents packed together, instead of fixed chunks
+    of the token stream. The documents in each instance are read from the packed index next to each path
+    (see :mod:`olmo.data.packing`), so documents never span files and are only split when they're longer
+    than ``chunk_size``.
+
+    Instances are padded to ``chunk_size`` with ``pad_token_id`` and always include a ``label_mask``
+    that excludes the padding. ``doc_lens`` come straight from the index, with the padding as its own
+    document at the end.
+
+    :param paths: Paths to memory-mapped token arrays.
+    :param chunk_size: The maximum number of tokens in an instance, which has to match the index.
+    :param memmap_dtype: The numpy datatype of the memory-mapped array.
+    :param pad_token_id: The ID of the padding token.
+    :param eos_token_id: The ID of the EOS token that the documents were indexed by.
+
+    See :class:`MemMapDataset` for the other parameters. Precomputed instance filters aren't supported.
+    """
+
+    def __init__(
+        self,
+        *paths: PathOrStr,
+        chunk_size: int = 1024,
+        memmap_dtype: Union[Type[np.uint8], Type[np.uint16], Type[np.uint32], Type[np.uint64]] = np.uint16,
+        pad_token_id: int,
+        eos_token_id: int,
+        metadata: Optional[Union[List[Dict[str, Any]], Dict[str, Any]]] = None,
+        include_instance_metadata: bool = True,
+        include_source_ids: bool = False,
+        generate_attention_mask: bool = False,
+        generate_doc_lengths: bool = False,
+        label_mask_paths: Optional[List[PathOrStr]] = None,
+        instance_filter_config: Optional[InstanceFilterConfig] = None,
+        block_cache: Optional[BlockCache] = None,
+    ):
+        if instance_filter_config is not None and instance_filter_config.precomputed:
+            raise ValueError("Precomputed instance filters aren't supported with packed instances")
+        super().__init__(
+            *paths,
+            chunk_size=chunk_size,
+            memmap_dtype=memmap_dtype,
+            metadata=metadata,
+            include_instance_metadata=include_instance_metadata,
+            include_source_ids=include_source_ids,
+            generate_attention_mask=generate_attention_mask,
+            generate_doc_lengths=generate_doc_lengths,
+            pad_token_id=pad_token_id,
+            eos_token_id=eos_token_id,
+            label_mask_paths=label_mask_paths,
+            instance_filter_config=instance_filter_config,
+            block_cache=block_cache,
+        )
+        self._packed_indices: OrderedDict[int, Tuple[np.ndarray, np.ndarray]] = OrderedDict()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state = super().__getstate__()
+        state["_packed_indices"] = OrderedDict()
+        return state
+
+    @property
+    def offsets(self) -> List[Tuple[int, int]]:
+        # The number of instances in each file comes from its index instead of its size.
+        if self._mmap_offsets is None:
+            self._create_s3_clients()
+            with concurrent.futures.ThreadPoolExecutor() as executor:
+                sizes = list(
+                    executor.map(
+                        lambda path: read_packed_index_size(self._packed_index_path(path)), self._memmap_paths
+                    )
+                )
+            ends = np.cumsum(sizes).tolist()
+            self._mmap_offsets = [(end - size, end) for size, end in zip(sizes, ends)]
+        return self._mmap_offsets
+
+    def _packed_index_path(self, path: PathOrStr) -> str:
+        assert self._eos_token_id is not None
+        return packed_index_path(path, self._chunk_size, self._eos_token_id)
+
+    def _get_packed_index(self, memmap_index: int) -> Tuple[np.ndarray, np.ndarray]:
+        path = self._packed_index_path(self._memmap_paths[memmap_index])
+        local_path = _local_path(path)
+        if local_path is not None:
+            return split_packed_index(self._get_memmap(local_path, np.int64))
+
+        index = self._packed_indices.get(memmap_index)
+        if index is None:
+            index = read_packed_index(path)
+            self._packed_indices[memmap_index] = index
+            while len(self._packed_indices) > self.max_open_memmaps:
+                self._packed_indices.popitem(last=False)
+        else:
+            self._packed_indices.move_to_end(memmap_index)
+        return index
+
+    def _get_pieces(self, memmap_index: int, local_index: int) -> np.ndarray:
+        pieces, instance_offsets = self._get_packed_index(memmap_index)
+        return pieces[instance_offsets[local_index] : instance_offsets[local_index + 1]]
+
+    def _read_ranges(self, reads: Sequence[Tuple[PathOrStr, int, int, Any]]) -> List[np.ndarray]:
+        """
+        Read many ``(path, start, num_tokens, dtype)`` ranges of tokens, concurrently for remote paths.
+        """
+        out: List[np.ndarray] = [np.empty(0)] * len(reads)
+        remote_reads: List[int] = []
+        for i, (path, start, num_tokens, dtype) in enumerate(reads):
+            local_path = _local_path(path)
+            if local_path is not None:
+                out[i] = self._get_memmap(local_path, dtype)[start : start + num_tokens]
+            elif self.block_cache is not None:
+                item_size = dtype(0).itemsize
+                buffer = self.block_cache.get_bytes_range(path, start * item_size, num_tokens * item_size)
+                out[i] = np.frombuffer(buffer, dtype=dtype)
+            else:
+                remote_reads.append(i)
+
+        if remote_reads:
+            requests = []
+            for i in remote_reads:
+                path, start, num_tokens, dtype = reads[i]
+                item_size = dtype(0).itemsize
+                requests.append((path, start * item_size, num_tokens * item_size))
+            for i, buffer in zip(remote_reads, get_bytes_ranges_multi(requests)):
+                out[i] = np.frombuffer(buffer, dtype=reads[i][3])
+        return out
+
+    def prefetch(self, indices: Union[Sequence[int], np.ndarray]):
+        if self.block_cache is None or len(indices) == 0:
+            return
+        memmap_indices, local_indices = self.get_memmap_indices(indices)
+        for memmap_index, local_index in zip(memmap_indices.tolist(), local_indices.tolist()):
+            paths_and_dtypes: List[Tuple[PathOrStr, Any]] = [(self._memmap_paths[memmap_index], self.dtype)]
+            if self._label_mask_paths is not None:
+                paths_and_dtypes.append((self._label_mask_paths[memmap_index], np.bool_))
+            for path, dtype in paths_and_dtypes:
+                if _local_path(path) is not None:
+                    continue
+                item_size = dtype(0).itemsize
+                for start, num_tokens in self._get_pieces(memmap_index, local_index).tolist():
+                    self.block_cache.prefetch(path, start * item_size, num_tokens * item_size)
+
+    def __getitem__(self, index: int) -> Dict[str, Any]:
+        return self.__getitems__([int(index)])[0]
+
+    def __getitems__(self, indices: Sequence[int]) -> List[Dict[str, Any]]:
+        memmap_indices, local_indices = self.get_memmap_indices(indices)
+        assert self._pad_token_id is not None
+        input_ids = torch.full((len(memmap_indices), self._chunk_size), self._pad_token_id, dtype=torch.long)
+        label_mask = torch.zeros((len(memmap_indices), self._chunk_size), dtype=torch.bool)
+
+        # The row, column, and length of each read in the output.
+        positions: List[Tuple[int, int, int]] = []
+        reads: List[Tuple[PathOrStr, int, int, Any]] = []
+        mask_reads: List[Tuple[PathOrStr, int, int, Any]] = []
+        all_doc_lens: List[torch.Tensor] = []
+        # The number of real tokens at the start of each row, which is followed by padding.
+        num_filled: List[int] = []
+        for i, (memmap_index, local_index) in enumerate(zip(memmap_indices.tolist(), local_indices.tolist())):
+            pieces = self._get_pieces(memmap_index, local_index)
+            column = 0
+            for start, num_tokens in pieces.tolist():
+                positions.append((i, column, num_tokens))
+                reads.append((self._memmap_paths[memmap_index], start, num_tokens, self.dtype))
+                if self._label_mask_paths is not None:
+                    mask_reads.append((self._label_mask_paths[memmap_index], start, num_tokens, np.bool_))
+                column += num_tokens
+            num_filled.append(column)
+            doc_lens = pieces[:, 1].tolist()
+            if column < self._chunk_size:
+                doc_lens.append(self._chunk_size - column)
+            all_doc_lens.append(torch.tensor(doc_lens, dtype=torch.int32))
+        all_ranges = self._read_ranges(reads + mask_reads)
+
+        for (i, column, num_tokens), tokens in zip(positions, all_ranges):
+            input_ids.numpy()[i, column : column + num_tokens] = tokens
+            label_mask.numpy()[i, column : column + num_tokens] = True
+        if mask_reads:
+            for (i, column, num_tokens), mask in zip(positions, all_ranges[len(positions) :]):
+                label_mask.numpy()[i, column : column + num_tokens] &= mask
+
+        instance_mask: Optional[np.ndarray] = None
+        if self.instance_filter_config is not None:
+            # Only check the real tokens, since the padding of a partly filled row would count as repetitions.
+            instance_mask = np.ones(len(num_filled), dtype=np.bool_)
+            full_rows = [i for i, filled in enumerate(num_filled) if filled == self._chunk_size]
+            if full_rows:
+                instance_mask[full_rows] = self._validate_instances(input_ids[full_rows])
+            for i, filled in enumerate(num_filled):
+                if 0 < filled < self._chunk_size:
+                    instance_mask[i] = self._validate_instance(input_ids[i, :filled])
+
+        return [
+            self._build_instance(
+                int(memmap_index),
+                input_ids[i],
+                label_mask[i],
+                None if instance_mask is None else bool(instance_mask[i]),
+                all_doc_lens[i],
+            )
+            for i, memmap_index in enumerate(memmap_indices)
+        ]
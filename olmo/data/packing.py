@@ -0,0 +1,165 @@
+"""
+Document packing.
+
+Instead of cutting the token stream of a data file into fixed chunks, the documents of each file can be
+packed into instances of at most ``max_sequence_length`` tokens with best-fit-decreasing bin packing, so that
+documents are only split when they're longer than an instance and there's very little padding.
+The result is saved next to each file as a packed index (see :func:`write_packed_index()`), which is
+what :class:`~olmo.data.packed_dataset.PackedMemMapDataset` reads instances from.
+Use ``scripts/build_packed_indices.py`` to create them.
+"""
+
+from bisect import bisect_left, insort
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from ..aliases import PathOrStr
+from ..util import file_size, get_bytes_range
+from .util import write_array_file
+
+__all__ = [
+    "packed_index_path",
+    "get_document_spans",
+    "pack_documents",
+    "build_packed_index",
+    "write_packed_index",
+    "read_packed_index",
+    "read_packed_index_size",
+    "split_packed_index",
+]
+
+#: The dtype of all values in a packed index.
+PACKED_INDEX_DTYPE = np.int64
+
+
+def packed_index_path(path: PathOrStr, max_sequence_length: int, eos_token_id: int) -> str:
+    """
+    Get the path of the packed index for the memmap array at ``path``.
+    """
+    return f"{path}.packed-s{max_sequence_length}-eos{eos_token_id}.idx"
+
+
+def get_document_spans(eos_offsets: np.ndarray, num_tokens: int) -> np.ndarray:
+    """
+    Get the ``(start, length)`` of each document of an array of ``num_tokens`` tokens from the offsets
+    of its EOS tokens, as returned by :func:`~olmo.data.document_index.build_document_index()`.
+    Any tokens after the last EOS token make up one more document.
+    """
+    ends = eos_offsets.astype(np.int64) + 1
+    if len(ends) == 0 or ends[-1] < num_tokens:
+        ends = np.append(ends, num_tokens)
+    starts = np.concatenate([[0], ends[:-1]])
+    return np.stack([starts, ends - starts], axis=1)
+
+
+def pack_documents(lengths: np.ndarray, max_sequence_length: int) -> List[List[int]]:
+    """
+    Pack documents of the given lengths into as few instances of at most ``max_sequence_length`` tokens
+    as possible with best-fit-decreasing: going from the longest document to the shortest, each document
+    goes into the fullest instance that still has room for it.
+
+    :returns: The indices of the documents in each instance.
+    """
+    if len(lengths) > 0 and (lengths.min() <= 0 or lengths.max() > max_sequence_length):
+        raise ValueError(f"Document lengths must be in the range [1, {max_sequence_length}]")
+
+    instances: List[List[int]] = []
+    # The instances with room left by the amount of room, and the sorted amounts that have any instances.
+    instances_by_room: Dict[int, List[int]] = {}
+    rooms: List[int] = []
+    for doc in np.argsort(-lengths, kind="stable").tolist():
+        length = int(lengths[doc])
+        i = bisect_left(rooms, length)
+        if i == len(rooms):
+            instance = len(instances)
+            instances.append([doc])
+            room = max_sequence_length - length
+        else:
+            room = rooms[i]
+            instance = instances_by_room[room].pop()
+            if not instances_by_room[room]:
+                del instances_by_room[room]
+                del rooms[i]
+            instances[instance].append(doc)
+            room -= length
+        if room > 0:
+            if room not in instances_by_room:
+                instances_by_room[room] = []
+                insort(rooms, room)
+            instances_by_room[room].append(instance)
+    return instances
+
+
+def build_packed_index(
+    eos_offsets: np.ndarray, num_tokens: int, max_sequence_length: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Pack the documents of a memmap array with :func:`pack_documents()`. Documents longer than
+    ``max_sequence_length`` are split into pieces of ``max_sequence_length`` tokens and a shorter remainder.
+
+    :param eos_offsets: The offsets of the EOS tokens in the array.
+    :param num_tokens: The size of the array.
+    :param max_sequence_length: The maximum number of tokens per instance.
+
+    :returns: The ``(start, length)`` of each document or piece of a document as an array of shape
+        ``(num_pieces, 2)``, ordered by instance and then by ``start``, and the offsets of each instance's
+        pieces in that array as an array of ``num_instances + 1`` boundaries.
+    """
+    spans = get_document_spans(eos_offsets, num_tokens)
+    num_pieces = -(-spans[:, 1] // max_sequence_length)
+    piece_starts = np.repeat(spans[:, 0], num_pieces) + max_sequence_length * (
+        np.arange(num_pieces.sum()) - np.repeat(np.cumsum(num_pieces) - num_pieces, num_pieces)
+    )
+    piece_ends = np.minimum(piece_starts + max_sequence_length, np.repeat(spans[:, 0] + spans[:, 1], num_pieces))
+    pieces = np.stack([piece_starts, piece_ends - piece_starts], axis=1).astype(PACKED_INDEX_DTYPE)
+
+    instances = [sorted(instance) for instance in pack_documents(pieces[:, 1], max_sequence_length)]
+    order = np.array([piece for instance in instances for piece in instance], dtype=np.int64)
+    instance_offsets = np.cumsum([0] + [len(instance) for instance in instances]).astype(PACKED_INDEX_DTYPE)
+    return pieces[order], instance_offsets
+
+
+def write_packed_index(
+    pieces: np.ndarray, instance_offsets: np.ndarray, target: PathOrStr, save_overwrite: bool = False
+):
+    """
+    Save an index from :func:`build_packed_index()` to a local or remote ``target``.
+
+    The index is a single array of ``int64`` values: the number of instances, then the
+    ``num_instances + 1`` instance offsets, then the flattened pieces.
+    """
+    header = np.array([len(instance_offsets) - 1], dtype=PACKED_INDEX_DTYPE)
+    write_array_file(
+        np.concatenate([header, instance_offsets, pieces.reshape(-1)]).astype(PACKED_INDEX_DTYPE, copy=False),
+        target,
+        save_overwrite=save_overwrite,
+    )
+
+
+def read_packed_index_size(path: PathOrStr) -> int:
+    """
+    Read just the number of instances in a packed index.
+    """
+    return int(
+        np.frombuffer(get_bytes_range(path, 0, PACKED_INDEX_DTYPE(0).itemsize), dtype=PACKED_INDEX_DTYPE)[0]
+    )
+
+
+def read_packed_index(path: PathOrStr) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Read a whole packed index written by :func:`write_packed_index()`.
+
+    :returns: The pieces and instance offsets, like :func:`build_packed_index()`.
+    """
+    data = np.frombuffer(get_bytes_range(path, 0, file_size(path)), dtype=PACKED_INDEX_DTYPE)
+    return split_packed_index(data)
+
+
+def split_packed_index(data: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Split the raw array of a packed index into its pieces and instance offsets.
+    """
+    num_instances = int(data[0])
+    instance_offsets = data[1 : num_instances + 2]
+    return data[num_instances + 2 :].reshape(-1, 2), instance_offsets
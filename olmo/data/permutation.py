@@ -0,0 +1,84 @@
+from typing import List, Optional, Union
+
+import numpy as np
+
+__all__ = ["FeistelPermutation"]
+
+
+class FeistelPermutation:
+    """
+    A pseudo-random permutation of ``range(size)`` that's computed on the fly, so looking up where any
+    position goes takes constant time and memory regardless of ``size``.
+
+    This is a balanced Feistel network over the smallest power-of-4 domain that covers ``size``.
+    Outputs that fall outside of ``range(size)`` are fed through the network again ("cycle walking"), which
+    keeps the result a bijection on ``range(size)``. Since the domain is less than 4 times bigger than ``size``,
+    that takes fewer than 4 passes on average.
+
+    :param size: The number of elements to permute.
+    :param seed: The key of the permutation. Different seeds give unrelated permutations.
+    :param num_rounds: The number of Feistel rounds.
+
+    Calling the permutation with ``tweaks`` selects a different permutation for each tweak value,
+    which is like having a separate permutation per tweak, without the cost of creating them.
+    """
+
+    def __init__(self, size: int, seed: Union[int, np.ndarray], num_rounds: int = 6):
+        if size < 0:
+            raise ValueError("'size' must be non-negative")
+        self.size = size
+        self.half_bits = max(1, ((size - 1).bit_length() + 1) // 2)
+        self.half_mask = np.uint64((1 << self.half_bits) - 1)
+        self.keys = np.random.SeedSequence(seed).generate_state(num_rounds, dtype=np.uint64)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __call__(
+        self, positions: Union[int, np.ndarray], tweaks: Optional[Union[int, np.ndarray]] = None
+    ) -> np.ndarray:
+        """
+        Get the elements at the given positions of the permutation.
+
+        :param positions: The positions to look up.
+        :param tweaks: Optional non-negative integers, one per position or a single one for all positions,
+            that select which permutation to look up each position in.
+        """
+        positions = np.asarray(positions, dtype=np.int64)
+        if ((positions < 0) | (positions >= self.size)).any():
+            raise IndexError(f"positions must be in the range [0, {self.size})")
+        values = positions.astype(np.uint64)
+        keys = self._get_keys(values, tweaks)
+        values = self._encrypt(values, keys)
+        out_of_range = values >= self.size
+        while out_of_range.any():
+            values[out_of_range] = self._encrypt(
+                values[out_of_range], [key if key.ndim == 0 else key[out_of_range] for key in keys]
+            )
+            out_of_range = values >= self.size
+        return values.astype(np.int64)
+
+    def _get_keys(self, values: np.ndarray, tweaks: Optional[Union[int, np.ndarray]]) -> List[np.ndarray]:
+        if tweaks is None:
+            return list(self.keys)
+        tweaks = np.broadcast_to(np.asarray(tweaks, dtype=np.int64), values.shape).astype(np.uint64)
+        return [_mix(tweaks ^ key) for key in self.keys]
+
+    def _encrypt(self, values: np.ndarray, keys: List[np.ndarray]) -> np.ndarray:
+        shift = np.uint64(self.half_bits)
+        left = values >> shift
+        right = values & self.half_mask
+        for key in keys:
+            left, right = right, left ^ (_mix(right ^ key) & self.half_mask)
+        return (left << shift) | right
+
+
+def _mix(x: np.ndarray) -> np.ndarray:
+    # The SplitMix64 finalizer, which is cheap and mixes every input bit into every output bit.
+    x = x * np.uint64(0x9E3779B97F4A7C15)
+    x ^= x >> np.uint64(30)
+    x *= np.uint64(0xBF58476D1CE4E5B9)
+    x ^= x >> np.uint64(27)
+    x *= np.uint64(0x94D049BB133111EB)
+    x ^= x >> np.uint64(31)
+    return x
@@ -0,0 +1,214 @@
+"""
+Passing batches from data loader workers to the main process through a ring of preallocated shared memory
+slots, instead of pickling each batch and moving every tensor into a fresh shared memory segment.
+"""
+
+from __future__ import annotations
+
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+import torch
+import torch.utils.data
+from torch.utils.data import DataLoader
+
+from ..config import TrainConfig
+
+__all__ = ["BatchSlot", "SharedMemoryBatchRing", "SharedMemoryDataLoader"]
+
+_FREE, _FILLED = 0, 1
+
+
+@dataclass
+class BatchSlot:
+    """
+    What a worker sends to the main process in place of a batch that's been written to a slot.
+    """
+
+    slot: int
+    shapes: Dict[str, Tuple[int, ...]]
+    """The shape of each field of the batch that's stored in the slot."""
+    extras: Dict[str, Any]
+    """The fields of the batch that aren't tensors, like ``max_doc_lens``."""
+
+
+class SharedMemoryBatchRing:
+    """
+    A fixed number of batch slots per data loader worker in shared memory.
+
+    Each field is a tensor of shape ``(num_slots, batch_size, *shape)``, allocated once up front.
+    A worker writes its ``k``-th batch into its ``k % slots_per_worker``-th slot, and the main process
+    reads it from there without a copy and releases the slot once it's done with the batch.
+    Since PyTorch never has more than ``prefetch_factor`` batches in flight per worker, a ring of
+    ``prefetch_factor + 1`` slots per worker means workers don't usually have to wait for a slot.
+
+    Batches that don't fit into the slots, like ones with fields that weren't allocated, or where a worker
+    has waited ``timeout`` seconds for its next slot, are sent the normal way instead.
+
+    :param fields: The shape of one row and the dtype of each field. The size of the last dimension of
+        each field can vary between batches up to the allocated size, which is needed for ``doc_lens``.
+    :param batch_size: The maximum number of rows in a batch.
+    :param num_workers: The number of data loader workers.
+    :param slots_per_worker: The number of slots for each worker.
+    :param timeout: How long a worker waits for its next slot to be released.
+    """
+
+    def __init__(
+        self,
+        fields: Dict[str, Tuple[Tuple[int, ...], torch.dtype]],
+        batch_size: int,
+        num_workers: int,
+        slots_per_worker: int,
+        timeout: float = 60.0,
+    ):
+        self.batch_size = batch_size
+        self.num_workers = num_workers
+        self.slots_per_worker = slots_per_worker
+        self.timeout = timeout
+        num_slots = num_workers * slots_per_worker
+        self.buffers: Dict[str, torch.Tensor] = {
+            name: torch.zeros((num_slots, batch_size, *shape), dtype=dtype).share_memory_()
+            for name, (shape, dtype) in fields.items()
+        }
+        self.states = torch.zeros(num_slots, dtype=torch.int32).share_memory_()
+        # The number of batches that this process has written, which is only used within workers.
+        self._num_batches = 0
+
+    @classmethod
+    def from_train_config(cls, config: TrainConfig) -> SharedMemoryBatchRing:
+        """
+        Allocate slots for the fields of the training batches that a config produces.
+        """
+        assert config.device_train_batch_size is not None
+        seq_len = config.model.max_sequence_length
+        fields: Dict[str, Tuple[Tuple[int, ...], torch.dtype]] = {
+            "input_ids": ((seq_len,), torch.long),
+            "index": ((), torch.long),
+        }
+        if config.data.label_mask_paths or config.data.pack_documents:
+            fields["label_mask"] = ((seq_len,), torch.bool)
+        if config.data.generate_attention_mask:
+            fields["attention_mask"] = ((seq_len,), torch.float)
+        if config.data.instance_filter is not None:
+            fields["instance_mask"] = ((), torch.bool)
+        if config.data.generate_doc_lengths:
+            fields["doc_lens"] = ((seq_len,), torch.int32)
+        return cls(
+            fields,
+            batch_size=config.device_train_batch_size,
+            num_workers=config.data.num_workers,
+            slots_per_worker=(config.data.prefetch_factor or 2) + 1,
+        )
+
+    def reset(self):
+        """
+        Release all slots. Only call this when no workers are running.
+        """
+        self.states.fill_(_FREE)
+
+    def put(self, batch: Dict[str, Any], worker_id: int) -> Union[BatchSlot, Dict[str, Any]]:
+        """
+        Write a batch into the next slot of a worker. Returns the :class:`BatchSlot` to send to the
+        main process, or the batch itself if it doesn't fit.
+        """
+        shapes: Dict[str, Tuple[int, ...]] = {}
+        extras: Dict[str, Any] = {}
+        for name, value in batch.items():
+            if not isinstance(value, torch.Tensor):
+                extras[name] = value
+                continue
+            buffer = self.buffers.get(name)
+            if (
+                buffer is None
+                or value.dim() != buffer.dim() - 1
+                or any(size > max_size for size, max_size in zip(value.shape, buffer.shape[1:]))
+            ):
+                return batch
+            shapes[name] = tuple(value.shape)
+
+        slot = worker_id * self.slots_per_worker + self._num_batches % self.slots_per_worker
+        if not self._wait_for_slot(slot):
+            return batch
+        self._num_batches += 1
+
+        for name, shape in shapes.items():
+            self.buffers[name][slot][tuple(slice(0, size) for size in shape)].copy_(batch[name])
+        self.states[slot] = _FILLED
+        return BatchSlot(slot=slot, shapes=shapes, extras=extras)
+
+    def _wait_for_slot(self, slot: int) -> bool:
+        deadline = time.monotonic() + self.timeout
+        while self.states[slot].item() != _FREE:
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.0005)
+        return True
+
+    def get(self, batch_slot: BatchSlot) -> Dict[str, Any]:
+        """
+        Get a batch from a slot as views of the shared buffers, which are only valid until the slot is released.
+        """
+        batch: Dict[str, Any] = {
+            name: self.buffers[name][batch_slot.slot][tuple(slice(0, size) for size in shape)]
+            for name, shape in batch_slot.shapes.items()
+        }
+        batch.update(batch_slot.extras)
+        return batch
+
+    def release(self, batch_slot: BatchSlot):
+        self.states[batch_slot.slot] = _FREE
+
+
+class _SharedMemoryCollator:
+    def __init__(self, collate_fn: Callable[[List[Any]], Dict[str, Any]], ring: SharedMemoryBatchRing):
+        self.collate_fn = collate_fn
+        self.ring = ring
+
+    def __call__(self, items: List[Any]) -> Union[BatchSlot, Dict[str, Any]]:
+        batch = self.collate_fn(items)
+        worker_info = torch.utils.data.get_worker_info()
+        if worker_info is None or not isinstance(batch, dict):
+            return batch
+        assert worker_info.num_workers <= self.ring.num_workers
+        return self.ring.put(batch, worker_info.id)
+
+
+class SharedMemoryDataLoader(DataLoader):
+    """
+    A :class:`~torch.utils.data.DataLoader` whose workers pass batches to the main process through
+    a :class:`SharedMemoryBatchRing`. The order of batches is the same as with a regular data loader.
+
+    .. important::
+        The tensors of each batch are views of the shared slots, so they're only valid until the next batch
+        is requested. Batches from this data loader should be copied (e.g. moved to the GPU) before then.
+
+    :param ring: The slots to use, which need to be big enough for ``batch_size`` and ``num_workers``.
+    :param collate_fn: The collate function for the workers.
+
+    All other arguments are passed to :class:`~torch.utils.data.DataLoader`.
+    """
+
+    def __init__(self, *args, ring: SharedMemoryBatchRing, collate_fn: Callable, **kwargs):
+        super().__init__(*args, collate_fn=_SharedMemoryCollator(collate_fn, ring), **kwargs)
+        self.ring = ring
+
+    def __iter__(self) -> Iterator[Any]:  # type: ignore[override]
+        # Slots from a previous iteration that ended early might never have been released.
+        self.ring.reset()
+        return self._iter_batches(super().__iter__())
+
+    def _iter_batches(self, batches: Iterator[Any]) -> Iterator[Any]:
+        held: Optional[BatchSlot] = None
+        try:
+            for batch in batches:
+                if held is not None:
+                    self.ring.release(held)
+                    held = None
+                if isinstance(batch, BatchSlot):
+                    held = batch
+                    batch = self.ring.get(batch)
+                yield batch
+        finally:
+            if held is not None:
+                self.ring.release(held)
@@ -1,8 +1,13 @@
+import os
+import tempfile
 from typing import Generator, List, NamedTuple
 
 import numpy as np
 import torch
 
+from ..aliases import PathOrStr
+from ..util import is_url, upload
+
 
 def find_end_first_consecutive_true(arr: np.ndarray) -> int:
     """Function to find the end position of the first consecutive sequence of True in an array."""
@@ -119,6 +124,52 @@ def find_periodic_sequences(
                 yield out
 
 
+def find_max_repetitions(arr: np.ndarray, max_period: int, min_period: int = 1) -> np.ndarray:
+    """Function to find the largest number of times a periodic sequence repeats in each row of an array.
+
+    This gives exactly the same result as taking the maximum ``times`` over the sequences
+    found by :func:`find_periodic_sequences` (or 0 if there are none), but checks every period
+    with a single vectorized comparison of shifted views of the array instead of padding and
+    reshaping the array for each period.
+
+    A sequence with period ``p`` that repeats ``t`` times corresponds to a run of ``(t - 1) * p``
+    positions ``i`` where ``arr[i] == arr[i - p]``, so for each period we find the longest such run.
+    Like :func:`find_periodic_sequences`, only sequences that repeat at least 3 times are counted,
+    and periods longer than a third of the array length are ignored.
+
+    Args:
+        arr (np.ndarray): A 1D array, or a 2D array where each row is checked separately.
+        max_period (int): The maximum period to check for.
+        min_period (int, optional): The minimum period to check for. Defaults to 1.
+
+    Returns:
+        np.ndarray: The maximum number of repetitions for each row, or a scalar array for 1D inputs.
+    """
+    batch = np.atleast_2d(arr)
+    num_rows, length = batch.shape
+    max_period = min(max_period, length // 3)
+    max_times = np.zeros(num_rows, dtype=np.int64)
+    positions = np.arange(1, length + 1, dtype=np.int64)
+
+    for period in range(min_period, max_period + 1):
+        is_equal = batch[:, period:] == batch[:, :-period]
+        # Repeating at least 3 times requires a run of at least 2 equal positions, so we can
+        # cheaply skip the rows that don't have one, which is nearly all of them for natural text.
+        candidates = np.flatnonzero((is_equal[:, 1:] & is_equal[:, :-1]).any(axis=1))
+        if len(candidates) == 0:
+            continue
+        is_equal = is_equal[candidates]
+        # The length of the run of equal positions ending at each position, computed by
+        # subtracting the (1-based) position of the last mismatch.
+        pos = positions[: length - period]
+        last_mismatch = np.maximum.accumulate(np.where(is_equal, 0, pos), axis=1)
+        longest_run = (pos - last_mismatch).max(axis=1)
+        times = (longest_run + period) // period
+        max_times[candidates] = np.maximum(max_times[candidates], np.where(times > 2, times, 0))
+
+    return max_times if arr.ndim > 1 else max_times[0]
+
+
 def get_document_lengths(input_ids: torch.Tensor, eos_token_id: int) -> torch.Tensor:
     doc_boundaries = torch.cat(
         [
@@ -128,3 +179,34 @@ def get_document_lengths(input_ids: torch.Tensor, eos_token_id: int) -> torch.Te
         ]
     )
     return doc_boundaries[1:] - doc_boundaries[:-1]
+
+
+def get_document_lengths_from_offsets(eos_offsets: np.ndarray, start: int, end: int) -> torch.Tensor:
+    """
+    Like :func:`get_document_lengths()` for the tokens ``start`` to ``end`` of a file, but using a sorted array
+    of the offsets of every EOS token in that file instead of scanning the tokens themselves.
+    """
+    first, last = np.searchsorted(eos_offsets, [start, end], side="left")
+    eos_positions = np.asarray(eos_offsets[first:last], dtype=np.int64) - start
+    if len(eos_positions) == 0 or eos_positions[-1] != end - start - 1:
+        eos_positions = np.append(eos_positions, end - start - 1)
+    return torch.from_numpy(np.diff(eos_positions, prepend=-1).astype(np.int32))
+
+
+def write_array_file(array: np.ndarray, target: PathOrStr, save_overwrite: bool = False):
+    """
+    Write the raw bytes of ``array`` to a local or remote ``target``, such as an index next to a data file.
+    """
+    if is_url(target) and not str(target).startswith("file://"):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tmp_path = os.path.join(tmp_dir, os.path.basename(str(target)))
+            array.tofile(tmp_path)
+            upload(tmp_path, str(target), save_overwrite=save_overwrite)
+    else:
+        target = str(target).replace("file://", "", 1)
+        if not save_overwrite and os.path.exists(target):
+            raise FileExistsError(target)
+        # Write to a temporary file first so readers never see a partial file.
+        tmp_path = f"{target}.{os.getpid()}.tmp"
+        array.tofile(tmp_path)
+        os.replace(tmp_path, target)
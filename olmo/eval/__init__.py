@@ -1,19 +1,23 @@
-from typing import Dict, List, Union
+from typing import Dict, List, Optional, Union
 
 import torch
-from torch.utils.data import DataLoader, DistributedSampler
+from torch.utils.data import DataLoader, DistributedSampler, Sampler
 from torchmetrics import MeanMetric, Metric
 
 from ..config import EvaluatorConfig, EvaluatorType, TrainConfig
 from ..exceptions import OLMoConfigurationError
 from ..tokenizer import Tokenizer
 from ..torch_util import get_global_rank, get_world_size
-from .downstream import ICLMetric, label_to_task_map
+from .downstream import ICLMetric, continuation_positions, label_to_task_map
 from .evaluator import Evaluator
+from .shared_context import DocumentDistributedSampler, continuation_logits
 
 __all__ = [
     "Evaluator",
     "ICLMetric",
+    "DocumentDistributedSampler",
+    "continuation_logits",
+    "continuation_positions",
     "label_to_task_map",
     "build_downstream_evaluator",
     "build_evaluator",
@@ -34,8 +38,14 @@ def build_downstream_evaluator(
         task_class, task_kwargs = task_class
     ds_eval_dataset = task_class(tokenizer=tokenizer, **task_kwargs)  # type: ignore
     data_config = eval_cfg.data
+    ds_eval_sampler: Optional[Sampler]
     if is_unit_test:
         ds_eval_sampler = None
+    elif eval_cfg.share_context:
+        # Continuations can only share their context within a batch.
+        ds_eval_sampler = DocumentDistributedSampler(
+            ds_eval_dataset, num_replicas=get_world_size(), rank=get_global_rank()
+        )
     else:
         ds_eval_sampler = DistributedSampler(
             ds_eval_dataset,
@@ -64,6 +74,7 @@ def build_downstream_evaluator(
         eval_loader=ds_eval_dataloader,
         eval_metric=metric.to(device),
         subset_num_batches=eval_cfg.subset_num_batches,
+        share_context=eval_cfg.share_context,
     )
     return evaluator
 
@@ -101,6 +112,7 @@ def build_evaluator(
             eval_loader=eval_loader,
             eval_metric=eval_metric,
             subset_num_batches=eval_config.subset_num_batches,
+            metadata_table=eval_loader.dataset.metadata_table,  # type: ignore[attr-defined]
         )
     else:
         raise ValueError(f"Unexpected evaluator type '{eval_config.type}'")
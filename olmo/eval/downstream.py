@@ -25,6 +25,19 @@ METRIC_FROM_OE_EVAL = {
 LOG_2_OF_E = 1.44269504089
 
 
+def continuation_positions(batch: Dict[str, Any]) -> torch.Tensor:
+    """
+    The positions of a batch from :meth:`ICLMultiChoiceTaskDataset.collate_fn()` whose logits predict the
+    continuation tokens, of shape ``(batch_size, max_cont_len)``, for the ``logits_positions`` of
+    :meth:`OLMo.forward() <olmo.model.OLMo.forward>`. Positions past the end of a shorter continuation are
+    clamped to the last position of the batch.
+    """
+    ctx_len, cont_len = batch["ctx_len"], batch["cont_len"]
+    offsets = torch.arange(int(cont_len.max()), device=ctx_len.device)
+    positions = (ctx_len - 1).unsqueeze(-1) + offsets.unsqueeze(0)
+    return positions.clamp(max=batch["input_ids"].shape[-1] - 1)
+
+
 class ICLMetric(Metric):
     # update method does not require access to global metric state
     full_state_update: bool = False
@@ -44,7 +57,18 @@ class ICLMetric(Metric):
         self.loglikelihoods = []
         self.labels = []
 
-    def update(self, batch: Dict[str, Any], lm_logits: torch.Tensor, dc_lm_logits=None):
+    def update(
+        self,
+        batch: Dict[str, Any],
+        lm_logits: torch.Tensor,
+        dc_lm_logits=None,
+        continuation_logits_only: bool = False,
+    ):
+        """
+        :param continuation_logits_only: If ``True``, ``lm_logits`` only has the logits for the continuation
+            tokens, like from :func:`~olmo.eval.shared_context.continuation_logits()` or from
+            :meth:`OLMo.forward() <olmo.model.OLMo.forward>` with :func:`continuation_positions()`.
+        """
         lm_logits = F.log_softmax(lm_logits, dim=-1)
 
         if self.metric_type == "pmi_dc":
@@ -56,9 +80,8 @@ class ICLMetric(Metric):
             # get logits from LM for the continuation: [cont_len, vocab]
             # batch['input_ids'][idx] -> ctx + cont + padding
             # -1 in both indices: lm_logits will be left shited 1 pos as 0th pos in input generates next token in the 0th pos of lm_logits
-            lm_cont_logits = lm_logits[idx][
-                batch["ctx_len"][idx] - 1 : batch["ctx_len"][idx] + batch["cont_len"][idx] - 1
-            ]
+            cont_start = 0 if continuation_logits_only else batch["ctx_len"][idx] - 1
+            lm_cont_logits = lm_logits[idx][cont_start : cont_start + batch["cont_len"][idx]]
 
             log_likelihood: torch.Tensor
             if self.metric_type == "pmi_dc":
@@ -1,5 +1,5 @@
 from dataclasses import dataclass
-from typing import Any, Dict, Optional, Union
+from typing import Any, Dict, List, Optional, Union
 
 import torch
 from torch.utils.data import DataLoader
@@ -18,6 +18,16 @@ class Evaluator:
     eval_loader: DataLoader
     eval_metric: Union[Metric, Dict[str, Metric]]
     subset_num_batches: Optional[int] = None
+    metadata_table: Optional[List[Dict[str, Any]]] = None
+    """
+    For LM evaluators, the metadata that the ``source_id`` of each instance refers to,
+    see :data:`~olmo.data.MemMapDataset.metadata_table`.
+    """
+    share_context: bool = False
+    """
+    For downstream evaluators, whether to run the context of each document once for all of its continuations,
+    see :func:`~olmo.eval.shared_context.continuation_logits()`.
+    """
 
     def reset_metrics(self) -> None:
         if isinstance(self.eval_metric, Metric):
@@ -67,19 +77,31 @@ class Evaluator:
     def update_metrics(
         self,
         batch: Dict[str, Any],
-        ce_loss: torch.Tensor,
-        logits: torch.Tensor,
+        ce_loss: Optional[torch.Tensor],
+        logits: Optional[torch.Tensor],
+        continuation_logits_only: bool = False,
     ) -> None:
+        """
+        :param continuation_logits_only: For downstream evaluators, whether ``logits`` are only for the
+            continuation tokens, see :meth:`ICLMetric.update() <olmo.eval.downstream.ICLMetric.update>`.
+        """
         if self.type == EvaluatorType.downstream:
             assert isinstance(self.eval_metric, ICLMetric)
-            self.eval_metric.update(batch, logits)  # type: ignore
+            assert logits is not None
+            self.eval_metric.update(batch, logits, continuation_logits_only=continuation_logits_only)
         elif self.type == EvaluatorType.lm:
+            assert ce_loss is not None
             # Metric(s) = cross entropy loss
-            for metadata, instance_loss in zip(batch["metadata"], ce_loss):
-                if isinstance(self.eval_metric, dict):
-                    metric = self.eval_metric[metadata["label"]]
-                else:
-                    metric = self.eval_metric
-                metric.update(instance_loss)
+            if isinstance(self.eval_metric, Metric):
+                self.eval_metric.update(ce_loss)
+            elif "source_id" in batch:
+                assert self.metadata_table is not None
+                source_ids = batch["source_id"]
+                for source_id in source_ids.unique().tolist():
+                    label = self.metadata_table[source_id]["label"]
+                    self.eval_metric[label].update(ce_loss[source_ids == source_id])
+            else:
+                for metadata, instance_loss in zip(batch["metadata"], ce_loss):
+                    self.eval_metric[metadata["label"]].update(instance_loss)
         else:
             raise ValueError(f"Unexpected evaluator type '{self.type}'")
@@ -0,0 +1,130 @@
+"""
+Multiple-choice evaluation that runs each context once.
+
+:class:`~olmo.eval.downstream.ICLMultiChoiceTaskDataset` has one instance for every continuation of a
+document, each with the full context in front of it, so normally the context is run through the model once
+for every continuation. With ``share_context`` on a downstream evaluator, :func:`continuation_logits()`
+instead runs every distinct context in a batch once, keeps its keys and values in a
+:class:`~olmo.model.PagedKVCache`, and then runs all continuations of the batch against it at once.
+:class:`DocumentDistributedSampler` keeps the continuations of each document on the same rank and in the
+same batches, so that they can share their context.
+"""
+
+import math
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import torch
+import torch.nn as nn
+from torch.utils.data import Sampler
+
+from ..model import PagedKVCache
+from .downstream import ICLMultiChoiceTaskDataset
+
+__all__ = ["DocumentDistributedSampler", "continuation_logits"]
+
+
+class DocumentDistributedSampler(Sampler[int]):
+    """
+    Like a :class:`~torch.utils.data.DistributedSampler` without shuffling, except that it splits a
+    :class:`~olmo.eval.downstream.ICLMultiChoiceTaskDataset` between ranks by document, keeping the
+    instances of each document next to each other. Ranks with fewer instances repeat some of theirs, which
+    :class:`~olmo.eval.downstream.ICLMetric` only counts once.
+    """
+
+    def __init__(self, dataset: ICLMultiChoiceTaskDataset, num_replicas: int, rank: int):
+        self.num_replicas = num_replicas
+        self.rank = rank
+        documents: Dict[int, List[int]] = {}
+        for index, sample in enumerate(dataset.samples):
+            documents.setdefault(sample["doc_id"], []).append(index)
+        rank_indices: List[List[int]] = [[] for _ in range(num_replicas)]
+        for i, indices in enumerate(documents.values()):
+            rank_indices[i % num_replicas].extend(indices)
+        self.num_samples = max(len(indices) for indices in rank_indices) if rank_indices else 0
+        indices = rank_indices[rank]
+        if indices and len(indices) < self.num_samples:
+            indices = (indices * math.ceil(self.num_samples / len(indices)))[: self.num_samples]
+        self.indices = indices
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.indices)
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+
+def _left_pad(sequences: List[List[int]], device: torch.device) -> torch.Tensor:
+    seq_len = max(len(sequence) for sequence in sequences)
+    input_ids = torch.zeros((len(sequences), seq_len), dtype=torch.long)
+    for i, sequence in enumerate(sequences):
+        input_ids[i, seq_len - len(sequence) :] = torch.tensor(sequence, dtype=torch.long)
+    return input_ids.to(device)
+
+
+def continuation_logits(model: nn.Module, batch: Dict[str, Any], n_layers: Optional[int] = None) -> torch.Tensor:
+    """
+    Get the logits that predict the continuation tokens of a batch of a
+    :class:`~olmo.eval.downstream.ICLMultiChoiceTaskDataset`, running every distinct context of the batch
+    only once.
+
+    :param model: An :class:`~olmo.model.OLMo` model, which can be wrapped in FSDP.
+    :param batch: The batch.
+    :param n_layers: The number of blocks of the model, which defaults to ``model.config.n_layers``.
+
+    :returns: A tensor of shape ``(batch_size, max_cont_len, vocab_size)``, where ``[i, j]`` are the logits
+        for the ``j``-th continuation token of the ``i``-th instance, like
+        ``model(batch["input_ids"]).logits[i, ctx_len[i] - 1 + j]`` would be.
+    """
+    if n_layers is None:
+        n_layers = model.config.n_layers  # type: ignore
+    assert n_layers is not None
+    device = batch["input_ids"].device
+    queries: List[List[int]] = batch["input_ids"].tolist()
+    ctx_lens: List[int] = batch["ctx_len"].tolist()
+    cont_lens: List[int] = batch["cont_len"].tolist()
+
+    # The distinct contexts, and which one each instance continues.
+    context_ids: Dict[Tuple[int, ...], int] = {}
+    instance_contexts: List[int] = []
+    for query, ctx_len in zip(queries, ctx_lens):
+        assert ctx_len > 0
+        instance_contexts.append(context_ids.setdefault(tuple(query[:ctx_len]), len(context_ids)))
+    contexts = [list(context) for context in context_ids]
+
+    # Pages of a single position, so that continuations can point at the positions of their context directly.
+    context_pages: List[List[int]] = []
+    next_page = 0
+    for context in contexts:
+        context_pages.append(list(range(next_page, next_page + len(context))))
+        next_page += len(context)
+    rows = [i for i, cont_len in enumerate(cont_lens) if cont_len > 1]
+    # The last continuation token is never an input.
+    num_pages = next_page + sum(cont_len - 1 for cont_len in cont_lens)
+    if not rows:
+        # Under FSDP every rank has to run the same number of forward passes, so without any longer
+        # continuations this runs the first continuation token of the first instance, and ignores the result.
+        num_pages += 1
+    cache = PagedKVCache(n_layers, num_pages=num_pages, page_size=1)
+
+    # Run the contexts, which gives the logits for the first continuation token.
+    cache.schedule(context_pages, [0] * len(contexts), [len(context) for context in contexts], device)
+    # shape: (num_contexts, vocab_size)
+    context_logits = model(_left_pad(contexts, device), past_key_values=cache, last_logits_only=True).logits[:, -1]
+    logits = context_logits.new_zeros((len(queries), max(cont_lens), context_logits.shape[-1]))
+    logits[:, 0] = context_logits[torch.tensor(instance_contexts, device=device)]
+
+    # Run the rest of the continuations after their context.
+    page_tables: List[List[int]] = []
+    inputs: List[List[int]] = []
+    for i in rows or [0]:
+        num_inputs = max(cont_lens[i] - 1, 1)
+        page_tables.append(context_pages[instance_contexts[i]] + list(range(next_page, next_page + num_inputs)))
+        inputs.append(queries[i][ctx_lens[i] : ctx_lens[i] + num_inputs])
+        next_page += num_inputs
+    cache.schedule(page_tables, [ctx_lens[i] for i in rows or [0]], [len(x) for x in inputs], device)
+    # shape: (len(rows), max_cont_len - 1, vocab_size)
+    rest_logits = model(_left_pad(inputs, device), past_key_values=cache).logits
+    seq_len = rest_logits.shape[1]
+    for row, i in enumerate(rows):
+        logits[i, 1 : cont_lens[i]] = rest_logits[row, seq_len - cont_lens[i] + 1 :]
+    return logits
@@ -0,0 +1,159 @@
+"""
+A cross-entropy loss fused with the output projection of a model, which never materializes the logits of
+more than a chunk of positions at a time.
+
+The logits of a full training micro-batch, ``(batch_size * seq_len, vocab_size)`` in float32, are usually
+the largest activation of a training step. :func:`chunked_cross_entropy_loss()` instead takes the final hidden
+states and the weight of the output projection, and computes the logits, the loss, and the z-loss one chunk
+of positions at a time. The backward pass computes the logits of each chunk again rather than keeping them.
+"""
+
+from typing import Optional, Tuple
+
+import torch
+import torch.nn.functional as F
+
+__all__ = ["chunked_cross_entropy_loss"]
+
+
+class _ChunkedLinearCrossEntropy(torch.autograd.Function):
+    @staticmethod
+    def forward(  # type: ignore[override]
+        ctx,
+        x: torch.Tensor,
+        weight: torch.Tensor,
+        bias: Optional[torch.Tensor],
+        labels: torch.Tensor,
+        ignore_index: int,
+        logit_scale: float,
+        z_loss_multiplier: float,
+        chunk_size: int,
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        ce_loss = x.new_zeros(x.shape[0], dtype=torch.float32)
+        lse = x.new_zeros(x.shape[0], dtype=torch.float32)
+        compute_dtype = x.dtype
+        for start in range(0, x.shape[0], chunk_size):
+            end = min(start + chunk_size, x.shape[0])
+            # Under autocast this runs in the autocast dtype, like the output projection of the model would.
+            logits = F.linear(x[start:end], weight, bias)
+            compute_dtype = logits.dtype
+            # shape: (chunk_size, vocab_size)
+            logits = logits.float()
+            if logit_scale != 1.0:
+                logits.mul_(logit_scale)
+            chunk_labels = labels[start:end]
+            mask = chunk_labels != ignore_index
+            chunk_lse = logits.logsumexp(-1)
+            target_logits = logits.gather(1, chunk_labels.masked_fill(~mask, 0).unsqueeze(1)).squeeze(1)
+            ce_loss[start:end] = (chunk_lse - target_logits) * mask
+            lse[start:end] = chunk_lse
+        z_loss = z_loss_multiplier * lse.pow(2)
+
+        ctx.save_for_backward(x, weight, bias, labels, lse)
+        ctx.ignore_index = ignore_index
+        ctx.logit_scale = logit_scale
+        ctx.z_loss_multiplier = z_loss_multiplier
+        ctx.chunk_size = chunk_size
+        ctx.compute_dtype = compute_dtype
+        return ce_loss, z_loss
+
+    @staticmethod
+    def backward(ctx, grad_ce_loss: torch.Tensor, grad_z_loss: torch.Tensor):  # type: ignore[override]
+        x, weight, bias, labels, lse = ctx.saved_tensors
+        # The backward pass doesn't run under autocast, so cast to the dtype of the forward pass explicitly.
+        compute_weight = weight.to(ctx.compute_dtype)
+        compute_bias = None if bias is None else bias.to(ctx.compute_dtype)
+        grad_x = torch.empty_like(x) if ctx.needs_input_grad[0] else None
+        grad_weight = torch.zeros_like(weight, dtype=torch.float32) if ctx.needs_input_grad[1] else None
+        grad_bias = (
+            torch.zeros_like(bias, dtype=torch.float32) if bias is not None and ctx.needs_input_grad[2] else None
+        )
+        for start in range(0, x.shape[0], ctx.chunk_size):
+            end = min(start + ctx.chunk_size, x.shape[0])
+            chunk_x = x[start:end].to(ctx.compute_dtype)
+            # shape: (chunk_size, vocab_size)
+            logits = F.linear(chunk_x, compute_weight, compute_bias).float()
+            if ctx.logit_scale != 1.0:
+                logits.mul_(ctx.logit_scale)
+            chunk_labels = labels[start:end]
+            mask = chunk_labels != ctx.ignore_index
+            chunk_lse = lse[start:end]
+            # d(lse)/d(logits) is the softmax, d(ce_loss)/d(logits) is the softmax minus the one-hot labels,
+            # and d(z_loss)/d(logits) is 2 * z_loss_multiplier * lse * softmax.
+            # shape: (chunk_size, vocab_size)
+            grad_logits = logits.sub_(chunk_lse.unsqueeze(1)).exp_()
+            grad_lse = 2 * ctx.z_loss_multiplier * chunk_lse * grad_z_loss[start:end]
+            grad_logits.mul_((grad_ce_loss[start:end] * mask + grad_lse).unsqueeze(1))
+            grad_logits.scatter_add_(
+                1,
+                chunk_labels.masked_fill(~mask, 0).unsqueeze(1),
+                -(grad_ce_loss[start:end] * mask).unsqueeze(1),
+            )
+            if ctx.logit_scale != 1.0:
+                grad_logits.mul_(ctx.logit_scale)
+            if grad_bias is not None:
+                grad_bias.add_(grad_logits.sum(0))
+            grad_logits = grad_logits.to(ctx.compute_dtype)
+            if grad_x is not None:
+                grad_x[start:end] = grad_logits @ compute_weight
+            if grad_weight is not None:
+                grad_weight.add_((grad_logits.t() @ chunk_x).float())
+        return (
+            grad_x,
+            None if grad_weight is None else grad_weight.to(weight.dtype),
+            None if grad_bias is None else grad_bias.to(bias.dtype),
+            None,
+            None,
+            None,
+            None,
+            None,
+        )
+
+
+def chunked_cross_entropy_loss(
+    x: torch.Tensor,
+    weight: torch.Tensor,
+    labels: torch.Tensor,
+    bias: Optional[torch.Tensor] = None,
+    ignore_index: int = -100,
+    reduction: str = "mean",
+    compute_z_loss: bool = False,
+    z_loss_multiplier: float = 1e-4,
+    logit_scale: float = 1.0,
+    chunk_size: int = 1024,
+) -> Tuple[torch.Tensor, Optional[torch.Tensor]]:
+    """
+    The same as :func:`~olmo.train.cross_entropy_loss()` on the logits
+    ``logit_scale * F.linear(x, weight, bias)``, but without ever materializing more than ``chunk_size``
+    positions of them.
+
+    :param x: The final hidden states, a tensor of shape ``(num_positions, d_model)``.
+    :param weight: The weight of the output projection, a tensor of shape ``(vocab_size, d_model)``.
+    :param labels: The target token IDs of every position, a tensor of shape ``(num_positions,)``.
+    :param bias: The bias of the output projection, if any.
+    :param ignore_index: Positions with this label don't count towards either loss.
+    :param reduction: ``"mean"``, ``"sum"``, or ``"none"``.
+    :param compute_z_loss: Whether to also compute the z-loss.
+    :param z_loss_multiplier: The multiplier of the z-loss.
+    :param logit_scale: What to multiply the logits by.
+    :param chunk_size: The number of positions to compute the logits of at a time.
+
+    :returns: The loss and the z-loss, which is ``None`` unless ``compute_z_loss`` is set.
+    """
+    ce_loss, z_loss = _ChunkedLinearCrossEntropy.apply(
+        x, weight, bias, labels, ignore_index, logit_scale, z_loss_multiplier, chunk_size
+    )
+    mask = labels != ignore_index
+    if reduction == "mean":
+        ce_loss = ce_loss.sum() / mask.sum()
+        # Like `cross_entropy_loss()`, this averages the z-loss over all positions.
+        z_loss = (z_loss * mask).mean()
+    elif reduction == "sum":
+        ce_loss = ce_loss.sum()
+        z_loss = (z_loss * mask).sum()
+    elif reduction != "none":
+        raise ValueError(f"Unknown reduction '{reduction}'")
+
+    if not compute_z_loss:
+        return ce_loss, None
+    return ce_loss, z_loss
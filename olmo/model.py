@@ -22,6 +22,7 @@ from typing import (
     Sequence,
     Set,
     Tuple,
+    Union,
     cast,
 )
 
@@ -47,6 +48,7 @@ from .config import (
 )
 from .exceptions import OLMoConfigurationError
 from .initialization import init_normal
+from .loss import chunked_cross_entropy_loss
 from .torch_util import ensure_finite_, get_cumulative_document_lengths
 
 if sys.version_info.minor > 8:
@@ -70,6 +72,8 @@ __all__ = [
     "OLMo",
     "OLMoOutput",
     "OLMoGenerateOutput",
+    "StaticKVCache",
+    "PagedKVCache",
 ]
 
 log = logging.getLogger(__name__)
@@ -304,17 +308,37 @@ class RotaryEmbedding(nn.Module):
     def apply_rotary_pos_emb(self, pos_sin: torch.Tensor, pos_cos: torch.Tensor, t: torch.Tensor) -> torch.Tensor:
         return ((t * pos_cos) + (self.rotate_half(t) * pos_sin)).to(t.dtype)
 
-    def forward(self, q: torch.Tensor, k: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+    def forward(
+        self,
+        q: torch.Tensor,
+        k: torch.Tensor,
+        position_offset: int = 0,
+        positions: Optional[torch.Tensor] = None,
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        :param position_offset: The position of the first key, when keys before it aren't included in ``k``.
+        :param positions: The position of each query and key, of shape ``(batch_size, seq_len)``, when they
+            differ between sequences.
+        """
         if self.config.rope_full_precision:
             q_, k_ = q.float(), k.float()
         else:
             q_, k_ = q, k
 
         with torch.autocast(q.device.type, enabled=False):
+            if positions is not None:
+                pos_sin, pos_cos = self.get_rotary_embedding(int(positions.max()) + 1, q_.device)
+                # shape: (batch_size, 1, seq_len, head_dim)
+                pos_sin = pos_sin[0, 0][positions].unsqueeze(1).type_as(q_)
+                pos_cos = pos_cos[0, 0][positions].unsqueeze(1).type_as(q_)
+                q_ = self.apply_rotary_pos_emb(pos_sin, pos_cos, q_)
+                k_ = self.apply_rotary_pos_emb(pos_sin, pos_cos, k_)
+                return q_.type_as(q), k_.type_as(k)
+
             query_len, key_len = q_.shape[-2], k_.shape[-2]  # could be different if layer_past not None
-            pos_sin, pos_cos = self.get_rotary_embedding(key_len, q_.device)
-            pos_sin = pos_sin.type_as(q_)
-            pos_cos = pos_cos.type_as(q_)
+            pos_sin, pos_cos = self.get_rotary_embedding(position_offset + key_len, q_.device)
+            pos_sin = pos_sin[:, :, position_offset:, :].type_as(q_)
+            pos_cos = pos_cos[:, :, position_offset:, :].type_as(q_)
             q_ = self.apply_rotary_pos_emb(
                 pos_sin[:, :, key_len - query_len : key_len, :],
                 pos_cos[:, :, key_len - query_len : key_len, :],
@@ -408,6 +432,248 @@ def alibi_attention_bias(seq_len: int, config: ModelConfig, device: torch.device
     return alibi_bias * (1.0 / (2 ** m.view(1, config.n_heads, 1, 1)))  # type: ignore
 
 
+class StaticKVCache:
+    """
+    Attention keys and values of every block for up to ``max_length`` positions, allocated once and written
+    in place, for decoding without reallocating and copying the whole cache on every step like
+    ``past_key_values`` do.
+
+    Pass it to :meth:`OLMo.forward()` as ``past_key_values``. Each forward pass writes the keys and values of its
+    inputs after the ones that are already cached, and then advances :data:`length` past them.
+
+    :param n_layers: The number of blocks.
+    :param batch_size: The maximum number of sequences.
+    :param max_length: The maximum number of positions of each sequence, including the prompt.
+    """
+
+    def __init__(self, n_layers: int, batch_size: int, max_length: int):
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.length = 0
+        # Allocated on the first write, in the dtype and on the device of the keys and values.
+        self.keys: List[Optional[torch.Tensor]] = [None] * n_layers
+        self.values: List[Optional[torch.Tensor]] = [None] * n_layers
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [StaticKVCacheLayer(self, i) for i in range(len(self))[index]]
+        return StaticKVCacheLayer(self, index)
+
+    def update(self, layer: int, k: torch.Tensor, v: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Write the keys and values of shape ``(batch_size, n_kv_heads, seq_len, head_dim)`` for new positions of
+        a block, and get views of all of its cached keys and values including those.
+        """
+        batch_size, n_kv_heads, seq_len, head_dim = k.shape
+        end = self.length + seq_len
+        if end > self.max_length:
+            raise ValueError(f"The cache only has room for {self.max_length} positions, got {end}")
+        if batch_size > self.batch_size:
+            raise ValueError(f"The cache only has room for {self.batch_size} sequences, got {batch_size}")
+        keys, values = self.keys[layer], self.values[layer]
+        if keys is None or values is None:
+            keys = k.new_zeros((self.batch_size, n_kv_heads, self.max_length, head_dim))
+            values = v.new_zeros((self.batch_size, n_kv_heads, self.max_length, head_dim))
+            self.keys[layer], self.values[layer] = keys, values
+        keys[:batch_size, :, self.length : end] = k
+        values[:batch_size, :, self.length : end] = v
+        return keys[:batch_size, :, :end], values[:batch_size, :, :end]
+
+    def advance(self, num_positions: int):
+        self.length += num_positions
+
+    def reorder(self, rows: torch.Tensor):
+        """
+        Replace the first ``len(rows)`` sequences with the cached sequences at ``rows``, like beam search
+        needs after each step.
+        """
+        for keys, values in zip(self.keys, self.values):
+            if keys is None or values is None:
+                continue
+            keys[: len(rows), :, : self.length] = keys[rows, :, : self.length]
+            values[: len(rows), :, : self.length] = values[rows, :, : self.length]
+
+    def reset(self):
+        self.length = 0
+
+
+class StaticKVCacheLayer:
+    """
+    The part of a :class:`StaticKVCache` for one block.
+    """
+
+    def __init__(self, cache: StaticKVCache, layer: int):
+        self.cache = cache
+        self.layer = layer
+
+    @property
+    def length(self) -> int:
+        return self.cache.length
+
+    def update(self, k: torch.Tensor, v: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        return self.cache.update(self.layer, k, v)
+
+
+class PagedKVCache:
+    """
+    Attention keys and values of every block for many sequences of different lengths, in pages of
+    ``page_size`` positions that are allocated once and handed out to sequences as they grow, like a
+    continuous batching engine needs to add and remove sequences between forward passes.
+
+    Before each forward pass, :meth:`schedule()` sets up which pages each sequence of the batch has, how many
+    of its positions are already cached, and how many new ones there are. The new ones are left-padded to the
+    same length, so that the last position of every sequence is the last one of the batch. Then pass the cache
+    to :meth:`OLMo.forward()` as ``past_key_values``, without an ``attention_mask`` or ``attention_bias``.
+    Each forward pass writes the keys and values of the new positions into their pages.
+
+    :param n_layers: The number of blocks.
+    :param num_pages: The number of pages.
+    :param page_size: The number of positions in each page.
+    """
+
+    def __init__(self, n_layers: int, num_pages: int, page_size: int):
+        self.num_pages = num_pages
+        self.page_size = page_size
+        # Allocated by `allocate()` or on the first write, of shape (num_pages * page_size, n_kv_heads, head_dim).
+        self.keys: List[Optional[torch.Tensor]] = [None] * n_layers
+        self.values: List[Optional[torch.Tensor]] = [None] * n_layers
+        self.positions: Optional[torch.Tensor] = None
+        self._new_mask: Optional[torch.Tensor] = None
+        self._write_slots: Optional[torch.Tensor] = None
+        self._read_slots: Optional[torch.Tensor] = None
+        self._read_mask: Optional[torch.Tensor] = None
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [PagedKVCacheLayer(self, i) for i in range(len(self))[index]]
+        return PagedKVCacheLayer(self, index)
+
+    def allocate(self, n_kv_heads: int, head_dim: int, dtype: torch.dtype, device: torch.device):
+        """
+        Allocate the keys and values of every block up front, rather than on the first write.
+        """
+        shape = (self.num_pages * self.page_size, n_kv_heads, head_dim)
+        for layer in range(len(self)):
+            self.keys[layer] = torch.zeros(shape, dtype=dtype, device=device)
+            self.values[layer] = torch.zeros(shape, dtype=dtype, device=device)
+
+    def schedule(
+        self,
+        page_tables: Sequence[Sequence[int]],
+        past_lengths: Sequence[int],
+        num_new_positions: Sequence[int],
+        device: torch.device,
+    ):
+        """
+        Set up the next forward pass.
+
+        :param page_tables: The pages of each sequence, in order, with room for its new positions.
+        :param past_lengths: The number of positions of each sequence that are already cached.
+        :param num_new_positions: The number of new positions of each sequence.
+        """
+        seq_len = max(num_new_positions)
+        key_len = max(past + new for past, new in zip(past_lengths, num_new_positions))
+        # shape: (batch_size, seq_len)
+        offsets = torch.arange(seq_len).unsqueeze(0) - seq_len
+        positions = (
+            offsets + torch.tensor([past + new for past, new in zip(past_lengths, num_new_positions)])[:, None]
+        )
+        new_mask = offsets >= -torch.tensor(num_new_positions)[:, None]
+        # shape: (batch_size, key_len)
+        key_positions = torch.arange(key_len).unsqueeze(0).expand(len(page_tables), -1)
+        read_mask = key_positions < (positions[:, -1:] + 1)
+        slots = torch.zeros((len(page_tables), key_len), dtype=torch.long)
+        for i, pages in enumerate(page_tables):
+            length = past_lengths[i] + num_new_positions[i]
+            if len(pages) * self.page_size < length:
+                raise ValueError(f"Sequence {i} has {len(pages)} pages for {length} positions")
+            page_slots = torch.tensor(pages, dtype=torch.long)[:, None] * self.page_size + torch.arange(
+                self.page_size
+            )
+            slots[i, :length] = page_slots.view(-1)[:length]
+
+        self.positions = positions.clamp(min=0).to(device)
+        self._new_mask = new_mask.to(device)
+        self._write_slots = slots.gather(1, positions.clamp(min=0))[new_mask].to(device)
+        self._read_slots = slots.to(device)
+        self._read_mask = read_mask.to(device)
+
+    def attention_bias(self, config: ModelConfig) -> torch.Tensor:
+        """
+        The attention bias of shape ``(batch_size, 1 or n_heads, seq_len, key_len)`` for the scheduled batch.
+        """
+        assert self.positions is not None and self._read_mask is not None and self._new_mask is not None
+        key_positions = torch.arange(self._read_mask.shape[-1], device=self.positions.device)
+        # shape: (batch_size, seq_len, key_len)
+        allowed = (
+            self._read_mask[:, None, :]
+            & (key_positions[None, None, :] <= self.positions[:, :, None])
+            & self._new_mask[:, :, None]
+        )
+        bias = torch.zeros(allowed.shape, dtype=torch.float, device=allowed.device)
+        bias.masked_fill_(~allowed, torch.finfo(bias.dtype).min)
+        # shape: (batch_size, 1, seq_len, key_len)
+        bias = bias.unsqueeze(1)
+        if config.alibi:
+            distance = (self.positions[:, :, None] - key_positions[None, None, :]).abs().float()
+            m = torch.arange(1, config.n_heads + 1, dtype=torch.float, device=bias.device)
+            m.mul_(config.alibi_bias_max / config.n_heads)
+            # shape: (batch_size, n_heads, seq_len, key_len)
+            bias = bias - distance.unsqueeze(1) * (1.0 / (2 ** m.view(1, config.n_heads, 1, 1)))
+            ensure_finite_(bias, check_neg_inf=True, check_pos_inf=False)
+        return bias
+
+    def update(self, layer: int, k: torch.Tensor, v: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Write the keys and values of shape ``(batch_size, n_kv_heads, seq_len, head_dim)`` for the new positions
+        of a block, and get all of its keys and values for the scheduled sequences, of shape
+        ``(batch_size, n_kv_heads, key_len, head_dim)``.
+        """
+        assert self._new_mask is not None and self._write_slots is not None and self._read_slots is not None
+        batch_size, n_kv_heads, _, head_dim = k.shape
+        keys, values = self.keys[layer], self.values[layer]
+        if keys is None or values is None:
+            keys = k.new_zeros((self.num_pages * self.page_size, n_kv_heads, head_dim))
+            values = v.new_zeros((self.num_pages * self.page_size, n_kv_heads, head_dim))
+            self.keys[layer], self.values[layer] = keys, values
+        keys.index_copy_(0, self._write_slots, k.transpose(1, 2)[self._new_mask])
+        values.index_copy_(0, self._write_slots, v.transpose(1, 2)[self._new_mask])
+        key_len = self._read_slots.shape[-1]
+        read_slots = self._read_slots.view(-1)
+        return (
+            keys[read_slots].view(batch_size, key_len, n_kv_heads, head_dim).transpose(1, 2),
+            values[read_slots].view(batch_size, key_len, n_kv_heads, head_dim).transpose(1, 2),
+        )
+
+
+class PagedKVCacheLayer:
+    """
+    The part of a :class:`PagedKVCache` for one block.
+    """
+
+    def __init__(self, cache: PagedKVCache, layer: int):
+        self.cache = cache
+        self.layer = layer
+
+    @property
+    def positions(self) -> torch.Tensor:
+        assert self.cache.positions is not None
+        return self.cache.positions
+
+    def update(self, k: torch.Tensor, v: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        return self.cache.update(self.layer, k, v)
+
+
+#: What blocks accept as the keys and values of previous positions.
+LayerPast = Union[Tuple[torch.Tensor, torch.Tensor], StaticKVCacheLayer, PagedKVCacheLayer]
+
+
 class OLMoBlock(nn.Module):
     """
     A base class for transformer block implementations.
@@ -591,7 +857,7 @@ class OLMoBlock(nn.Module):
         k: torch.Tensor,
         v: torch.Tensor,
         attention_bias: Optional[torch.Tensor] = None,
-        layer_past: Optional[Tuple[torch.Tensor, torch.Tensor]] = None,
+        layer_past: Optional[LayerPast] = None,
         use_cache: bool = False,
         max_doc_len: Optional[int] = None,
         cu_doc_lens: Optional[torch.Tensor] = None,
@@ -612,17 +878,29 @@ class OLMoBlock(nn.Module):
         # shape: (B, n_kv_h, T, hs)
         v = v.view(B, T, self.config.effective_n_kv_heads, C // self.config.n_heads).transpose(1, 2)
 
-        if layer_past is not None:
-            past_key, past_value = layer_past
-            k = torch.cat((past_key, k), dim=-2)
-            v = torch.cat((past_value, v), dim=-2)
+        if isinstance(layer_past, StaticKVCacheLayer):
+            # Keys are cached after the rotary embeddings, so only the new ones need them.
+            if self.config.rope:
+                q, k = self.rotary_emb(q, k, position_offset=layer_past.length)
+            k, v = layer_past.update(k, v)
+            present = (k, v) if use_cache else None
+        elif isinstance(layer_past, PagedKVCacheLayer):
+            if self.config.rope:
+                q, k = self.rotary_emb(q, k, positions=layer_past.positions)
+            k, v = layer_past.update(k, v)
+            present = (k, v) if use_cache else None
+        else:
+            if layer_past is not None:
+                past_key, past_value = layer_past
+                k = torch.cat((past_key, k), dim=-2)
+                v = torch.cat((past_value, v), dim=-2)
 
-        present = (k, v) if use_cache else None
-        query_len, key_len = q.shape[-2], k.shape[-2]  # could be different if layer_past not None
+            present = (k, v) if use_cache else None
 
-        if self.config.rope:
-            # Apply rotary embeddings.
-            q, k = self.rotary_emb(q, k)
+            if self.config.rope:
+                # Apply rotary embeddings.
+                q, k = self.rotary_emb(q, k)
+        query_len, key_len = q.shape[-2], k.shape[-2]  # could be different if layer_past not None
 
         if attention_bias is not None:
             # Resize and cast attention bias.
@@ -630,9 +908,9 @@ class OLMoBlock(nn.Module):
             # run in if AMP is enabled, and this can be a problem if some tokens are masked out due to padding
             # as down-casting the attention bias to the autocast precision will result in -infs, which will
             # cause the SDP attn function to produce NaNs.
-            attention_bias = self._cast_attn_bias(
-                attention_bias[:, :, key_len - query_len : key_len, :key_len], dtype
-            )
+            if attention_bias.shape[-2] != query_len:
+                attention_bias = attention_bias[:, :, key_len - query_len : key_len, :]
+            attention_bias = self._cast_attn_bias(attention_bias[:, :, :, :key_len], dtype)
 
         # Get the attention scores.
         # shape: (B, nh, T, hs)
@@ -658,7 +936,7 @@ class OLMoBlock(nn.Module):
         self,
         x: torch.Tensor,
         attention_bias: Optional[torch.FloatTensor] = None,
-        layer_past: Optional[Tuple[torch.Tensor, torch.Tensor]] = None,
+        layer_past: Optional[LayerPast] = None,
         use_cache: bool = False,
         max_doc_len: Optional[int] = None,
         cu_doc_lens: Optional[torch.Tensor] = None,
@@ -729,7 +1007,7 @@ class OLMoSequentialBlock(OLMoBlock):
         self,
         x: torch.Tensor,
         attention_bias: Optional[torch.Tensor] = None,
-        layer_past: Optional[Tuple[torch.Tensor, torch.Tensor]] = None,
+        layer_past: Optional[LayerPast] = None,
         use_cache: bool = False,
         max_doc_len: Optional[int] = None,
         cu_doc_lens: Optional[torch.Tensor] = None,
@@ -922,7 +1200,7 @@ class OLMoLlamaBlock(OLMoBlock):
         self,
         x: torch.Tensor,
         attention_bias: Optional[torch.Tensor] = None,
-        layer_past: Optional[Tuple[torch.Tensor, torch.Tensor]] = None,
+        layer_past: Optional[LayerPast] = None,
         use_cache: bool = False,
         max_doc_len: Optional[int] = None,
         cu_doc_lens: Optional[torch.Tensor] = None,
@@ -978,10 +1256,11 @@ class OLMoLlamaBlock(OLMoBlock):
 
 
 class OLMoOutput(NamedTuple):
-    logits: torch.FloatTensor
+    logits: Optional[torch.FloatTensor]
     """
     A tensor of shape `(batch_size, seq_len, vocab_size)` representing the log probabilities
-    for the next token *before* normalization via (log) softmax.
+    for the next token *before* normalization via (log) softmax. This is `None` when the model
+    computes the loss from `labels` instead.
     """
 
     attn_key_values: Optional[List[Tuple[torch.Tensor, torch.Tensor]]]
@@ -994,6 +1273,16 @@ class OLMoOutput(NamedTuple):
     Hidden states from each block.
     """
 
+    loss: Optional[torch.Tensor] = None
+    """
+    The cross-entropy loss, when `labels` are given.
+    """
+
+    z_loss: Optional[torch.Tensor] = None
+    """
+    The z-loss, when `labels` are given and `compute_z_loss` is set.
+    """
+
 
 class OLMoGenerateOutput(NamedTuple):
     token_ids: torch.LongTensor
@@ -1020,7 +1309,7 @@ class OLMoBlockGroup(nn.ModuleList):
         self,
         x: torch.Tensor,
         attention_bias: Optional[torch.FloatTensor] = None,
-        layers_past: Optional[List[Tuple[torch.Tensor, torch.Tensor]]] = None,
+        layers_past: Optional[Sequence[LayerPast]] = None,
         use_cache: bool = False,
         max_doc_len: Optional[int] = None,
         cu_doc_lens: Optional[torch.Tensor] = None,
@@ -1256,12 +1545,19 @@ class OLMo(nn.Module):
         input_embeddings: Optional[torch.FloatTensor] = None,
         attention_mask: Optional[torch.Tensor] = None,
         attention_bias: Optional[torch.Tensor] = None,
-        past_key_values: Optional[Sequence[Tuple[torch.Tensor, torch.Tensor]]] = None,
+        past_key_values: Optional[
+            Union[Sequence[Tuple[torch.Tensor, torch.Tensor]], StaticKVCache, PagedKVCache]
+        ] = None,
         use_cache: bool = False,
         last_logits_only: bool = False,
         output_hidden_states: Optional[bool] = None,
         doc_lens: Optional[torch.Tensor] = None,
         max_doc_lens: Optional[Sequence[int]] = None,
+        logits_positions: Optional[torch.Tensor] = None,
+        labels: Optional[torch.Tensor] = None,
+        loss_reduction: str = "mean",
+        compute_z_loss: bool = False,
+        loss_chunk_size: int = 1024,
     ) -> OLMoOutput:
         """
         :param input_ids: A tensor of shape `(batch_size, seq_len)`.
@@ -1289,21 +1585,47 @@ class OLMo(nn.Module):
         :param past_key_values: Pre-computed keys and values for each attention block.
             Can be used to speed up sequential decoding. The `input_ids` which have
             their past given to this model should not be passed as `input_ids` as they have already been computed.
+            This can also be a :class:`StaticKVCache`, which is updated in place, or a :class:`PagedKVCache`
+            that has been scheduled for `input_ids`, in which case `attention_mask` and `attention_bias`
+            aren't supported.
         :param use_cache: If `True`, return key and value tensors for each block.
         :param last_logits_only: If `True`, only compute the logits for the last token of each sequence.
             This can speed up decoding when you only care about the next token.
         :param doc_lens: Document lengths to use in attention for intra-document masking.
             Shape `(batch_size, max_docs)`.
         :param max_doc_lens: Maximum document length for each instance in the batch.
+        :param logits_positions: Only compute the logits for these positions, which saves the final layer norm
+            and the output projection for all others. This can be a tensor of indices of shape
+            `(batch_size, num_positions)` or `(num_positions,)`, which gives logits of shape
+            `(batch_size, num_positions, vocab_size)`, or a bool tensor of shape `(batch_size, seq_len)`,
+            which gives logits of shape `(num_selected_positions, vocab_size)`.
+        :param labels: A tensor of shape `(batch_size, seq_len)` with the target token ID of every position,
+            where `-100` means the position doesn't count. When given, the model returns the loss and
+            no logits, and computes the output projection together with the loss with
+            :func:`~olmo.loss.chunked_cross_entropy_loss()`, so that it only ever keeps the logits of
+            `loss_chunk_size` positions at a time.
+        :param loss_reduction: The reduction of the loss over positions, `"mean"`, `"sum"`, or `"none"`,
+            which gives a loss of shape `(batch_size, seq_len)`.
+        :param compute_z_loss: Whether to also compute the z-loss from `labels`.
+        :param loss_chunk_size: The number of positions to compute the logits of at a time for the loss.
         """
         output_hidden_states = output_hidden_states if output_hidden_states is not None else False
 
         if past_key_values:
             assert len(past_key_values) == self.config.n_layers
+        assert not (last_logits_only and logits_positions is not None)
+        assert labels is None or not (last_logits_only or logits_positions is not None)
 
         batch_size, seq_len = input_ids.size() if input_embeddings is None else input_embeddings.size()[:2]
         if past_key_values is None:
             past_length = 0
+        elif isinstance(past_key_values, StaticKVCache):
+            past_length = past_key_values.length
+        elif isinstance(past_key_values, PagedKVCache):
+            # Positions differ between sequences, see `PagedKVCache.positions`.
+            past_length = 0
+            if attention_mask is not None or attention_bias is not None:
+                raise ValueError("A paged KV cache can't be combined with an attention mask or bias")
         else:
             past_length = past_key_values[0][0].size(-2)
 
@@ -1323,9 +1645,15 @@ class OLMo(nn.Module):
 
         if not (self.config.alibi or self.config.rope):
             # Get positional embeddings.
-            # shape: (1, seq_len)
-            pos = torch.arange(past_length, past_length + seq_len, dtype=torch.long, device=x.device).unsqueeze(0)
-            # shape: (1, seq_len, d_model)
+            if isinstance(past_key_values, PagedKVCache):
+                # shape: (batch_size, seq_len)
+                pos = past_key_values[0].positions
+            else:
+                # shape: (1, seq_len)
+                pos = torch.arange(
+                    past_length, past_length + seq_len, dtype=torch.long, device=x.device
+                ).unsqueeze(0)
+            # shape: (1 or batch_size, seq_len, d_model)
             pos_emb = self.transformer.wpe(pos)  # type: ignore
             x = pos_emb + x
 
@@ -1340,7 +1668,9 @@ class OLMo(nn.Module):
             attention_mask = (1.0 - attention_mask) * torch.finfo(attention_mask.dtype).min
 
         # Merge attention mask with attention bias.
-        if (
+        if isinstance(past_key_values, PagedKVCache):
+            attention_bias = past_key_values.attention_bias(self.config)
+        elif (
             attention_bias is not None
             or attention_mask is not None
             or self.config.alibi
@@ -1364,8 +1694,9 @@ class OLMo(nn.Module):
             if attention_mask is not None:
                 mask_len = attention_mask.shape[-1]
             elif past_key_values is not None:
-                mask_len = past_key_values[0][0].shape[-2] + seq_len
-            attention_bias = attention_bias[:, :, :mask_len, :mask_len].to(dtype=torch.float)
+                mask_len = past_length + seq_len
+            # Only the rows for the new positions are needed.
+            attention_bias = attention_bias[:, :, mask_len - seq_len : mask_len, :mask_len].to(dtype=torch.float)
 
             # Add in the masking bias.
             if attention_mask is not None:
@@ -1438,19 +1769,57 @@ class OLMo(nn.Module):
                     assert cache is not None
                     attn_key_values.extend(cache)
 
+        if isinstance(past_key_values, StaticKVCache):
+            past_key_values.advance(seq_len)
+
         if last_logits_only:
             # shape: (batch_size, 1, d_model)
             x = x[:, -1, :].unsqueeze(1)
+        elif logits_positions is not None and logits_positions.dtype == torch.bool:
+            # shape: (num_selected_positions, d_model)
+            x = x[logits_positions]
+        elif logits_positions is not None:
+            if logits_positions.dim() == 1:
+                logits_positions = logits_positions.unsqueeze(0).expand(batch_size, -1)
+            # shape: (batch_size, num_positions, d_model)
+            x = x.gather(1, logits_positions.unsqueeze(-1).expand(-1, -1, x.shape[-1]))
 
         # Apply final layer norm.
-        # shape: (batch_size, seq_len or 1, d_model)
+        # shape: (batch_size, seq_len or 1 or num_positions, d_model)
         x = self.transformer.ln_f(x)  # type: ignore
         if output_hidden_states:
             # add final hidden state post-final-layernorm, following HuggingFace's convention
             all_hidden_states.append(x)
 
+        if labels is not None:
+            if self.config.weight_tying:
+                weight, bias = self.transformer.wte.weight, None  # type: ignore
+            else:
+                weight, bias = self.transformer.ff_out.weight, self.transformer.ff_out.bias  # type: ignore
+            loss, z_loss = chunked_cross_entropy_loss(
+                x.reshape(-1, x.shape[-1]),
+                weight,
+                labels.reshape(-1),
+                bias=bias,
+                reduction=loss_reduction,
+                compute_z_loss=compute_z_loss,
+                logit_scale=1 / math.sqrt(self.config.d_model) if self.config.scale_logits else 1.0,
+                chunk_size=loss_chunk_size,
+            )
+            if loss_reduction == "none":
+                loss = loss.view(batch_size, seq_len)
+                if z_loss is not None:
+                    z_loss = z_loss.view(batch_size, seq_len)
+            return OLMoOutput(
+                logits=None,
+                attn_key_values=attn_key_values,
+                hidden_states=tuple(all_hidden_states) if output_hidden_states else None,
+                loss=loss,
+                z_loss=z_loss,
+            )
+
         # Get logits.
-        # shape: (batch_size, seq_len or 1, vocab_size)
+        # shape: (batch_size, seq_len or 1 or num_positions, vocab_size)
         if self.config.weight_tying:
             logits = F.linear(x, self.transformer.wte.weight, None)  # type: ignore
         else:
@@ -1654,24 +2023,11 @@ class OLMo(nn.Module):
 
         tokens_generated = 0
 
-        def flatten_past_key_values(
-            past_key_values: List[Tuple[torch.Tensor, torch.Tensor]],
-        ) -> Dict[str, torch.Tensor]:
-            out = {}
-            for i, (key, value) in enumerate(past_key_values):
-                out[f"past_key_{i}"] = key
-                out[f"past_value_{i}"] = value
-            return out
-
-        def unflatten_past_key_values(
-            past_key_values: Dict[str, torch.Tensor],
-        ) -> List[Tuple[torch.Tensor, torch.Tensor]]:
-            out = []
-            for i in range(self.config.n_layers):
-                past_key = past_key_values[f"past_key_{i}"]
-                past_value = past_key_values[f"past_value_{i}"]
-                out.append((past_key, past_value))
-            return out
+        # Keys and values are written in place for each new token. Since beam search reorders the sequences
+        # after each step, the state tracks which cached sequence each of them continues.
+        kv_cache = StaticKVCache(
+            self.config.n_layers, batch_size * beam_search.beam_size, seq_len + beam_search.max_steps
+        )
 
         def step(
             last_predictions: torch.Tensor, state: dict[str, torch.Tensor]
@@ -1682,13 +2038,13 @@ class OLMo(nn.Module):
             attention_bias = state.get("attention_bias")
 
             if tokens_generated > 0:
-                past_key_values = unflatten_past_key_values(state)
+                if beam_search.beam_size > 1:
+                    kv_cache.reorder(state["kv_cache_rows"])
                 input_ids = last_predictions.unsqueeze(1)
                 if attention_mask is not None:
                     group_size = input_ids.shape[0]
                     attention_mask = torch.cat((attention_mask, attention_mask.new_ones((group_size, 1))), dim=-1)
             else:
-                past_key_values = None
                 input_ids = state["input_ids"]
 
             tokens_generated += 1
@@ -1698,14 +2054,13 @@ class OLMo(nn.Module):
                 input_ids,
                 attention_mask=attention_mask,
                 attention_bias=attention_bias,
-                past_key_values=past_key_values,
-                use_cache=True,
+                past_key_values=kv_cache,
                 last_logits_only=True,
             )
             log_probs = F.log_softmax(output.logits[:, -1, :], dim=-1)
 
             # Create new state.
-            state = flatten_past_key_values(output.attn_key_values)
+            state = {"kv_cache_rows": torch.arange(input_ids.shape[0], device=input_ids.device)}
             if attention_mask is not None:
                 state["attention_mask"] = attention_mask
             if attention_bias is not None:
@@ -0,0 +1,4 @@
+from .engine import GenerationEngine, RequestOutput, SamplingParams, Scheduler
+from .server import GenerationServer
+
+__all__ = ["GenerationEngine", "GenerationServer", "RequestOutput", "SamplingParams", "Scheduler"]
@@ -0,0 +1,450 @@
+"""
+Continuous batching generation.
+
+Instead of decoding a fixed batch until every sequence of it is done, like :meth:`OLMo.generate()
+<olmo.model.OLMo.generate>`, the :class:`GenerationEngine` keeps a pool of running sequences whose keys
+and values live in the pages of a :class:`~olmo.model.PagedKVCache`. Every step, the :class:`Scheduler`
+retires finished sequences, admits waiting requests as pages free up, and builds a batch that mixes the
+next token of every running sequence with (chunks of) the prompts of newly admitted ones, within a budget
+of tokens per step.
+"""
+
+from __future__ import annotations
+
+import itertools
+import logging
+import math
+import threading
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Deque, Dict, List, Optional, Sequence, Tuple
+
+import torch
+
+from ..model import OLMo, PagedKVCache
+
+__all__ = ["SamplingParams", "RequestOutput", "Scheduler", "GenerationEngine"]
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class SamplingParams:
+    """
+    How to sample the tokens of a request.
+    """
+
+    max_tokens: int = 16
+    """
+    The maximum number of tokens to generate.
+    """
+
+    temperature: float = 1.0
+    """
+    The softmax temperature, or ``0`` for greedy decoding.
+    """
+
+    top_k: Optional[int] = None
+    """
+    Only sample from the ``top_k`` most likely tokens.
+    """
+
+    top_p: Optional[float] = None
+    """
+    Only sample from the most likely tokens whose probabilities add up to ``top_p``.
+    """
+
+    stop_token_ids: Sequence[int] = ()
+    """
+    Tokens that end the output in addition to the EOS token. They're included in the output.
+    """
+
+    ignore_eos: bool = False
+    """
+    Keep generating after the EOS token.
+    """
+
+
+@dataclass
+class RequestOutput:
+    """
+    The result of a request.
+    """
+
+    request_id: int
+    prompt_token_ids: List[int]
+    token_ids: List[int]
+    finish_reason: str
+    """
+    ``"stop"`` when the output ended with the EOS token or one of the stop tokens, or ``"length"`` when it
+    reached ``max_tokens`` or the maximum sequence length of the model.
+    """
+
+
+@dataclass(eq=False)
+class _Sequence:
+    request_id: int
+    prompt_token_ids: List[int]
+    params: SamplingParams
+    token_ids: List[int] = field(default_factory=list)
+    pages: List[int] = field(default_factory=list)
+    num_cached: int = 0
+    """
+    The number of positions whose keys and values are in the cache.
+    """
+
+    future: Optional[Future] = None
+
+    @property
+    def all_token_ids(self) -> List[int]:
+        return self.prompt_token_ids + self.token_ids
+
+    @property
+    def length(self) -> int:
+        return len(self.prompt_token_ids) + len(self.token_ids)
+
+
+@dataclass
+class _ScheduledBatch:
+    sequences: List[_Sequence]
+    num_new_positions: List[int]
+
+    def __len__(self) -> int:
+        return len(self.sequences)
+
+
+class Scheduler:
+    """
+    Decides which sequences to run in each step, and manages the pages of the cache.
+
+    Running sequences always get their next position, in the order they were admitted. If there isn't a page
+    for it, the most recently admitted sequence is preempted: its pages are freed, and it goes back to the
+    front of the queue to be prefilled again with the tokens it has generated so far. The rest of the
+    ``max_num_batched_tokens`` budget goes to prefilling waiting sequences, in the order they arrived, as long
+    as there are pages for them. A prompt that doesn't fit in the budget is prefilled in chunks over several
+    steps.
+
+    :param num_pages: The number of pages of the cache.
+    :param page_size: The number of positions of each page.
+    :param max_num_seqs: The maximum number of sequences in a step.
+    :param max_num_batched_tokens: The maximum number of positions in a step.
+    """
+
+    def __init__(self, num_pages: int, page_size: int, max_num_seqs: int, max_num_batched_tokens: int):
+        self.page_size = page_size
+        self.max_num_seqs = max_num_seqs
+        self.max_num_batched_tokens = max_num_batched_tokens
+        self.free_pages: List[int] = list(reversed(range(num_pages)))
+        self.waiting: Deque[_Sequence] = deque()
+        self.running: List[_Sequence] = []
+
+    def has_work(self) -> bool:
+        return bool(self.waiting or self.running)
+
+    def add(self, seq: _Sequence):
+        self.waiting.append(seq)
+
+    def free(self, seq: _Sequence):
+        self.free_pages.extend(reversed(seq.pages))
+        seq.pages = []
+        seq.num_cached = 0
+
+    def _allocate(self, seq: _Sequence, length: int) -> bool:
+        num_pages = math.ceil(length / self.page_size) - len(seq.pages)
+        if num_pages > len(self.free_pages):
+            return False
+        for _ in range(num_pages):
+            seq.pages.append(self.free_pages.pop())
+        return True
+
+    def schedule(self) -> _ScheduledBatch:
+        batch = _ScheduledBatch([], [])
+        budget = self.max_num_batched_tokens
+
+        # Decode, or finish prefilling, the running sequences.
+        preempted = False
+        for seq in list(self.running):
+            if seq not in self.running:
+                # Preempted for an earlier sequence, like all the ones after it.
+                break
+            num_new = min(seq.length - seq.num_cached, budget)
+            if num_new == 0:
+                continue
+            while not self._allocate(seq, seq.num_cached + num_new):
+                victim = self.running.pop()
+                log.debug(f"Preempting request {victim.request_id}, since there are no free pages")
+                self.free(victim)
+                self.waiting.appendleft(victim)
+                preempted = True
+                if victim is seq:
+                    break
+            else:
+                batch.sequences.append(seq)
+                batch.num_new_positions.append(num_new)
+                budget -= num_new
+
+        # Admit waiting sequences, unless that would just take back the pages of preempted ones.
+        while not preempted and self.waiting and budget > 0 and len(self.running) < self.max_num_seqs:
+            seq = self.waiting[0]
+            num_new = min(seq.length - seq.num_cached, budget)
+            if not self._allocate(seq, seq.num_cached + num_new):
+                break
+            self.waiting.popleft()
+            self.running.append(seq)
+            batch.sequences.append(seq)
+            batch.num_new_positions.append(num_new)
+            budget -= num_new
+
+        return batch
+
+    def retire(self, seq: _Sequence):
+        self.running.remove(seq)
+        self.free(seq)
+
+
+class GenerationEngine:
+    """
+    Generates outputs for many requests with continuous batching.
+
+    Use :meth:`generate()` to generate outputs for a list of prompts, or :meth:`submit()` from any thread
+    after :meth:`start()` to run steps in the background as requests come in.
+
+    :param model: The model.
+    :param eos_token_id: The EOS token, which defaults to the one of the model config.
+    :param page_size: The number of positions of each page of the cache.
+    :param num_pages: The number of pages of the cache, which defaults to as many as fit in ``cache_memory_gb``,
+        up to enough for ``max_num_seqs`` sequences of the maximum sequence length of the model.
+    :param cache_memory_gb: The memory for the keys and values of the cache when ``num_pages`` isn't given.
+    :param max_num_seqs: The maximum number of sequences in a step.
+    :param max_num_batched_tokens: The maximum number of positions in a step.
+    :param seed: The seed for sampling.
+    """
+
+    def __init__(
+        self,
+        model: OLMo,
+        eos_token_id: Optional[int] = None,
+        page_size: int = 16,
+        num_pages: Optional[int] = None,
+        cache_memory_gb: float = 4.0,
+        max_num_seqs: int = 64,
+        max_num_batched_tokens: int = 2048,
+        seed: Optional[int] = None,
+    ):
+        self.model = model.eval()
+        self.config = model.config
+        self.eos_token_id = eos_token_id if eos_token_id is not None else self.config.eos_token_id
+        param = next(model.parameters())
+        self.device = param.device
+        n_kv_heads = self.config.effective_n_kv_heads
+        head_dim = self.config.d_model // self.config.n_heads
+        if num_pages is None:
+            # The keys and values of every block.
+            page_bytes = 2 * self.config.n_layers * page_size * n_kv_heads * head_dim * param.element_size()
+            num_pages = min(
+                int(cache_memory_gb * 1024**3) // page_bytes,
+                max_num_seqs * math.ceil(self.config.max_sequence_length / page_size),
+            )
+        if num_pages < 1:
+            raise ValueError(f"The cache needs at least one page, but it has {num_pages}")
+        self.cache = PagedKVCache(self.config.n_layers, num_pages, page_size)
+        # Allocate the cache now, so that running out of memory fails here rather than on the first request.
+        self.cache.allocate(n_kv_heads, head_dim, param.dtype, self.device)
+        self.scheduler = Scheduler(num_pages, page_size, max_num_seqs, max_num_batched_tokens)
+        self.generator = torch.Generator(device=self.device)
+        if seed is not None:
+            self.generator.manual_seed(seed)
+        self.num_steps = 0
+        self.num_tokens = 0
+        self._request_ids = itertools.count()
+        self._lock = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = False
+
+    def add_request(
+        self,
+        prompt_token_ids: Sequence[int],
+        params: Optional[SamplingParams] = None,
+        future: Optional[Future] = None,
+    ) -> int:
+        """
+        Queue a request, returning its ID.
+        """
+        if not prompt_token_ids:
+            raise ValueError("The prompt is empty")
+        if len(prompt_token_ids) >= self.config.max_sequence_length:
+            raise ValueError(
+                f"The prompt has {len(prompt_token_ids)} tokens, "
+                f"but the model supports sequences of up to {self.config.max_sequence_length}"
+            )
+        # A bad token ID would fail the whole step, and every other request in it.
+        if not all(0 <= token_id < self.config.vocab_size for token_id in prompt_token_ids):
+            raise ValueError(f"The prompt has token IDs outside of the vocabulary of {self.config.vocab_size}")
+        params = params or SamplingParams()
+        max_length = min(len(prompt_token_ids) + params.max_tokens, self.config.max_sequence_length)
+        if math.ceil(max_length / self.scheduler.page_size) > self.cache.num_pages:
+            raise ValueError(f"The cache doesn't have enough pages for a sequence of {max_length} tokens")
+        with self._lock:
+            seq = _Sequence(next(self._request_ids), list(prompt_token_ids), params, future=future)
+            self.scheduler.add(seq)
+            self._lock.notify()
+        return seq.request_id
+
+    def has_unfinished_requests(self) -> bool:
+        return self.scheduler.has_work()
+
+    def step(self) -> List[RequestOutput]:
+        """
+        Run one step, returning the outputs of requests that finished in it.
+        """
+        with self._lock:
+            batch = self.scheduler.schedule()
+        if not batch:
+            return []
+
+        seq_len = max(batch.num_new_positions)
+        input_ids = torch.full((len(batch), seq_len), self.eos_token_id, dtype=torch.long)
+        for i, (seq, num_new) in enumerate(zip(batch.sequences, batch.num_new_positions)):
+            input_ids[i, seq_len - num_new :] = torch.tensor(
+                seq.all_token_ids[seq.num_cached : seq.num_cached + num_new]
+            )
+        self.cache.schedule(
+            [seq.pages for seq in batch.sequences],
+            [seq.num_cached for seq in batch.sequences],
+            batch.num_new_positions,
+            self.device,
+        )
+        with torch.inference_mode():
+            logits = self.model(
+                input_ids.to(self.device), past_key_values=self.cache, last_logits_only=True  # type: ignore
+            ).logits[:, -1, : self.config.vocab_size]
+
+        # Only sequences whose prefill is done get a new token.
+        sampled: List[Tuple[_Sequence, int]] = []
+        for i, (seq, num_new) in enumerate(zip(batch.sequences, batch.num_new_positions)):
+            seq.num_cached += num_new
+            if seq.num_cached == seq.length:
+                sampled.append((seq, i))
+        self.num_steps += 1
+        self.num_tokens += sum(batch.num_new_positions)
+        if not sampled:
+            return []
+
+        rows = [i for _, i in sampled]
+        token_ids = self._sample(logits[rows], [seq.params for seq, _ in sampled]).tolist()
+
+        outputs: List[RequestOutput] = []
+        for (seq, _), token_id in zip(sampled, token_ids):
+            seq.token_ids.append(token_id)
+            finish_reason: Optional[str] = None
+            if (
+                token_id == self.eos_token_id and not seq.params.ignore_eos
+            ) or token_id in seq.params.stop_token_ids:
+                finish_reason = "stop"
+            elif len(seq.token_ids) >= seq.params.max_tokens or seq.length >= self.config.max_sequence_length:
+                finish_reason = "length"
+            if finish_reason is None:
+                continue
+            with self._lock:
+                self.scheduler.retire(seq)
+            output = RequestOutput(seq.request_id, seq.prompt_token_ids, seq.token_ids, finish_reason)
+            if seq.future is not None:
+                seq.future.set_result(output)
+            outputs.append(output)
+        return outputs
+
+    def _sample(self, logits: torch.Tensor, params: List[SamplingParams]) -> torch.Tensor:
+        logits = logits.float()
+        greedy = torch.tensor([p.temperature == 0 for p in params], device=logits.device)
+        if greedy.all():
+            return logits.argmax(dim=-1)
+
+        vocab_size = logits.shape[-1]
+        temperature = torch.tensor([p.temperature or 1.0 for p in params], device=logits.device)
+        top_k = torch.tensor([p.top_k or vocab_size for p in params], device=logits.device)
+        top_p = torch.tensor([p.top_p or 1.0 for p in params], device=logits.device)
+
+        sorted_logits, sorted_indices = (logits / temperature[:, None]).sort(dim=-1, descending=True)
+        ranks = torch.arange(vocab_size, device=logits.device)
+        probs = sorted_logits.softmax(dim=-1)
+        # Always keep the most likely token.
+        remove = (ranks[None, :] >= top_k[:, None]) | (probs.cumsum(dim=-1) - probs > top_p[:, None])
+        sorted_logits.masked_fill_(remove, float("-inf"))
+        choices = torch.multinomial(sorted_logits.softmax(dim=-1), 1, generator=self.generator)
+        sampled = sorted_indices.gather(-1, choices).squeeze(-1)
+        return torch.where(greedy, logits.argmax(dim=-1), sampled)
+
+    def generate(
+        self, prompts: Sequence[Sequence[int]], params: Optional[SamplingParams] = None
+    ) -> List[RequestOutput]:
+        """
+        Generate outputs for a list of prompts, in the same order.
+        """
+        if self._thread is not None:
+            futures = [self.submit(prompt, params) for prompt in prompts]
+            return [future.result() for future in futures]
+
+        request_ids = [self.add_request(prompt, params) for prompt in prompts]
+        outputs: Dict[int, RequestOutput] = {}
+        while self.has_unfinished_requests():
+            for output in self.step():
+                outputs[output.request_id] = output
+        return [outputs[request_id] for request_id in request_ids]
+
+    def submit(self, prompt_token_ids: Sequence[int], params: Optional[SamplingParams] = None) -> Future:
+        """
+        Queue a request for the background thread, returning a future for its :class:`RequestOutput`.
+        """
+        if self._thread is None:
+            raise RuntimeError("The engine hasn't been started")
+        future: Future = Future()
+        self.add_request(prompt_token_ids, params, future=future)
+        return future
+
+    def start(self) -> GenerationEngine:
+        """
+        Start running steps in a background thread whenever there are requests.
+        """
+        assert self._thread is None
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="generation-engine", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is None:
+            return
+        with self._lock:
+            self._stopped = True
+            self._lock.notify()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._stopped and not self.scheduler.has_work():
+                    self._lock.wait()
+                if self._stopped:
+                    return
+            try:
+                self.step()
+            except Exception as e:
+                log.exception("Generation step failed")
+                self._fail_all(e)
+
+    def _fail_all(self, error: Exception):
+        with self._lock:
+            for seq in list(self.scheduler.running) + list(self.scheduler.waiting):
+                if seq.future is not None and not seq.future.done():
+                    seq.future.set_exception(error)
+            for seq in list(self.scheduler.running):
+                self.scheduler.retire(seq)
+            self.scheduler.waiting.clear()
+
+    def __enter__(self) -> GenerationEngine:
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
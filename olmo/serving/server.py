@@ -0,0 +1,204 @@
+"""
+A local HTTP front end for a :class:`~olmo.serving.engine.GenerationEngine`, with a subset of the
+OpenAI completions API.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+from ..tokenizer import Tokenizer
+from .engine import GenerationEngine, SamplingParams
+
+__all__ = ["GenerationServer"]
+
+log = logging.getLogger(__name__)
+
+
+class _BadRequest(Exception):
+    pass
+
+
+class _GenerationHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    server: GenerationServer
+
+
+class _GenerationRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    server: _GenerationHTTPServer
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send_json(200, {"status": "ok"})
+        elif self.path == "/v1/models":
+            self._send_json(
+                200, {"object": "list", "data": [{"id": self.server.server.model_name, "object": "model"}]}
+            )
+        else:
+            self._send_error(404, f"Unknown path '{self.path}'")
+
+    def do_POST(self):
+        if self.path != "/v1/completions":
+            self._send_error(404, f"Unknown path '{self.path}'")
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            response = self.server.server.complete(body)
+        except (_BadRequest, json.JSONDecodeError) as e:
+            self._send_error(400, str(e))
+            return
+        except Exception as e:
+            log.exception("Completion failed")
+            self._send_error(500, str(e))
+            return
+        self._send_json(200, response)
+
+    def _send_json(self, status: int, data: Dict[str, Any]):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status: int, message: str):
+        self._send_json(status, {"error": {"message": message, "type": "invalid_request_error"}})
+
+    def log_message(self, format, *args):
+        log.debug(format, *args)
+
+
+class GenerationServer:
+    """
+    Serves ``POST /v1/completions`` with a :class:`~olmo.serving.engine.GenerationEngine` running in the
+    background, along with ``GET /v1/models`` and ``GET /health``.
+
+    Completion requests take a ``prompt`` that's a string, a list of token IDs, or a list of either, and
+    ``max_tokens``, ``temperature``, ``top_p``, ``top_k``, ``stop_token_ids``, and ``ignore_eos``. Every
+    prompt of every request goes into the same engine, so concurrent requests are batched together.
+
+    :param engine: The engine.
+    :param tokenizer: The tokenizer for prompts and outputs.
+    :param model_name: The name of the model in responses.
+    :param host: The address to listen on.
+    :param port: The port to listen on. By default a free port is picked.
+    """
+
+    def __init__(
+        self,
+        engine: GenerationEngine,
+        tokenizer: Tokenizer,
+        model_name: str = "olmo",
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        self.engine = engine
+        self.tokenizer = tokenizer
+        self.model_name = model_name
+        self.host = host
+        self.port = port
+        self._server: Optional[_GenerationHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> GenerationServer:
+        server = _GenerationHTTPServer((self.host, self.port), _GenerationRequestHandler)
+        server.server = self
+        self.port = server.server_address[1]
+        self._server = server
+        self.engine.start()
+        self._thread = threading.Thread(target=server.serve_forever, name="generation server", daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self.start()
+        assert self._thread is not None
+        log.info(f"Serving '{self.model_name}' at {self.url}")
+        try:
+            self._thread.join()
+        finally:
+            self.stop()
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.engine.stop()
+
+    def __enter__(self) -> GenerationServer:
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def _prompts(self, prompt: Any) -> List[List[int]]:
+        if isinstance(prompt, str):
+            return [self.tokenizer.encode(prompt, add_special_tokens=False)]
+        if isinstance(prompt, list) and prompt and all(isinstance(token_id, int) for token_id in prompt):
+            return [prompt]
+        if isinstance(prompt, list) and prompt:
+            return [prompt_token_ids for p in prompt for prompt_token_ids in self._prompts(p)]
+        raise _BadRequest("'prompt' has to be a string, a list of token IDs, or a list of either")
+
+    def complete(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Handle the JSON body of a completions request.
+        """
+        if body.get("stream"):
+            raise _BadRequest("Streaming isn't supported")
+        if body.get("n", 1) != 1 or body.get("best_of", 1) != 1:
+            raise _BadRequest("Only one completion per prompt is supported")
+        if body.get("stop"):
+            raise _BadRequest("'stop' isn't supported, use 'stop_token_ids'")
+        prompts = self._prompts(body.get("prompt"))
+        try:
+            params = SamplingParams(
+                max_tokens=int(body.get("max_tokens", 16)),
+                temperature=float(body.get("temperature", 1.0)),
+                top_k=None if body.get("top_k") in (None, -1) else int(body["top_k"]),
+                top_p=None if body.get("top_p") is None else float(body["top_p"]),
+                stop_token_ids=[int(token_id) for token_id in body.get("stop_token_ids") or []],
+                ignore_eos=bool(body.get("ignore_eos", False)),
+            )
+            futures = [self.engine.submit(prompt, params) for prompt in prompts]
+        except (TypeError, ValueError) as e:
+            raise _BadRequest(str(e))
+        outputs = [future.result() for future in futures]
+
+        num_prompt_tokens = sum(len(output.prompt_token_ids) for output in outputs)
+        num_completion_tokens = sum(len(output.token_ids) for output in outputs)
+        return {
+            "id": f"cmpl-{outputs[0].request_id}",
+            "object": "text_completion",
+            "created": int(time.time()),
+            "model": self.model_name,
+            "choices": [
+                {
+                    "index": i,
+                    "text": self.tokenizer.decode(output.token_ids),
+                    "logprobs": None,
+                    "finish_reason": output.finish_reason,
+                }
+                for i, output in enumerate(outputs)
+            ],
+            "usage": {
+                "prompt_tokens": num_prompt_tokens,
+                "completion_tokens": num_completion_tokens,
+                "total_tokens": num_prompt_tokens + num_completion_tokens,
+            },
+        }
@@ -35,13 +35,14 @@ from .config import (
     CheckpointType,
     DDPGradSyncMode,
     DistributedStrategy,
+    EvaluatorType,
     SchedulerUnits,
     ShardedCheckpointerType,
     SpeedMonitorConfig,
     TrainConfig,
 )
 from .data import IterableDataset
-from .eval import Evaluator
+from .eval import Evaluator, continuation_logits, continuation_positions
 from .exceptions import OLMoConfigurationError
 from .model import OLMo
 from .optim import Optimizer, Scheduler
@@ -235,6 +236,8 @@ class Trainer:
     last_unsharded_checkpoint_step: Optional[int] = None
 
     def __post_init__(self):
+        if self.cfg.fused_loss and self.cfg.loss_chunk_size is not None:
+            raise OLMoConfigurationError("`fused_loss` and `loss_chunk_size` can't be used together")
         if self.cfg.fused_loss:
             if fused_loss_fn is not None:
                 self.loss_fn = fused_loss_fn
@@ -730,7 +733,36 @@ class Trainer:
 
     def model_forward(
         self, batch: Dict[str, Any], loss_reduction: str = "mean", compute_z_loss: bool = False
-    ) -> Tuple[torch.Tensor, Optional[torch.Tensor], torch.Tensor]:
+    ) -> Tuple[torch.Tensor, Optional[torch.Tensor], Optional[torch.Tensor]]:
+        if self.cfg.loss_chunk_size is not None:
+            # The model computes the loss without materializing the logits. Instead of dropping the logits
+            # for the last position, the labels get an ignored label for it.
+            # shape: (batch_size, seq_len)
+            labels = F.pad(self.get_labels(batch), (0, 1), value=-100)
+            output = self.dist_model(
+                input_ids=batch["input_ids"],
+                attention_mask=batch.get("attention_mask"),
+                attention_bias=batch.get("attention_bias"),
+                doc_lens=batch.get("doc_lens"),
+                max_doc_lens=batch.get("max_doc_lens"),
+                labels=labels,
+                # The mean of the z-loss is over all positions but the last one, so take it here.
+                loss_reduction="sum" if loss_reduction == "mean" else loss_reduction,
+                compute_z_loss=compute_z_loss,
+                loss_chunk_size=self.cfg.loss_chunk_size,
+            )
+            ce_loss, z_loss = output.loss, output.z_loss
+            if loss_reduction == "mean":
+                ce_loss = ce_loss / (labels != -100).sum()
+                if z_loss is not None:
+                    z_loss = z_loss / labels[:, :-1].numel()
+            elif loss_reduction == "none":
+                # Drop the last position: (batch_size, seq_len) -> (batch_size, seq_len - 1)
+                ce_loss = ce_loss[:, :-1]
+                if z_loss is not None:
+                    z_loss = z_loss[:, :-1]
+            return ce_loss, z_loss, None
+
         # shape: (batch_size, seq_len, vocab_size)
         logits = self.dist_model(
             input_ids=batch["input_ids"],
@@ -911,22 +943,40 @@ class Trainer:
 
         return metrics
 
-    def eval_batch(self, batch: Dict[str, Any]) -> Tuple[torch.Tensor, torch.Tensor]:
+    def eval_batch(self, batch: Dict[str, Any]) -> Tuple[torch.Tensor, Optional[torch.Tensor]]:
         with torch.autocast("cuda", enabled=True, dtype=self.cfg.autocast_precision):
             ce_loss, _, logits = self.model_forward(batch, loss_reduction="none")
         return ce_loss.mean(dim=-1), logits
 
+    def downstream_eval_batch(self, batch: Dict[str, Any], share_context: bool = False) -> torch.Tensor:
+        with torch.autocast("cuda", enabled=True, dtype=self.cfg.autocast_precision):
+            if share_context:
+                return continuation_logits(self.dist_model, batch, n_layers=self.model.config.n_layers)
+            # shape: (batch_size, max_cont_len, vocab_size)
+            return self.dist_model(
+                input_ids=batch["input_ids"],
+                attention_mask=batch.get("attention_mask"),
+                attention_bias=batch.get("attention_bias"),
+                logits_positions=continuation_positions(batch),
+            ).logits
+
     def eval_step(self, batch: Dict[str, Any], evaluator: Evaluator) -> None:
         # Move tensors to the right device.
         batch = move_to_device(batch, self.device)
 
         # Run forward pass.
+        ce_loss: Optional[torch.Tensor]
         with torch.no_grad():  # NOTE: 'torch.inference_mode()' doesn't work with 'torch.compile()'.
-            ce_loss, logits = self.eval_batch(batch)
+            if evaluator.type == EvaluatorType.downstream:
+                # Downstream metrics don't need the loss, and only need the logits for the continuations.
+                ce_loss = None
+                logits = self.downstream_eval_batch(batch, share_context=evaluator.share_context)
+            else:
+                ce_loss, logits = self.eval_batch(batch)
 
         # Update metrics.
         evaluator.update_metrics(
-            batch, ce_loss, logits
+            batch, ce_loss, logits, continuation_logits_only=evaluator.type == EvaluatorType.downstream
         )  # batch includes all keys that the downstream evaluation needs
 
         barrier()
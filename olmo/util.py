@@ -1,7 +1,10 @@
+import bisect
+import concurrent.futures
 import gzip
 import io
 import json
 import logging
+import math
 import os
 import re
 import socket
@@ -13,8 +16,22 @@ from enum import Enum
 from itertools import cycle, islice
 from pathlib import Path
 from queue import Queue
-from threading import Thread
-from typing import Any, Callable, Dict, MutableMapping, Optional, Tuple, Union
+from threading import Condition, Event, Lock, Thread
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Generator,
+    List,
+    MutableMapping,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+    Union,
+)
 
 import boto3
 import botocore.exceptions as boto_exceptions
@@ -36,6 +53,7 @@ from olmo_data.data import get_data_path
 from .aliases import PathOrStr
 from .exceptions import (
     OLMoCliError,
+    OLMoConfigurationError,
     OLMoEnvironmentError,
     OLMoError,
     OLMoNetworkError,
@@ -43,11 +61,16 @@ from .exceptions import (
 )
 from .torch_util import get_global_rank, get_local_rank, get_node_rank, is_distributed
 
+if TYPE_CHECKING:
+    from .config import DataConfig
+
 try:
     from functools import cache
 except ImportError:
     from functools import lru_cache as cache
 
+T = TypeVar("T")
+
 
 class StrEnum(str, Enum):
     """
@@ -328,6 +351,29 @@ def resource_path(
         return cached_path(f"{str(folder).rstrip('/')}/{fname}", progress=progress)
 
 
+def file_exists(path: PathOrStr) -> bool:
+    """
+    Check whether a local or remote file exists, e.g. a sidecar file written next to a data file.
+    """
+    try:
+        file_size(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def data_config_paths(data_config: "DataConfig") -> List[str]:
+    """
+    Get all of the data files of a data config, from either ``paths`` or ``datasets``.
+    """
+    if data_config.paths:
+        return list(data_config.paths)
+    elif data_config.datasets:
+        return [path for label in sorted(data_config.datasets.keys()) for path in data_config.datasets[label]]
+    else:
+        raise OLMoConfigurationError("One of DataConfig.paths or DataConfig.datasets is required")
+
+
 def file_size(path: PathOrStr) -> int:
     """
     Get the size of a local or remote file in bytes.
@@ -350,6 +396,44 @@ def file_size(path: PathOrStr) -> int:
         return os.stat(path).st_size
 
 
+class FileInfo(NamedTuple):
+    """
+    The size and version of a local or remote file.
+    """
+
+    size: int
+    """The size of the file in bytes."""
+
+    etag: Optional[str]
+    """
+    An identifier that changes whenever the contents of the file change. For local files this
+    is derived from the modification time and size.
+    """
+
+
+def get_file_info(path: PathOrStr) -> FileInfo:
+    """
+    Get the size and ETag of a local or remote file with a single request.
+    """
+    if is_url(path):
+        from urllib.parse import urlparse
+
+        parsed = urlparse(str(path))
+        if parsed.scheme == "gs":
+            return _gcs_file_info(parsed.netloc, parsed.path.strip("/"))
+        elif parsed.scheme in ("s3", "r2", "weka"):
+            return _s3_file_info(parsed.scheme, parsed.netloc, parsed.path.strip("/"))
+        elif parsed.scheme in ("http", "https"):
+            return _http_file_info(parsed.scheme, parsed.netloc, parsed.path.strip("/"))
+        elif parsed.scheme == "file":
+            return get_file_info(str(path).replace("file://", "", 1))
+        else:
+            raise NotImplementedError(f"file info not implemented for '{parsed.scheme}' files")
+    else:
+        stat = os.stat(path)
+        return FileInfo(size=stat.st_size, etag=f"{stat.st_mtime_ns:x}-{stat.st_size:x}")
+
+
 def upload(source: PathOrStr, target: str, save_overwrite: bool = False):
     """Upload source file to a target location on GCS or S3."""
     from urllib.parse import urlparse
@@ -371,14 +455,28 @@ def get_bytes_range(source: PathOrStr, bytes_start: int, num_bytes: int) -> byte
 
         parsed = urlparse(str(source))
         if parsed.scheme == "gs":
-            return _gcs_get_bytes_range(parsed.netloc, parsed.path.strip("/"), bytes_start, num_bytes)
+            return _hedged_request(
+                parsed.scheme, _gcs_get_bytes_range, parsed.netloc, parsed.path.strip("/"), bytes_start, num_bytes
+            )
         elif parsed.scheme in ("s3", "r2", "weka"):
-            return _s3_get_bytes_range(
-                parsed.scheme, parsed.netloc, parsed.path.strip("/"), bytes_start, num_bytes
+            return _hedged_request(
+                parsed.scheme,
+                _s3_get_bytes_range,
+                parsed.scheme,
+                parsed.netloc,
+                parsed.path.strip("/"),
+                bytes_start,
+                num_bytes,
             )
         elif parsed.scheme in ("http", "https"):
-            return _http_get_bytes_range(
-                parsed.scheme, parsed.netloc, parsed.path.strip("/"), bytes_start, num_bytes
+            return _hedged_request(
+                parsed.scheme,
+                _http_get_bytes_range,
+                parsed.scheme,
+                parsed.netloc,
+                parsed.path.strip("/"),
+                bytes_start,
+                num_bytes,
             )
         elif parsed.scheme == "file":
             return get_bytes_range(str(source).replace("file://", "", 1), bytes_start, num_bytes)
@@ -390,6 +488,189 @@ def get_bytes_range(source: PathOrStr, bytes_start: int, num_bytes: int) -> byte
             return f.read(num_bytes)
 
 
+def get_bytes_ranges(source: PathOrStr, ranges: Sequence[Tuple[int, int]]) -> List[bytes]:
+    """
+    Get several ``(bytes_start, num_bytes)`` ranges from a single local or remote file.
+    Remote ranges are requested concurrently over the shared storage connection pools.
+    """
+    if not is_url(source) or str(source).startswith("file://"):
+        with open(str(source).replace("file://", "", 1), "rb") as f:
+            out = []
+            for bytes_start, num_bytes in ranges:
+                f.seek(bytes_start)
+                out.append(f.read(num_bytes))
+            return out
+    else:
+        return get_bytes_ranges_multi([(source, bytes_start, num_bytes) for bytes_start, num_bytes in ranges])
+
+
+def get_bytes_ranges_multi(
+    requests: Sequence[Tuple[PathOrStr, int, int]], num_threads: Optional[int] = None
+) -> List[bytes]:
+    """
+    Get many ``(source, bytes_start, num_bytes)`` ranges, possibly from different files, concurrently.
+    The results are returned in the same order as the requests.
+
+    :param num_threads: The number of threads to use. By default this uses a shared thread pool
+        sized to match the storage connection pools (see :func:`storage_pool_size()`).
+    """
+    if len(requests) <= 1:
+        return [get_bytes_range(*request) for request in requests]
+
+    if num_threads is None:
+        futures = [_get_storage_executor(os.getpid()).submit(get_bytes_range, *request) for request in requests]
+        return [future.result() for future in futures]
+    else:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=num_threads) as executor:
+            return list(executor.map(lambda request: get_bytes_range(*request), requests))
+
+
+def storage_pool_size() -> int:
+    """
+    The maximum number of connections to keep open to each storage backend, which is also
+    the number of threads used for concurrent requests. This can be set with the
+    ``OLMO_STORAGE_POOL_SIZE`` env var and defaults to :func:`default_thread_count()`.
+    """
+    return int(os.environ.get("OLMO_STORAGE_POOL_SIZE") or default_thread_count())
+
+
+def storage_timeouts() -> Tuple[float, float]:
+    """
+    The ``(connect, read)`` timeouts in seconds for storage requests, which can be set with the
+    ``OLMO_STORAGE_CONNECT_TIMEOUT`` and ``OLMO_STORAGE_READ_TIMEOUT`` env vars.
+    """
+    return (
+        float(os.environ.get("OLMO_STORAGE_CONNECT_TIMEOUT") or 10.0),
+        float(os.environ.get("OLMO_STORAGE_READ_TIMEOUT") or 60.0),
+    )
+
+
+def storage_hedge_percentile() -> Optional[float]:
+    """
+    If set through the ``OLMO_STORAGE_HEDGE_PERCENTILE`` env var (e.g. to ``95``), remote range reads
+    that take longer than this percentile of recent latencies for their backend are duplicated, and
+    whichever request finishes first wins. Hedging is disabled by default.
+    """
+    percentile = os.environ.get("OLMO_STORAGE_HEDGE_PERCENTILE")
+    return None if not percentile else float(percentile)
+
+
+class LatencyHistogram:
+    """
+    A thread-safe histogram of recent request latencies with logarithmically spaced buckets.
+
+    Once ``max_count`` latencies have been recorded all the counts are halved, so older
+    samples decay away and the percentiles track recent behavior.
+    """
+
+    def __init__(
+        self,
+        *,
+        min_latency: float = 1e-3,
+        max_latency: float = 300.0,
+        growth_factor: float = 1.2,
+        max_count: int = 2000,
+        min_count: int = 20,
+    ):
+        num_buckets = int(math.ceil(math.log(max_latency / min_latency) / math.log(growth_factor))) + 1
+        #: The upper bound of each bucket.
+        self.bounds = [min_latency * growth_factor**i for i in range(num_buckets)]
+        self.counts = [0] * num_buckets
+        self.total = 0
+        self.max_count = max_count
+        self.min_count = min_count
+        self._lock = Lock()
+
+    def record(self, latency: float):
+        bucket = min(bisect.bisect_left(self.bounds, latency), len(self.bounds) - 1)
+        with self._lock:
+            self.counts[bucket] += 1
+            self.total += 1
+            if self.total >= self.max_count:
+                self.counts = [count // 2 for count in self.counts]
+                self.total = sum(self.counts)
+
+    def percentile(self, percentile: float) -> Optional[float]:
+        """
+        Get an upper bound on the given percentile (between 0 and 100) of recent latencies,
+        or ``None`` if too few latencies have been recorded.
+        """
+        with self._lock:
+            if self.total < self.min_count:
+                return None
+            target = self.total * percentile / 100
+            cumulative = 0
+            for bound, count in zip(self.bounds, self.counts):
+                cumulative += count
+                if cumulative >= target:
+                    return bound
+            return self.bounds[-1]
+
+
+@cache
+def get_latency_histogram(backend: str) -> LatencyHistogram:
+    """
+    Get the histogram of range read latencies for a storage backend, e.g. ``"s3"``.
+    """
+    return LatencyHistogram()
+
+
+def _hedged_request(backend: str, fn: Callable[..., bytes], *args) -> bytes:
+    histogram = get_latency_histogram(backend)
+
+    def timed_request(started: Optional[Event] = None) -> bytes:
+        start = time.monotonic()
+        if started is not None:
+            started.set()
+        result = fn(*args)
+        histogram.record(time.monotonic() - start)
+        return result
+
+    percentile = storage_hedge_percentile()
+    threshold = None if percentile is None else histogram.percentile(percentile)
+    if threshold is None:
+        return timed_request()
+
+    # We can't use the storage executor since we may already be running in one of its threads.
+    executor = _get_hedge_executor(os.getpid())
+    started = Event()
+    futures = [executor.submit(timed_request, started)]
+    # Time spent waiting for a thread isn't remote latency, and hedging then would only queue up more work,
+    # so the clock starts when the request does.
+    started.wait()
+    done, _ = concurrent.futures.wait(futures, timeout=threshold)
+    if not done:
+        log.debug("%s request exceeded %.3fs, sending a hedged request", backend, threshold)
+        futures.append(executor.submit(timed_request))
+
+    err: Optional[BaseException] = None
+    try:
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                return future.result()
+            except Exception as e:
+                err = e
+    finally:
+        # A hedged request that hasn't started yet isn't needed anymore.
+        for future in futures:
+            future.cancel()
+    assert err is not None
+    raise err
+
+
+@cache
+def _get_hedge_executor(pid: int) -> concurrent.futures.ThreadPoolExecutor:
+    del pid
+    return concurrent.futures.ThreadPoolExecutor(max_workers=2 * storage_pool_size(), thread_name_prefix="hedge")
+
+
+@cache
+def _get_storage_executor(pid: int) -> concurrent.futures.ThreadPoolExecutor:
+    # Keyed by process ID since threads don't survive a fork.
+    del pid
+    return concurrent.futures.ThreadPoolExecutor(max_workers=storage_pool_size(), thread_name_prefix="storage")
+
+
 def find_latest_checkpoint(dir: PathOrStr) -> Optional[PathOrStr]:
     if is_url(dir):
         from urllib.parse import urlparse
@@ -454,6 +735,20 @@ def _gcs_file_size(bucket_name: str, key: str) -> int:
     return blob.size
 
 
+def _gcs_file_info(bucket_name: str, key: str) -> FileInfo:
+    from google.api_core.exceptions import NotFound
+
+    storage_client = _get_gcs_client()
+    bucket = storage_client.bucket(bucket_name)
+    blob = bucket.blob(key)
+    try:
+        blob.reload(retry=_gcs_retry)
+    except NotFound:
+        raise FileNotFoundError(f"gs://{bucket_name}/{key}")
+    assert blob.size is not None
+    return FileInfo(size=blob.size, etag=blob.etag)
+
+
 def _gcs_get_bytes_range(bucket_name: str, key: str, bytes_start: int, num_bytes: int) -> bytes:
     from google.api_core.exceptions import NotFound
 
@@ -564,13 +859,26 @@ def _get_s3_endpoint_url(scheme: str) -> Optional[str]:
     raise NotImplementedError(f"Cannot get endpoint url for scheme {scheme}")
 
 
-@cache
 def _get_s3_client(scheme: str):
+    return _get_s3_client_for_pid(scheme, os.getpid())
+
+
+@cache
+def _get_s3_client_for_pid(scheme: str, pid: int):
+    # Keyed by process ID so that forked processes, like data loader workers, don't share connections.
+    del pid
     session = boto3.Session(profile_name=_get_s3_profile_name(scheme))
+    connect_timeout, read_timeout = storage_timeouts()
     return session.client(
         "s3",
         endpoint_url=_get_s3_endpoint_url(scheme),
-        config=Config(retries={"max_attempts": 10, "mode": "standard"}),
+        config=Config(
+            retries={"max_attempts": 10, "mode": "standard"},
+            max_pool_connections=storage_pool_size(),
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout,
+            tcp_keepalive=True,
+        ),
         use_ssl=not int(os.environ.get("OLMO_NO_SSL", "0")),
     )
 
@@ -626,6 +934,24 @@ def _s3_file_size(scheme: str, bucket_name: str, key: str, max_attempts: int = 3
     raise OLMoNetworkError(f"Failed to get {scheme} file size") from err
 
 
+def _s3_file_info(scheme: str, bucket_name: str, key: str, max_attempts: int = 3) -> FileInfo:
+    err: Optional[Exception] = None
+    for attempt in range(1, max_attempts + 1):
+        try:
+            response = _get_s3_client(scheme).head_object(Bucket=bucket_name, Key=key)
+            return FileInfo(size=response["ContentLength"], etag=response.get("ETag"))
+        except boto_exceptions.ClientError as e:
+            if e.response["ResponseMetadata"]["HTTPStatusCode"] == 404:
+                raise FileNotFoundError(f"{scheme}://{bucket_name}/{key}") from e
+            err = e
+
+        if attempt < max_attempts:
+            log.warning("%s failed attempt %d with retriable error: %s", _s3_file_info.__name__, attempt, err)
+            _wait_before_retry(attempt)
+
+    raise OLMoNetworkError(f"Failed to get {scheme} file info") from err
+
+
 def _s3_get_bytes_range(
     scheme: str, bucket_name: str, key: str, bytes_start: int, num_bytes: int, max_attempts: int = 3
 ) -> bytes:
@@ -694,23 +1020,43 @@ def _s3_find_latest_checkpoint(scheme: str, bucket_name: str, prefix: str) -> Op
     return latest_checkpoint
 
 
-def _http_file_size(scheme: str, host_name: str, path: str) -> int:
-    import requests
+@cache
+def _get_http_session(pid: int) -> requests.Session:
+    # Keyed by process ID so that forked processes don't share connections.
+    del pid
+    pool_size = storage_pool_size()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
 
-    response = requests.head(f"{scheme}://{host_name}/{path}", allow_redirects=True)
+def _http_file_size(scheme: str, host_name: str, path: str) -> int:
+    response = _get_http_session(os.getpid()).head(
+        f"{scheme}://{host_name}/{path}", allow_redirects=True, timeout=storage_timeouts()
+    )
     return int(response.headers.get("content-length"))
 
 
-def _http_get_bytes_range(scheme: str, host_name: str, path: str, bytes_start: int, num_bytes: int) -> bytes:
-    import requests
+def _http_file_info(scheme: str, host_name: str, path: str) -> FileInfo:
+    response = _get_http_session(os.getpid()).head(
+        f"{scheme}://{host_name}/{path}", allow_redirects=True, timeout=storage_timeouts()
+    )
+    if response.status_code == 404:
+        raise FileNotFoundError(f"{scheme}://{host_name}/{path}")
+    return FileInfo(size=int(response.headers.get("content-length")), etag=response.headers.get("etag"))
 
+
+def _http_get_bytes_range(scheme: str, host_name: str, path: str, bytes_start: int, num_bytes: int) -> bytes:
     max_retries = 5
     attempt = 0
     while attempt < max_retries:
         try:
-            response = requests.get(
+            response = _get_http_session(os.getpid()).get(
                 f"{scheme}://{host_name}/{path}",
                 headers={"Range": f"bytes={bytes_start}-{bytes_start+num_bytes-1}"},
+                timeout=storage_timeouts(),
             )
             result = response.content
             if len(result) == num_bytes:
@@ -835,6 +1181,115 @@ def threaded_generator(g, maxsize: int = 16, thread_name: Optional[str] = None):
             yield x
 
 
+def adaptive_threaded_map(
+    fn: Callable[[int], T],
+    num_tasks: int,
+    *,
+    min_threads: int = 1,
+    max_threads: int = 16,
+    initial_threads: Optional[int] = None,
+    max_ahead: int = 8,
+    adjust_interval: int = 8,
+    thread_name: str = "adaptive thread",
+) -> Generator[T, None, None]:
+    """
+    Yield ``fn(0)``, ``fn(1)``, ..., ``fn(num_tasks - 1)`` in that order, computing them ahead of time
+    with a pool of background threads that grows or shrinks to keep up with the consumer.
+
+    Threads work on at most ``max_ahead`` tasks past the one that was yielded last. Every ``adjust_interval``
+    tasks the pool is resized based on how long the consumer had to wait and how long each task takes:
+    if the consumer was kept waiting, threads are added up to what the task latency calls for, and if
+    results were always ready without waiting and the lookahead was full, a thread is removed.
+    The order of the results doesn't depend on the number of threads.
+    """
+    if num_tasks <= 0:
+        return
+
+    lock = Condition()
+    results: Dict[int, Tuple[bool, Any]] = {}
+    # All of these are protected by the lock.
+    next_task = 0
+    next_output = 0
+    num_target_threads = 0
+    num_alive_threads = 0
+    stop = False
+    fetch_time = 0.0
+
+    def work():
+        nonlocal next_task, num_alive_threads, fetch_time
+        while True:
+            with lock:
+                while True:
+                    if stop or next_task >= num_tasks or num_alive_threads > num_target_threads:
+                        num_alive_threads -= 1
+                        lock.notify_all()
+                        return
+                    if next_task < next_output + max_ahead:
+                        break
+                    lock.wait()
+                task = next_task
+                next_task += 1
+            start = time.monotonic()
+            try:
+                result: Tuple[bool, Any] = (True, fn(task))
+            except Exception as e:
+                result = (False, e)
+            with lock:
+                fetch_time += time.monotonic() - start
+                results[task] = result
+                lock.notify_all()
+
+    def resize(num_threads: int):
+        # Must be called with the lock held.
+        nonlocal num_target_threads, num_alive_threads
+        num_target_threads = max(min_threads, min(max_threads, num_threads))
+        while num_alive_threads < num_target_threads:
+            num_alive_threads += 1
+            Thread(name=f"{thread_name} {num_alive_threads}", target=work, daemon=True).start()
+        lock.notify_all()
+
+    interval_start = time.monotonic()
+    wait_time = 0.0
+    num_full = 0
+    try:
+        with lock:
+            resize(initial_threads or min_threads)
+        for task in range(num_tasks):
+            with lock:
+                if task not in results:
+                    wait_start = time.monotonic()
+                    while task not in results:
+                        lock.wait()
+                    wait_time += time.monotonic() - wait_start
+                elif len(results) >= max_ahead:
+                    num_full += 1
+                ok, result = results.pop(task)
+                next_output = task + 1
+                lock.notify_all()
+
+                if (task + 1) % adjust_interval == 0:
+                    elapsed = time.monotonic() - interval_start
+                    if wait_time > 0.05 * elapsed:
+                        # By Little's law, keeping up takes about as many threads as tasks take to
+                        # fetch relative to how quickly the consumer gets through them when it isn't waiting.
+                        busy_time = max(elapsed - wait_time, 1e-6)
+                        resize(max(num_target_threads + 1, math.ceil(fetch_time / busy_time)))
+                    elif wait_time == 0 and num_full == adjust_interval:
+                        resize(num_target_threads - 1)
+                    interval_start = time.monotonic()
+                    wait_time = 0.0
+                    num_full = 0
+                    fetch_time = 0.0
+
+            if not ok:
+                raise OLMoThreadError(f"generator thread {thread_name} failed") from result
+            yield result
+    finally:
+        with lock:
+            stop = True
+            lock.notify_all()
+
+
 def roundrobin(*iterables):
     """
     Call the given iterables in a round-robin fashion. For example:
@@ -0,0 +1,71 @@
+"""
+Micro-benchmark of the fixed-length fast path of the :class:`~olmo.data.collator.DataCollator`
+against the general padding path, on instances that look like those from a
+:class:`~olmo.data.memmap_dataset.MemMapDataset`.
+
+Usage:
+
+```bash
+python scripts/benchmark_collator.py --batch-size 512 --seq-len 4096 --doc-lens --label-mask
+```
+"""
+
+import argparse
+import timeit
+from typing import Any, Dict, List
+
+import torch
+
+from olmo.config import PaddingDirection
+from olmo.data.collator import DataCollator
+from olmo.data.util import get_document_lengths
+
+
+def make_items(batch_size: int, seq_len: int, doc_lens: bool, label_mask: bool) -> List[Dict[str, Any]]:
+    eos_token_id = 0
+    input_ids = torch.randint(0, 64, (batch_size, seq_len))
+    items = []
+    for i in range(batch_size):
+        item: Dict[str, Any] = {
+            "input_ids": input_ids[i],
+            "index": i,
+            "instance_mask": True,
+            "metadata": {"label": "benchmark"},
+        }
+        if label_mask:
+            item["label_mask"] = torch.ones(seq_len, dtype=torch.bool)
+        if doc_lens:
+            item["doc_lens"] = get_document_lengths(input_ids[i], eos_token_id)
+        items.append(item)
+    return items
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark the data collator")
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--seq-len", type=int, default=4096)
+    parser.add_argument("--doc-lens", action="store_true", help="include document lengths")
+    parser.add_argument("--label-mask", action="store_true", help="include label masks")
+    parser.add_argument("--pin-memory", action="store_true", help="collate into pinned memory")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    items = make_items(args.batch_size, args.seq_len, args.doc_lens, args.label_mask)
+    collator = DataCollator(pad_direction=PaddingDirection.right, pad_token_id=1, pin_memory=args.pin_memory)
+
+    fast = collator(items)
+    padded = collator._collate_padded(items)  # type: ignore
+    assert fast.keys() == padded.keys()
+    for key, value in fast.items():
+        if isinstance(value, torch.Tensor):
+            assert torch.equal(value, padded[key]), key
+        else:
+            assert value == padded[key], key
+
+    for name, fn in [("padded", collator._collate_padded), ("fixed-length", collator)]:
+        times = timeit.repeat(lambda: fn(items), number=1, repeat=args.repeat)  # type: ignore
+        print(f"{name:>12}: best {min(times) * 1000:.2f}ms, mean {sum(times) / len(times) * 1000:.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""
+Benchmark the training data loader of a config over a matrix of data loader workers, data threads,
+and storage backends, reporting instances/s, bytes/s, CPU utilization, and latency percentiles of each
+stage of loading a batch (see :mod:`olmo.data.benchmark`).
+
+With the ``http`` and ``s3`` backends, the config's local data files are served by a
+:class:`~olmo.data.benchmark.LocalObjectStore` with the given latency, so that remote storage
+can be benchmarked without the network.
+
+Usage:
+
+```bash
+python scripts/benchmark_dataloader.py configs/official-1124/OLMo2-7B-stage1.yaml \\
+    --num-workers 0 4 8 --num-threads 0 4 --backends local http s3 --latency-ms 20 \\
+    --data.paths='[/data/part-0.npy,/data/part-1.npy]'
+```
+"""
+
+import argparse
+import json
+import logging
+import os
+import tempfile
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import torch.distributed as dist
+
+from olmo.config import TrainConfig
+from olmo.data import build_train_dataloader
+from olmo.data.benchmark import (
+    STAGES,
+    LocalObjectStore,
+    benchmark_data_loader,
+    instrument_data_loader,
+)
+from olmo.util import clean_opt, is_url, prepare_cli_environment
+
+log = logging.getLogger("benchmark_dataloader")
+
+BACKENDS = ("local", "http", "s3")
+
+
+def data_paths(cfg: TrainConfig) -> List[str]:
+    paths: List[str] = []
+    if cfg.data.paths:
+        paths.extend(str(path) for path in cfg.data.paths)
+    if cfg.data.datasets:
+        for label_paths in cfg.data.datasets.values():
+            paths.extend(str(path) for path in label_paths)
+    if cfg.data.label_mask_paths:
+        paths.extend(str(path) for path in cfg.data.label_mask_paths)
+    return paths
+
+
+def with_backend(cfg: TrainConfig, backend: str, store: Optional[LocalObjectStore]) -> TrainConfig:
+    """
+    Get a copy of the config that reads the data files through the given backend.
+    """
+    cfg = TrainConfig.new(**cfg.asdict())
+    if backend == "local":
+        return cfg
+    assert store is not None
+    to_url = store.http_url if backend == "http" else store.s3_url
+    if cfg.data.paths:
+        cfg.data.paths = [to_url(path) for path in cfg.data.paths]
+    if cfg.data.datasets:
+        cfg.data.datasets = {label: [to_url(path) for path in paths] for label, paths in cfg.data.datasets.items()}
+    if cfg.data.label_mask_paths:
+        cfg.data.label_mask_paths = [to_url(path) for path in cfg.data.label_mask_paths]
+    return cfg
+
+
+def main(
+    cfg: TrainConfig,
+    num_batches: int,
+    num_workers: List[int],
+    num_threads: List[int],
+    backends: List[str],
+    latency: float,
+    jitter: float,
+    output: Optional[str],
+):
+    if cfg.device_train_batch_size is None:
+        cfg.device_train_batch_size = cfg.global_train_batch_size
+    cfg.data.persistent_workers = False
+    bytes_per_token = np.dtype(cfg.data.effective_memmap_dtype).itemsize
+
+    store: Optional[LocalObjectStore] = None
+    if any(backend != "local" for backend in backends):
+        paths = data_paths(cfg)
+        if any(is_url(path) for path in paths):
+            raise ValueError("The http and s3 backends need local data paths")
+        root = os.path.commonpath([os.path.dirname(os.path.realpath(path)) for path in paths])
+        # The files are served from one level up, so that the S3 bucket is the last directory of 'root'.
+        store = LocalObjectStore(os.path.dirname(root), latency=latency, jitter=jitter).start()
+        # S3 clients are created lazily, so this has to happen before any S3 requests.
+        os.environ.update(store.s3_environ())
+        log.info(f"Serving '{os.path.dirname(root)}' at {store.url} with {latency * 1000:g}ms latency")
+
+    results: List[Dict[str, Any]] = []
+    try:
+        for backend in backends:
+            backend_cfg = with_backend(cfg, backend, store)
+            for workers in num_workers:
+                for threads in num_threads:
+                    backend_cfg.data.num_workers = workers
+                    data_loader = build_train_dataloader(backend_cfg)
+                    data_loader.dataset.num_threads = threads  # type: ignore
+                    instrument_data_loader(data_loader)
+                    result = benchmark_data_loader(data_loader, num_batches, bytes_per_token=bytes_per_token)
+                    summary: Dict[str, Any] = {"backend": backend, "num_workers": workers, "num_threads": threads}
+                    summary.update(result.summary())
+                    results.append(summary)
+                    log.info(
+                        f"{backend:>5} workers={workers:<3} threads={threads:<3} "
+                        f"{result.instances_per_second:10.1f} instances/s "
+                        f"{result.bytes_per_second / 2**20:8.1f} MiB/s "
+                        f"cpu={result.cpu_utilization:5.2f} cores "
+                        + " ".join(f"{stage}={summary[f'{stage}_p50_ms']:.1f}ms" for stage in STAGES)
+                    )
+    finally:
+        if store is not None:
+            store.stop()
+
+    if output is not None:
+        with open(output, "w") as f:
+            for summary in results:
+                f.write(json.dumps(summary) + "\n")
+        log.info(f"Results written to '{output}'")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="benchmark the training data loader")
+    parser.add_argument("config_file", type=str, help="config file")
+    parser.add_argument("--num-batches", type=int, default=50, help="the number of batches to read per run")
+    parser.add_argument("--num-workers", type=int, nargs="+", default=[0, 4], help="data loader workers")
+    parser.add_argument("--num-threads", type=int, nargs="+", default=[0, 4], help="data threads per worker")
+    parser.add_argument("--backends", type=str, nargs="+", default=["local"], choices=BACKENDS)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="latency of the http and s3 backends")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="random latency added to each request")
+    parser.add_argument("-o", "--output", type=str, default=None, help="a JSON lines file for the results")
+    args, other_args = parser.parse_known_args()
+
+    dist.init_process_group(backend="gloo", world_size=1, rank=0, store=dist.HashStore())
+
+    prepare_cli_environment()
+
+    with tempfile.TemporaryDirectory() as save_folder:
+        cfg = TrainConfig.load(
+            args.config_file,
+            [clean_opt(s) for s in other_args] + [f"save_folder={save_folder}", "save_overwrite=true"],
+        )
+        main(
+            cfg,
+            num_batches=args.num_batches,
+            num_workers=args.num_workers,
+            num_threads=args.num_threads,
+            backends=args.backends,
+            latency=args.latency_ms / 1000,
+            jitter=args.jitter_ms / 1000,
+            output=args.output,
+        )
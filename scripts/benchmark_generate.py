@@ -0,0 +1,105 @@
+"""
+Micro-benchmark of greedy decoding on CPU with a preallocated :class:`~olmo.model.StaticKVCache`
+against growing ``past_key_values`` with every step, reporting the latency of decode steps at
+increasing positions of the output.
+
+Usage:
+
+```bash
+python scripts/benchmark_generate.py --d-model 512 --n-layers 8 --prompt-len 128 --max-steps 1024
+```
+"""
+
+import argparse
+import time
+from typing import List, Optional, Tuple
+
+import torch
+
+from olmo.config import ModelConfig
+from olmo.model import OLMo, StaticKVCache
+
+
+def decode(
+    model: OLMo, input_ids: torch.Tensor, max_steps: int, static_cache: bool
+) -> Tuple[torch.Tensor, List[float]]:
+    """
+    Greedily decode ``max_steps`` tokens, returning them and the seconds that each step took.
+    """
+    cache: Optional[StaticKVCache] = None
+    if static_cache:
+        cache = StaticKVCache(model.config.n_layers, input_ids.shape[0], input_ids.shape[1] + max_steps)
+    past_key_values = cache
+    tokens: List[torch.Tensor] = []
+    step_times: List[float] = []
+    next_input_ids = input_ids
+    for _ in range(max_steps):
+        start = time.perf_counter()
+        output = model(
+            next_input_ids,
+            past_key_values=past_key_values,
+            use_cache=not static_cache,
+            last_logits_only=True,
+        )
+        next_input_ids = output.logits[:, -1].argmax(dim=-1, keepdim=True)
+        step_times.append(time.perf_counter() - start)
+        if not static_cache:
+            past_key_values = output.attn_key_values
+        tokens.append(next_input_ids)
+    return torch.cat(tokens, dim=1), step_times
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark decoding with and without a static KV cache")
+    parser.add_argument("--d-model", type=int, default=512)
+    parser.add_argument("--n-heads", type=int, default=8)
+    parser.add_argument("--n-layers", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--prompt-len", type=int, default=128)
+    parser.add_argument("--max-steps", type=int, default=1024)
+    parser.add_argument("--report-every", type=int, default=128, help="report latency over windows of steps")
+    parser.add_argument("--threads", type=int, default=None, help="the number of torch threads")
+    args = parser.parse_args()
+
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    torch.manual_seed(0)
+    config = ModelConfig(
+        d_model=args.d_model,
+        n_heads=args.n_heads,
+        n_layers=args.n_layers,
+        max_sequence_length=args.prompt_len + args.max_steps,
+        rope=True,
+        vocab_size=50280,
+        embedding_size=50304,
+        init_device="cpu",
+    )
+    model = OLMo(config).eval()
+    input_ids = torch.randint(0, config.vocab_size, (args.batch_size, args.prompt_len))
+
+    results = {}
+    with torch.inference_mode():
+        for static_cache in (False, True):
+            decode(model, input_ids, 8, static_cache)  # warm up
+        for name, static_cache in [("past_key_values", False), ("static cache", True)]:
+            results[name] = decode(model, input_ids, args.max_steps, static_cache)
+
+    tokens = [output for output, _ in results.values()]
+    if not torch.equal(tokens[0], tokens[1]):
+        print("warning: the decoded tokens differ")
+
+    # The first step is the prompt.
+    print(f"{'steps':>11} " + " ".join(f"{name:>16}" for name in results) + "   (ms/token)")
+    for start in range(1, args.max_steps, args.report_every):
+        end = min(start + args.report_every, args.max_steps)
+        line = f"{start:>5}-{end - 1:<5} "
+        for _, step_times in results.values():
+            window = step_times[start:end]
+            line += f"{sum(window) / len(window) * 1000:>16.2f} "
+        print(line)
+    for name, (_, step_times) in results.items():
+        print(f"{name:>16}: {sum(step_times[1:]) / (len(step_times) - 1) * 1000:.2f}ms/token overall")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Build a manifest of all of the data files of a training config, which can then be passed as ``data.manifest``
+so that the sizes of the files don't have to be looked up every time the dataset is built.
+
+Usage:
+
+```bash
+python scripts/build_dataset_manifest.py configs/official-1124/OLMo2-7B-stage1.yaml -o s3://bucket/manifest.jsonl
+```
+
+To check an existing manifest against the current files instead:
+
+```bash
+python scripts/build_dataset_manifest.py --verify s3://bucket/manifest.jsonl
+```
+
+Any extra arguments are treated as config overrides, just like with ``scripts/train.py``.
+"""
+
+import argparse
+import logging
+import sys
+
+import numpy as np
+
+from olmo.config import TrainConfig
+from olmo.data.manifest import DatasetManifest
+from olmo.util import clean_opt, data_config_paths, prepare_cli_environment
+
+log = logging.getLogger("build_dataset_manifest")
+
+
+def main(cfg: TrainConfig, output: str, num_threads: int, overwrite: bool):
+    paths = data_config_paths(cfg.data)
+
+    log.info(f"Looking up {len(paths):,d} data files...")
+    manifest = DatasetManifest.build(paths, cfg.data.effective_memmap_dtype, num_threads=num_threads)
+    if cfg.data.label_mask_paths:
+        log.info(f"Looking up {len(cfg.data.label_mask_paths):,d} label mask files...")
+        manifest = manifest.merge(
+            DatasetManifest.build(cfg.data.label_mask_paths, np.bool_, num_threads=num_threads)
+        )
+    manifest.save(output, save_overwrite=overwrite)
+    log.info(f"Wrote manifest of {len(manifest):,d} files to '{output}'")
+
+
+def verify(manifest_path: str, num_threads: int):
+    manifest = DatasetManifest.load(manifest_path)
+    stale = manifest.verify(num_threads=num_threads)
+    for path in stale:
+        log.error(f"'{path}' has changed since the manifest was built")
+    if stale:
+        sys.exit(1)
+    log.info(f"All {len(manifest):,d} files in '{manifest_path}' are up to date")
+
+
+if __name__ == "__main__":
+    prepare_cli_environment()
+
+    parser = argparse.ArgumentParser(description="build a manifest of the data files of a config")
+    parser.add_argument("config_file", type=str, nargs="?", help="config file, not needed with --verify")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("-o", "--output", type=str, help="where to write the manifest")
+    group.add_argument("--verify", type=str, help="an existing manifest to check")
+    parser.add_argument("--num-threads", type=int, default=None, help="number of concurrent requests")
+    parser.add_argument("--overwrite", action="store_true", help="overwrite an existing manifest")
+    args, other_args = parser.parse_known_args()
+
+    if args.verify is not None:
+        verify(args.verify, num_threads=args.num_threads)
+    elif args.config_file is None:
+        parser.error("a config file is required to build a manifest")
+    else:
+        cfg = TrainConfig.load(args.config_file, [clean_opt(s) for s in other_args])
+        main(cfg, args.output, num_threads=args.num_threads, overwrite=args.overwrite)
@@ -0,0 +1,68 @@
+"""
+Write an index of the EOS token offsets next to every data file of a training config, so that training
+with ``data.use_document_index=true`` can compute ``doc_lens`` without scanning every instance.
+Files written by ``scripts/prepare_memmap_dataset.py`` are indexed already.
+
+Usage:
+
+```bash
+python scripts/build_document_indices.py configs/official-1124/OLMo2-7B-stage1.yaml --num-workers 32
+```
+
+Any extra arguments are treated as config overrides, just like with ``scripts/train.py``.
+"""
+
+import argparse
+import concurrent.futures
+import logging
+from typing import Any, Tuple
+
+from olmo.config import TrainConfig
+from olmo.data.document_index import (
+    build_document_index,
+    document_index_path,
+    write_document_index,
+)
+from olmo.util import clean_opt, data_config_paths, file_exists, prepare_cli_environment
+
+log = logging.getLogger("build_document_indices")
+
+
+def build_index(path: str, eos_token_id: int, dtype: Any, overwrite: bool) -> Tuple[str, int]:
+    target = document_index_path(path, eos_token_id)
+    if not overwrite and file_exists(target):
+        return target, -1
+    eos_offsets = build_document_index(path, eos_token_id, dtype)
+    write_document_index(eos_offsets, target, save_overwrite=overwrite)
+    return target, len(eos_offsets)
+
+
+def main(cfg: TrainConfig, num_workers: int, overwrite: bool):
+    paths = data_config_paths(cfg.data)
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = {
+            executor.submit(
+                build_index, path, cfg.model.eos_token_id, cfg.data.effective_memmap_dtype, overwrite
+            ): path
+            for path in paths
+        }
+        for i, future in enumerate(concurrent.futures.as_completed(futures)):
+            target, num_docs = future.result()
+            if num_docs < 0:
+                log.info(f"[{i + 1}/{len(paths)}] '{target}' already exists, skipping")
+            else:
+                log.info(f"[{i + 1}/{len(paths)}] Wrote '{target}' with {num_docs:,d} documents")
+
+
+if __name__ == "__main__":
+    prepare_cli_environment()
+
+    parser = argparse.ArgumentParser(description="index the documents in every data file of a config")
+    parser.add_argument("config_file", type=str, help="config file")
+    parser.add_argument("--num-workers", type=int, default=None, help="number of processes to use")
+    parser.add_argument("--overwrite", action="store_true", help="rebuild indices that already exist")
+    args, other_args = parser.parse_known_args()
+
+    cfg = TrainConfig.load(args.config_file, [clean_opt(s) for s in other_args])
+    main(cfg, num_workers=args.num_workers, overwrite=args.overwrite)
@@ -0,0 +1,81 @@
+"""
+Run the instance filter from a training config over every data file ahead of time and save the results
+next to each file, so that training with ``data.instance_filter.precomputed=true`` doesn't have to.
+
+Usage:
+
+```bash
+python scripts/build_instance_filter_masks.py configs/official-1124/OLMo2-7B-stage1.yaml --num-workers 32
+```
+
+Any extra arguments are treated as config overrides, just like with ``scripts/train.py``.
+"""
+
+import argparse
+import concurrent.futures
+import logging
+from typing import Any, Tuple
+
+import numpy as np
+
+from olmo.config import InstanceFilterConfig, TrainConfig
+from olmo.data.instance_filter import (
+    build_instance_filter_mask,
+    instance_filter_mask_path,
+    write_instance_filter_mask,
+)
+from olmo.exceptions import OLMoConfigurationError
+from olmo.util import clean_opt, data_config_paths, file_exists, prepare_cli_environment
+
+log = logging.getLogger("build_instance_filter_masks")
+
+
+def build_mask(
+    path: str, config: InstanceFilterConfig, chunk_size: int, dtype: Any, overwrite: bool
+) -> Tuple[str, int]:
+    target = instance_filter_mask_path(path, config, chunk_size, dtype)
+    if not overwrite and file_exists(target):
+        return target, -1
+    bitmap = build_instance_filter_mask(path, config, chunk_size, dtype)
+    write_instance_filter_mask(bitmap, target, save_overwrite=overwrite)
+    return target, int(np.unpackbits(bitmap).sum())
+
+
+def main(cfg: TrainConfig, num_workers: int, overwrite: bool):
+    if cfg.data.instance_filter is None:
+        raise OLMoConfigurationError("The config doesn't have an instance filter ('data.instance_filter')")
+
+    paths = data_config_paths(cfg.data)
+
+    # Each file is independent, so we just process as many in parallel as we can.
+    with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = {
+            executor.submit(
+                build_mask,
+                path,
+                cfg.data.instance_filter,
+                cfg.model.max_sequence_length,
+                cfg.data.effective_memmap_dtype,
+                overwrite,
+            ): path
+            for path in paths
+        }
+        for i, future in enumerate(concurrent.futures.as_completed(futures)):
+            target, num_filtered = future.result()
+            if num_filtered < 0:
+                log.info(f"[{i + 1}/{len(paths)}] '{target}' already exists, skipping")
+            else:
+                log.info(f"[{i + 1}/{len(paths)}] Wrote '{target}', {num_filtered:,d} instances filtered")
+
+
+if __name__ == "__main__":
+    prepare_cli_environment()
+
+    parser = argparse.ArgumentParser(description="precompute the instance filter for every data file of a config")
+    parser.add_argument("config_file", type=str, help="config file")
+    parser.add_argument("--num-workers", type=int, default=None, help="number of processes to use")
+    parser.add_argument("--overwrite", action="store_true", help="rebuild masks that already exist")
+    args, other_args = parser.parse_known_args()
+
+    cfg = TrainConfig.load(args.config_file, [clean_opt(s) for s in other_args])
+    main(cfg, num_workers=args.num_workers, overwrite=args.overwrite)
@@ -0,0 +1,95 @@
+"""
+Pack the documents of every data file of a training config into instances of at most
+``model.max_sequence_length`` tokens and save the result next to each file, for training with
+``data.pack_documents=true``. Document boundaries come from the EOS index next to each file
+(see ``scripts/build_document_indices.py``), or from scanning the file if there isn't one.
+
+Usage:
+
+```bash
+python scripts/build_packed_indices.py configs/official-1124/OLMo2-7B-stage1.yaml --num-workers 32
+```
+
+Any extra arguments are treated as config overrides, just like with ``scripts/train.py``.
+"""
+
+import argparse
+import concurrent.futures
+import logging
+from typing import Any, Tuple
+
+import numpy as np
+
+from olmo.config import TrainConfig
+from olmo.data.document_index import (
+    build_document_index,
+    document_index_path,
+    read_document_index,
+)
+from olmo.data.packing import build_packed_index, packed_index_path, write_packed_index
+from olmo.util import (
+    clean_opt,
+    data_config_paths,
+    file_exists,
+    file_size,
+    prepare_cli_environment,
+)
+
+log = logging.getLogger("build_packed_indices")
+
+
+def build_index(
+    path: str, max_sequence_length: int, eos_token_id: int, dtype: Any, overwrite: bool
+) -> Tuple[str, int, int]:
+    target = packed_index_path(path, max_sequence_length, eos_token_id)
+    if not overwrite and file_exists(target):
+        return target, -1, 0
+    if file_exists(document_index_path(path, eos_token_id)):
+        eos_offsets = read_document_index(document_index_path(path, eos_token_id))
+    else:
+        eos_offsets = build_document_index(path, eos_token_id, dtype)
+    num_tokens = file_size(path) // np.dtype(dtype).itemsize
+    pieces, instance_offsets = build_packed_index(eos_offsets, num_tokens, max_sequence_length)
+    write_packed_index(pieces, instance_offsets, target, save_overwrite=overwrite)
+    return target, len(instance_offsets) - 1, num_tokens
+
+
+def main(cfg: TrainConfig, num_workers: int, overwrite: bool):
+    paths = data_config_paths(cfg.data)
+
+    max_sequence_length = cfg.model.max_sequence_length
+    with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = {
+            executor.submit(
+                build_index,
+                path,
+                max_sequence_length,
+                cfg.model.eos_token_id,
+                cfg.data.effective_memmap_dtype,
+                overwrite,
+            ): path
+            for path in paths
+        }
+        for i, future in enumerate(concurrent.futures.as_completed(futures)):
+            target, num_instances, num_tokens = future.result()
+            if num_instances < 0:
+                log.info(f"[{i + 1}/{len(paths)}] '{target}' already exists, skipping")
+            else:
+                padding = 1 - num_tokens / max(1, num_instances * max_sequence_length)
+                log.info(
+                    f"[{i + 1}/{len(paths)}] Wrote '{target}' with {num_instances:,d} instances, "
+                    f"{padding:.2%} padding"
+                )
+
+
+if __name__ == "__main__":
+    prepare_cli_environment()
+
+    parser = argparse.ArgumentParser(description="pack the documents in every data file of a config")
+    parser.add_argument("config_file", type=str, help="config file")
+    parser.add_argument("--num-workers", type=int, default=None, help="number of processes to use")
+    parser.add_argument("--overwrite", action="store_true", help="rebuild indices that already exist")
+    args, other_args = parser.parse_known_args()
+
+    cfg = TrainConfig.load(args.config_file, [clean_opt(s) for s in other_args])
+    main(cfg, num_workers=args.num_workers, overwrite=args.overwrite)
@@ -13,7 +13,7 @@ from cached_path import cached_path
 
 from olmo.checkpoint import load_state_dict
 from olmo.config import TrainConfig
-from olmo.data import build_memmap_dataset, build_train_dataloader
+from olmo.data import MixtureDataset, build_memmap_dataset, build_train_dataloader
 from olmo.data.iterable_dataset import IterableDataset
 from olmo.tokenizer import Tokenizer
 from olmo.util import add_cached_path_clients, clean_opt, prepare_cli_environment
@@ -143,7 +143,11 @@ def main(
         return
 
     cfg = TrainConfig.load(save_folder / "config.yaml", overrides=[clean_opt("--evaluators=[]")])
-    dataset = build_memmap_dataset(cfg, cfg.data)
+    dataset = MixtureDataset.from_data_config(
+        build_memmap_dataset(cfg, cfg.data),
+        cfg.data,
+        seed=cfg.data.seed if cfg.data.seed is not None else cfg.seed,
+    )
     tokenizer = Tokenizer.from_train_config(cfg)
 
     if rank is None:
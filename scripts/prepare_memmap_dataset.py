@@ -46,6 +46,11 @@ from smashed.utils.io_utils import (
 )
 
 from olmo import Tokenizer
+from olmo.data.document_index import (
+    build_document_index,
+    document_index_path,
+    write_document_index,
+)
 from olmo.util import prepare_cli_environment
 
 log = logging.getLogger(__name__)
@@ -117,6 +122,7 @@ class MemmapFile:
         path: str,
         dtype: np.dtype,
         max_tokens: int = DEFAULT_MAX_TOKENS,
+        eos_token_id: Optional[int] = None,
     ):
         """Create a new memmap file.
 
@@ -125,10 +131,13 @@ class MemmapFile:
                 written to a temporary file first and then uploaded to the destination.
             dtype (np.dtype): Data type for the memmap file; must be a valid numpy dtype.
             max_tokens (int, optional): Maximum number of tokens per file. Defaults to 500M tokens, which is 1GB.
+            eos_token_id (int, optional): If set, an index of the offsets of this token is written next to
+                the memmap file when it's closed. Defaults to None.
         """
         self.path = MultiPath.parse(path)
         self.dtype = dtype
         self.max_tokens = max_tokens
+        self.eos_token_id = eos_token_id
 
         self._local_path: Optional[Path] = None
         self._written_tokens = 0
@@ -209,16 +218,30 @@ class MemmapFile:
                 log.info(f"Resized memmap file from {old_memmap.nbytes:,} to {new_memmap.nbytes:,} bytes")
                 os.remove(temp_path)
 
+            # the document index is small, so we write it next to the local file and upload it the same way
+            to_upload = [(self._local_path, self.path)]
+            if self.eos_token_id is not None:
+                eos_offsets = build_document_index(self._local_path, self.eos_token_id, self.dtype)
+                local_index_path = Path(document_index_path(self._local_path, self.eos_token_id))
+                write_document_index(eos_offsets, local_index_path, save_overwrite=True)
+                to_upload.append(
+                    (local_index_path, MultiPath.parse(document_index_path(self.path.as_str, self.eos_token_id)))
+                )
+                log.info(f"Indexed {len(eos_offsets):,} documents in {self._local_path}")
+
             if not self.path.is_local:
-                with ExitStack() as stack:
-                    f = stack.enter_context(stream_file_for_read(self._local_path, "rb"))
-                    g = stack.enter_context(open_file_for_write(self.path, mode="wb"))
-                    g.write(f.read())
-                log.info(f"Written memmap file to {self.path.as_str}")
+                for local_path, remote_path in to_upload:
+                    with ExitStack() as stack:
+                        f = stack.enter_context(stream_file_for_read(local_path, "rb"))
+                        g = stack.enter_context(open_file_for_write(remote_path, mode="wb"))
+                        g.write(f.read())
+                    log.info(f"Written {local_path.name} to {remote_path.as_str}")
         finally:
             if not self.path.is_local:
-                # delete the temporary file under any circumstances
+                # delete the temporary files under any circumstances
                 os.remove(self._local_path)
+                if self.eos_token_id is not None:
+                    Path(document_index_path(self._local_path, self.eos_token_id)).unlink(missing_ok=True)
 
         self._local_path = self._memmap = None
 
@@ -234,6 +257,7 @@ def fill_memmap(
     random_seed: int = 3920,
     repeat_sequence: int = 1,
     cache_dir: Optional[str] = None,
+    index_documents: bool = True,
 ) -> int:
     """Write a memmap file from a file of documents."""
 
@@ -283,7 +307,14 @@ def fill_memmap(
 
                 # create a new memmap file; progressively name them with an index
                 curr_memmap_path = f"{memmap_path}_{file_index:05d}.npy"
-                memmap = stack.enter_context(MemmapFile(path=curr_memmap_path, dtype=dtype, max_tokens=max_tokens))
+                memmap = stack.enter_context(
+                    MemmapFile(
+                        path=curr_memmap_path,
+                        dtype=dtype,
+                        max_tokens=max_tokens,
+                        eos_token_id=tokenizer.eos_token_id if index_documents else None,
+                    )
+                )
 
                 # increment the file index and reset the tokens index
                 file_index += 1
@@ -369,6 +400,11 @@ def make_source_and_target(
     type=int,
     help="Maximum number of tokens to store in a single memmap file (default: 512M tokens or 1GB)",
 )
+@click.option(
+    "--index-documents/--no-index-documents",
+    default=True,
+    help="Write an index of the EOS token offsets next to each memmap file",
+)
 @click.option("--debug/--no-debug", default=False, help="Enable debug (single process mode)")
 @click.option(
     "--safe-mode/--fast-mode", default=False, help="Safe mode caches locally and decompresses using gzip.open"
@@ -390,6 +426,7 @@ def main(
     paths_per_worker: int = 1,
     max_workers: int = 1,
     cache_dir: Optional[str] = None,
+    index_documents: bool = True,
     ack_deprecated: bool = False,
 ):
     print("WARNING: THIS SCRIPT IS DEPRECATED!!!")
@@ -419,6 +456,7 @@ def main(
     print(f"paths_per_worker: {paths_per_worker}")
     print(f"max_workers:      {max_workers}")
     print(f"cache_dir:        {cache_dir}")
+    print(f"index_documents:  {index_documents}")
     print("=====================")
 
     dtype = np.dtype(dtype_str)
@@ -438,6 +476,7 @@ def main(
         random_seed=random_seed,
         repeat_sequence=repeat_sequence,
         cache_dir=cache_dir,
+        index_documents=index_documents,
     )
 
     total_tokens_written = 0
@@ -480,6 +519,9 @@ def main(
                     total_tokens += len(encode_fn(row))
 
         for output_path in recursively_list_files(output):
+            if not output_path.endswith(".npy"):
+                # skip document indices
+                continue
             memmap = np.memmap(output_path, mode="r", dtype=dtype)
             total_tokens -= len(memmap)
             total_docs -= (memmap == tokenizer.eos_token_id).sum()
@@ -1,5 +1,9 @@
 """
 Script for preparing the Tulu V2 data for fine-tuning an OLMo model.
+
+With ``--no-pad`` examples aren't padded to the maximum sequence length. Instead, an index of where each
+example ends is written next to the token file, so that ``scripts/build_packed_indices.py`` can pack
+the examples together for training with ``data.pack_documents=true``.
 """
 
 import logging
@@ -11,6 +15,7 @@ import datasets as ds
 import numpy as np
 from rich.progress import track
 
+from olmo.data.document_index import document_index_path, write_document_index
 from olmo.tokenizer import Tokenizer
 from olmo.util import prepare_cli_environment
 
@@ -28,7 +33,7 @@ def main(opts) -> None:
 
     log.info("Tokenizing dataset...")
     dataset = dataset.map(
-        partial(preprocess, tokenizer=tokenizer, max_seq_len=opts.seq_len),
+        partial(preprocess, tokenizer=tokenizer, max_seq_len=opts.seq_len, pad=not opts.no_pad),
         batched=False,
         remove_columns=["dataset", "id", "messages"],
         num_proc=opts.num_proc,  # type: ignore
@@ -42,7 +47,7 @@ def main(opts) -> None:
     log.info("Counting tokens...")
     total_tokens = 0
     for ex in track(dataset):
-        assert len(ex["input_ids"]) == opts.seq_len  # type: ignore
+        assert len(ex["input_ids"]) == opts.seq_len or opts.no_pad  # type: ignore
         total_tokens += len(ex["input_ids"])  # type: ignore
     log.info(f"Total tokens: {total_tokens:,d}")
 
@@ -57,14 +62,25 @@ def main(opts) -> None:
         str(output_dir / "label_mask.npy"), dtype=np.bool_, mode="w+", shape=(total_tokens,)
     )
     offset = 0
+    example_ends = []
     for ex in track(dataset):
         ex_len = len(ex["input_ids"])  # type: ignore
         input_ids_file[offset : offset + ex_len] = ex["input_ids"]  # type: ignore
         label_mask_file[offset : offset + ex_len] = ex["label_mask"]  # type: ignore
         offset += ex_len
+        example_ends.append(offset - 1)
     input_ids_file.flush()
     label_mask_file.flush()
 
+    if opts.no_pad:
+        # Each example contains EOS tokens after every assistant turn, so the document index lists
+        # the end of each example instead, which keeps whole conversations together when packing.
+        write_document_index(
+            np.array(example_ends, dtype=np.int64),
+            document_index_path(output_dir / "input_ids.npy", opts.eos),
+            save_overwrite=True,
+        )
+
     log.info("Done!")
 
 
@@ -72,7 +88,7 @@ def filter(example):
     return example["n_labels"] > 0
 
 
-def preprocess(example, tokenizer: Tokenizer, max_seq_len: int):
+def preprocess(example, tokenizer: Tokenizer, max_seq_len: int, pad: bool = True):
     input_ids = [tokenizer.eos_token_id]
     label_mask = [False]
 
@@ -97,7 +113,7 @@ def preprocess(example, tokenizer: Tokenizer, max_seq_len: int):
     input_ids = input_ids[:max_seq_len]
     label_mask = label_mask[:max_seq_len]
 
-    if len(input_ids) < max_seq_len:
+    if pad and len(input_ids) < max_seq_len:
         pad_len = max_seq_len - len(input_ids)
         input_ids += [tokenizer.pad_token_id] * pad_len
         label_mask += [False] * pad_len
@@ -121,6 +137,11 @@ def get_parser() -> ArgumentParser:
     parser.add_argument("-s", "--seq-len", type=int, help="""Max sequence length.""", default=2048)
     parser.add_argument("--eos", type=int, help="""EOS token ID.""", default=50279)
     parser.add_argument("--pad", type=int, help="""PAD token ID.""", default=1)
+    parser.add_argument(
+        "--no-pad",
+        action="store_true",
+        help="""Don't pad examples, and write an index of example boundaries for packing instead.""",
+    )
     parser.add_argument("-j", "--num-proc", type=int, help="""Number of workers.""", default=8)
     return parser
 
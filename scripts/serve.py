@@ -0,0 +1,133 @@
+"""
+Serve a checkpoint with a local OpenAI-style completions endpoint, or generate completions for a file of
+prompts offline, with continuous batching (see :mod:`olmo.serving`).
+
+Usage:
+
+```bash
+python scripts/serve.py /checkpoints/step1000-unsharded --port 8000
+curl localhost:8000/v1/completions -d '{"prompt": "Language models are", "max_tokens": 32}'
+
+python scripts/serve.py /checkpoints/step1000-unsharded --prompts prompts.jsonl -o completions.jsonl
+```
+
+Each line of the prompts file is a JSON object with a ``prompt``, and optionally any of the sampling
+parameters of the endpoint.
+"""
+
+import argparse
+import json
+import logging
+import time
+
+import torch
+
+from olmo.model import OLMo
+from olmo.serving import GenerationEngine, GenerationServer, SamplingParams
+from olmo.tokenizer import Tokenizer
+from olmo.util import prepare_cli_environment
+
+log = logging.getLogger("serve")
+
+
+def generate_offline(engine: GenerationEngine, tokenizer: Tokenizer, prompts_file: str, output_file: str):
+    with open(prompts_file) as f:
+        requests = [json.loads(line) for line in f if line.strip()]
+    start = time.monotonic()
+    request_ids = []
+    for request in requests:
+        params = SamplingParams(
+            max_tokens=request.get("max_tokens", 16),
+            temperature=request.get("temperature", 1.0),
+            top_k=request.get("top_k"),
+            top_p=request.get("top_p"),
+            stop_token_ids=request.get("stop_token_ids") or (),
+            ignore_eos=request.get("ignore_eos", False),
+        )
+        prompt = request["prompt"]
+        if isinstance(prompt, str):
+            prompt = tokenizer.encode(prompt, add_special_tokens=False)
+        request_ids.append(engine.add_request(prompt, params))
+
+    outputs = {}
+    while engine.has_unfinished_requests():
+        for output in engine.step():
+            outputs[output.request_id] = output
+    seconds = time.monotonic() - start
+
+    num_tokens = 0
+    with open(output_file, "w") as f:
+        for request, request_id in zip(requests, request_ids):
+            output = outputs[request_id]
+            num_tokens += len(output.token_ids)
+            completion = {
+                **request,
+                "completion": tokenizer.decode(output.token_ids),
+                "token_ids": output.token_ids,
+                "finish_reason": output.finish_reason,
+            }
+            f.write(json.dumps(completion) + "\n")
+    log.info(
+        f"Generated {num_tokens:,d} tokens for {len(requests):,d} prompts in {seconds:.1f}s "
+        f"({num_tokens / seconds:.1f} tokens/s, {engine.num_steps:,d} steps)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="serve a checkpoint with continuous batching")
+    parser.add_argument("checkpoint_dir", type=str, help="the checkpoint to load")
+    parser.add_argument("--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--dtype", type=str, default=None, choices=["float32", "bfloat16", "float16"])
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--model-name", type=str, default=None, help="the model name in responses")
+    parser.add_argument("--page-size", type=int, default=16, help="positions per page of the KV cache")
+    parser.add_argument("--num-pages", type=int, default=None, help="pages of the KV cache")
+    parser.add_argument(
+        "--cache-memory-gb", type=float, default=4.0, help="memory of the KV cache, unless --num-pages is given"
+    )
+    parser.add_argument("--max-num-seqs", type=int, default=64, help="the maximum number of sequences per step")
+    parser.add_argument(
+        "--max-num-batched-tokens", type=int, default=2048, help="the maximum number of positions per step"
+    )
+    parser.add_argument("--seed", type=int, default=None, help="the seed for sampling")
+    parser.add_argument("--prompts", type=str, default=None, help="a JSON lines file of prompts to run offline")
+    parser.add_argument("-o", "--output", type=str, default=None, help="where to write the offline completions")
+    args = parser.parse_args()
+
+    prepare_cli_environment()
+
+    if (args.prompts is None) != (args.output is None):
+        parser.error("--prompts and --output go together")
+
+    model = OLMo.from_checkpoint(args.checkpoint_dir, device=args.device)
+    if args.dtype is not None:
+        model = model.to(getattr(torch, args.dtype))
+    tokenizer = Tokenizer.from_checkpoint(args.checkpoint_dir)
+    engine = GenerationEngine(
+        model,
+        eos_token_id=tokenizer.eos_token_id,
+        page_size=args.page_size,
+        num_pages=args.num_pages,
+        cache_memory_gb=args.cache_memory_gb,
+        max_num_seqs=args.max_num_seqs,
+        max_num_batched_tokens=args.max_num_batched_tokens,
+        seed=args.seed,
+    )
+
+    if args.prompts is not None:
+        generate_offline(engine, tokenizer, args.prompts, args.output)
+        return
+
+    server = GenerationServer(
+        engine,
+        tokenizer,
+        model_name=args.model_name or args.checkpoint_dir.rstrip("/").split("/")[-1],
+        host=args.host,
+        port=args.port,
+    )
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
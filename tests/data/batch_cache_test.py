@@ -0,0 +1,103 @@
+from pathlib import Path
+from typing import Any, Dict, List
+
+import torch
+from torch.utils.data import DataLoader
+
+from olmo.config import BatchCacheConfig, PaddingDirection, TrainConfig
+from olmo.data import BatchCache, BatchCacheDataLoader, DataCollator, IterableDataset
+from olmo.data.batch_cache import fingerprint
+
+
+def make_dataset(offset: int) -> IterableDataset:
+    instances = [
+        {
+            "input_ids": torch.arange(i, i + 8),
+            "doc_lens": torch.tensor([4, 4] if i % 2 else [8], dtype=torch.int32),
+        }
+        for i in range(offset, offset + 40)
+    ]
+    return IterableDataset(instances, 4, world_size=1, rank=0, seed=0, num_threads=0)  # type: ignore
+
+
+def collect(data_loader: DataLoader) -> List[Dict[str, Any]]:
+    return [
+        {k: v.clone() if isinstance(v, torch.Tensor) else v for k, v in batch.items()} for batch in data_loader
+    ]
+
+
+def assert_batches_equal(actual: List[Dict[str, Any]], expected: List[Dict[str, Any]]):
+    assert len(actual) == len(expected)
+    for actual_batch, expected_batch in zip(actual, expected):
+        assert actual_batch.keys() == expected_batch.keys()
+        for key, value in expected_batch.items():
+            if isinstance(value, torch.Tensor):
+                assert actual_batch[key].dtype == value.dtype
+                torch.testing.assert_close(actual_batch[key], value)
+            else:
+                assert actual_batch[key] == value
+
+
+def test_batch_cache_data_loader(tmp_path: Path):
+    collator = DataCollator(pad_direction=PaddingDirection.right, pad_token_id=0)
+    cache = BatchCache(tmp_path, "fingerprint", start_batch=2, num_batches=3)
+
+    # The first run loads and records batches 2 to 4.
+    dataset = make_dataset(0)
+    expected = collect(DataLoader(dataset, batch_size=4, collate_fn=collator))  # type: ignore
+    assert len(expected) == 10
+    recorded = collect(BatchCacheDataLoader(dataset, batch_size=4, collate_fn=collator, cache=cache))
+    assert_batches_equal(recorded, expected)
+    reader = cache.open(0, 0, 1)
+    assert reader is not None
+    assert (reader.start_batch, reader.end_batch) == (2, 5)
+    assert_batches_equal([reader[i] for i in range(2, 5)], expected[2:5])
+
+    # Later runs replay them, even though the underlying data is different here.
+    other_dataset = make_dataset(1000)
+    other_expected = collect(DataLoader(other_dataset, batch_size=4, collate_fn=collator))  # type: ignore
+    other_dataset.start_index = 3 * 4
+    data_loader = BatchCacheDataLoader(
+        other_dataset, batch_size=4, num_workers=2, collate_fn=collator, cache=cache
+    )
+    assert_batches_equal(collect(data_loader), expected[3:5] + other_expected[5:])
+    assert other_dataset.start_index == 3 * 4
+
+    # Outside of the recorded range, or in another epoch, batches are loaded as usual and not recorded again.
+    other_dataset.start_index = 5 * 4
+    assert_batches_equal(collect(data_loader), other_expected[5:])
+    other_dataset.start_index = 0
+    other_dataset.reshuffle(1)
+    assert cache.open(1, 0, 1) is None
+    epoch_1 = collect(data_loader)
+    assert len(epoch_1) == 10
+    reader = cache.open(1, 0, 1)
+    assert reader is not None
+    assert_batches_equal([reader[i] for i in range(2, 5)], epoch_1[2:5])
+
+
+def test_batch_cache_partial_recording(tmp_path: Path):
+    collator = DataCollator(pad_direction=PaddingDirection.right, pad_token_id=0)
+    cache = BatchCache(tmp_path, "fingerprint", start_batch=1)
+    dataset = make_dataset(0)
+    for i, _ in enumerate(BatchCacheDataLoader(dataset, batch_size=4, collate_fn=collator, cache=cache)):
+        if i == 3:
+            break
+    # What was recorded up to stopping early is kept.
+    reader = cache.open(0, 0, 1)
+    assert reader is not None
+    assert (reader.start_batch, reader.end_batch) == (1, 4)
+
+
+def test_batch_cache_fingerprint():
+    config = TrainConfig.load("test_fixtures/train_tiny.yaml")
+    config.device_train_batch_size = config.global_train_batch_size
+    config.data.batch_cache = BatchCacheConfig(dir="/tmp/batches")
+    key = fingerprint(config)
+
+    config.data.num_workers = 4
+    config.data.batch_cache.num_batches = 10
+    assert fingerprint(config) == key
+
+    config.seed += 1
+    assert fingerprint(config) != key
@@ -0,0 +1,73 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+from torch.utils.data import DataLoader
+
+from olmo import util
+from olmo.config import PaddingDirection
+from olmo.data import DataCollator, IterableDataset, MemMapDataset
+from olmo.data.benchmark import (
+    LocalObjectStore,
+    benchmark_data_loader,
+    instrument_data_loader,
+)
+from olmo.util import file_size, get_bytes_range, get_file_info
+
+
+def test_local_object_store(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    (tmp_path / "bucket").mkdir()
+    data = bytes(range(256))
+    (tmp_path / "bucket" / "data.bin").write_bytes(data)
+
+    with LocalObjectStore(tmp_path, latency=0.01) as store:
+        url = store.http_url(tmp_path / "bucket" / "data.bin")
+        assert file_size(url) == 256
+        assert get_bytes_range(url, 10, 20) == data[10:30]
+        assert get_file_info(url).etag is not None
+        with pytest.raises(FileNotFoundError):
+            get_file_info(f"{store.url}/bucket/missing.bin")
+        assert store._resolve("/../../../../../etc/hostname") is None
+        assert store.num_requests == 4
+        assert store.num_bytes == 20
+
+        for key, value in store.s3_environ().items():
+            monkeypatch.setenv(key, value)
+        util._get_s3_client_for_pid.cache_clear()
+        try:
+            s3_url = store.s3_url(tmp_path / "bucket" / "data.bin")
+            assert s3_url == "s3://bucket/data.bin"
+            assert file_size(s3_url) == 256
+            assert get_bytes_range(s3_url, 100, 50) == data[100:150]
+        finally:
+            util._get_s3_client_for_pid.cache_clear()
+
+
+@pytest.mark.parametrize("num_workers", [0, 2])
+def test_benchmark_data_loader(tmp_path: Path, num_workers: int):
+    for i in range(2):
+        mmap = np.memmap(tmp_path / f"mmap{i}.npy", mode="w+", dtype=np.uint16, shape=(64,))
+        mmap[:] = np.arange(64 * i, 64 * (i + 1), dtype=np.uint16)
+        mmap.flush()
+
+    with LocalObjectStore(tmp_path) as store:
+        dataset = MemMapDataset(*[store.http_url(tmp_path / f"mmap{i}.npy") for i in range(2)], chunk_size=8)
+        data_loader = DataLoader(
+            IterableDataset(dataset, 4, world_size=1, rank=0, seed=0, num_threads=0),  # type: ignore
+            batch_size=4,
+            num_workers=num_workers,
+            collate_fn=DataCollator(pad_direction=PaddingDirection.right, pad_token_id=0),
+        )
+        instrument_data_loader(data_loader)
+        result = benchmark_data_loader(data_loader, num_batches=3)
+
+    assert result.num_batches == 3
+    assert result.num_instances == 12
+    assert result.num_bytes == 12 * 8 * 2
+    assert result.instances_per_second > 0
+    for stage in ("index", "read", "collate", "ipc"):
+        assert len(result.stage_seconds[stage]) == 3
+    assert "filter" not in result.stage_seconds
+    summary = result.summary()
+    assert summary["read_p50_ms"] > 0
+    assert summary["filter_p99_ms"] == 0
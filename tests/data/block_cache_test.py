@@ -0,0 +1,102 @@
+import concurrent.futures
+import time
+from pathlib import Path
+
+import numpy as np
+
+from olmo.data import BlockCache, MemMapDataset
+
+
+def wait_for_pending(cache: BlockCache):
+    for _ in range(100):
+        if not cache._pending:
+            return
+        time.sleep(0.05)
+
+
+def test_block_cache_reads_and_reuses_blocks(local_file_server, tmp_path: Path):
+    data = np.random.default_rng(0).integers(0, 256, size=10_000, dtype=np.uint8).tobytes()
+    (local_file_server.root / "data.bin").write_bytes(data)
+    url = local_file_server.url("data.bin")
+
+    cache = BlockCache(tmp_path / "cache", max_size=1_000_000, block_size=1024, read_ahead=0)
+    # A range that spans several blocks, and one that ends at the end of the file.
+    assert cache.get_bytes_range(url, 1000, 3000) == data[1000:4000]
+    assert cache.get_bytes_range(url, 9500, 500) == data[9500:]
+    num_requests = len(local_file_server.get_requests())
+    assert num_requests == 5
+
+    # A fresh cache on the same directory, like a new process or restart, shouldn't need the network.
+    cache = BlockCache(tmp_path / "cache", max_size=1_000_000, block_size=1024, read_ahead=0)
+    assert cache.get_bytes_range(url, 2048, 100) == data[2048:2148]
+    assert len(local_file_server.get_requests()) == num_requests
+
+    # Changing the file changes its ETag, so the stale blocks aren't used.
+    new_data = bytes(reversed(data))
+    time.sleep(0.01)
+    (local_file_server.root / "data.bin").write_bytes(new_data)
+    cache = BlockCache(tmp_path / "cache", max_size=1_000_000, block_size=1024, read_ahead=0)
+    assert cache.get_bytes_range(url, 2048, 100) == new_data[2048:2148]
+
+
+def test_block_cache_read_ahead_and_eviction(local_file_server, tmp_path: Path):
+    data = bytes(range(256)) * 40
+    (local_file_server.root / "data.bin").write_bytes(data)
+    url = local_file_server.url("data.bin")
+
+    cache = BlockCache(tmp_path / "cache", max_size=4096, block_size=1024, read_ahead=2)
+    assert cache.get_bytes_range(url, 0, 10) == data[:10]
+    wait_for_pending(cache)
+    assert len(local_file_server.get_requests()) == 3
+    # Blocks 1 and 2 were read ahead.
+    assert cache.get_bytes_range(url, 1024, 2048) == data[1024:3072]
+    wait_for_pending(cache)
+
+    for start in range(0, len(data), 1024):
+        assert cache.get_bytes_range(url, start, 1024) == data[start : start + 1024]
+    wait_for_pending(cache)
+    cached_size = sum(p.stat().st_size for p in (tmp_path / "cache").glob("*.block"))
+    assert 0 < cached_size <= 4096
+
+
+def test_block_cache_evicts_to_low_water_mark(local_file_server, tmp_path: Path):
+    data = bytes(range(256)) * 4 * 66
+    (local_file_server.root / "data.bin").write_bytes(data)
+    url = local_file_server.url("data.bin")
+
+    cache = BlockCache(tmp_path / "cache", max_size=64 * 1024, block_size=1024, read_ahead=0)
+    for block_index in range(65):
+        cache.get_bytes_range(url, block_index * 1024, 1024)
+    # Going over the budget evicts down to 90% of it...
+    assert len(list((tmp_path / "cache").glob("*.block"))) == 57
+    # ...which leaves room for the next blocks.
+    cache.get_bytes_range(url, 65 * 1024, 1024)
+    assert len(list((tmp_path / "cache").glob("*.block"))) == 58
+
+
+def test_block_cache_failed_prefetch(local_file_server, tmp_path: Path):
+    data = bytes(range(256)) * 8
+    (local_file_server.root / "data.bin").write_bytes(data)
+    url = local_file_server.url("data.bin")
+
+    cache = BlockCache(tmp_path / "cache", max_size=1_000_000, block_size=1024, read_ahead=0)
+    info = cache._get_file_info(url)
+    failed: concurrent.futures.Future = concurrent.futures.Future()
+    failed.set_exception(OSError("connection reset"))
+    cache._pending[str(cache._block_path(url, info, 1))] = failed
+    # A read of a block whose prefetch failed fetches it again.
+    assert cache.get_bytes_range(url, 1024, 100) == data[1024:1124]
+
+
+def test_mmap_dataset_with_block_cache(local_file_server, tmp_path: Path):
+    tokens = np.arange(64, dtype=np.uint16)
+    tokens.tofile(local_file_server.root / "tokens.npy")
+    cache = BlockCache(tmp_path / "cache", max_size=1_000_000, block_size=32, read_ahead=0)
+    ds = MemMapDataset(local_file_server.url("tokens.npy"), chunk_size=8, block_cache=cache)
+    ds.prefetch([0, 1, 2, 3])
+    wait_for_pending(cache)
+    num_requests = len(local_file_server.get_requests())
+    assert num_requests == 2
+    assert ds[1]["input_ids"].tolist() == list(range(8, 16))
+    assert [x["input_ids"].tolist() for x in ds.__getitems__([0, 3])] == [list(range(8)), list(range(24, 32))]
+    assert len(local_file_server.get_requests()) == num_requests
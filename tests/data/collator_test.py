@@ -192,3 +192,38 @@ def test_build_custom_collator_with_overrides(train_config):
         [5, 3, 3, 0],
     ]
     assert batch["max_doc_lens"] == [5, 5]
+
+
+def test_collate_fixed_length_matches_padded(train_config):
+    eos_token_id = 50279
+    collator = DataCollator.from_train_config(train_config)
+
+    input_ids = torch.randint(0, 8, (3, 16)).to(dtype=torch.int32)
+    input_ids[:, 3] = eos_token_id
+    inputs = [
+        {
+            "input_ids": input_ids[i],
+            "attention_mask": torch.ones(16, dtype=torch.long),
+            "label_mask": torch.rand(16) > 0.5,
+            "index": i,
+            "instance_mask": i != 1,
+            "doc_lens": get_document_lengths(input_ids[i], eos_token_id),
+            "metadata": {"label": "test"},
+        }
+        for i in range(3)
+    ]
+    fast = collator._collate_fixed_length(inputs)  # type: ignore
+    assert fast is not None
+    padded = collator._collate_padded(inputs)  # type: ignore
+    assert list(fast.keys()) == list(padded.keys())
+    for key, value in fast.items():
+        if isinstance(value, torch.Tensor):
+            assert value.dtype == padded[key].dtype
+            assert torch.equal(value, padded[key])
+        else:
+            assert value == padded[key]
+
+    # Items of different lengths or with an attention bias need the general path.
+    assert collator._collate_fixed_length([torch.tensor([0, 1, 2]), torch.tensor([3, 4])]) is None
+    with_bias = [{**x, "attention_bias": torch.zeros(16, 16)} for x in inputs]
+    assert collator._collate_fixed_length(with_bias) is None  # type: ignore
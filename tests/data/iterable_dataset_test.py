@@ -1,9 +1,10 @@
 from dataclasses import dataclass
-from typing import Iterable, List, Set
+from typing import Iterable, List, Optional, Set
 
 import pytest
 import torch.utils.data
 
+from olmo.config import ShuffleMode
 from olmo.data import IterableDataset
 
 
@@ -104,3 +105,127 @@ def test_iterable_dataset_with_workers(monkeypatch, worker_id: int):
     elif worker_id == 3:
         # 4th worker should get the 4th batch,
         assert items[0:device_batch_size] == rank_items[device_batch_size * 3 : device_batch_size * 4]
+
+
+class BatchedList(list):
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.batch_sizes: List[int] = []
+
+    def __getitems__(self, indices: List[int]) -> List[List[int]]:
+        self.batch_sizes.append(len(indices))
+        return [self[idx] for idx in indices]
+
+
+@pytest.mark.parametrize("num_threads", [0, 3])
+def test_iterable_dataset_uses_getitems(num_threads: int):
+    data = BatchedList(pack(range(20)))
+    dataset = IterableDataset(data, 4, world_size=1, rank=0, shuffle=False, num_threads=num_threads)
+    assert unpack(dataset) == list(range(20))
+    assert max(data.batch_sizes) > 1
+    assert sum(data.batch_sizes) == 20
+
+
+@pytest.mark.parametrize("shuffle_mode", [ShuffleMode.feistel, ShuffleMode.block])
+@pytest.mark.parametrize(
+    "world_size, rank, start_index, max_examples, drop_last, num_workers",
+    [
+        (1, 0, 0, None, False, None),
+        (3, 1, 0, None, False, None),
+        (3, 2, 6, None, True, None),
+        (2, 1, 4, 16, False, None),
+        (2, 0, 0, None, False, 3),
+        (3, 2, 9, None, False, 2),
+    ],
+)
+def test_iterable_dataset_lazy_shuffle(
+    monkeypatch,
+    tmp_path,
+    world_size: int,
+    rank: int,
+    start_index: int,
+    max_examples: Optional[int],
+    drop_last: bool,
+    num_workers: Optional[int],
+    shuffle_mode: ShuffleMode,
+):
+    if num_workers is not None:
+        monkeypatch.setattr(
+            torch.utils.data, "get_worker_info", lambda: MockWorkerInfo(id=1, num_workers=num_workers)
+        )
+
+    def make_dataset(shuffle_mode: ShuffleMode) -> IterableDataset:
+        return IterableDataset(
+            pack(range(41)),
+            2 * world_size,
+            seed=3,
+            epoch=1,
+            world_size=world_size,
+            rank=rank,
+            start_index=start_index,
+            max_examples=max_examples,
+            drop_last=drop_last,
+            work_dir=tmp_path,
+            shuffle_mode=shuffle_mode,
+            shuffle_block_size=4,
+            shuffle_buffer_size=12,
+            num_threads=2,
+        )
+
+    dataset = make_dataset(shuffle_mode)
+    assert not (tmp_path / "global_indices.npy").exists()
+    global_indices = dataset.get_global_indices()
+    assert len(global_indices) == dataset.total_size
+    if drop_last:
+        assert len(set(global_indices.tolist())) == dataset.total_size
+    else:
+        assert set(global_indices.tolist()) == set(range(41))
+    assert global_indices.tolist() != sorted(global_indices.tolist())
+
+    # The lazily computed indices should match what slicing the whole global order gives us.
+    expected = make_dataset(ShuffleMode.global_indices)
+    monkeypatch.setattr(expected, "get_global_indices", lambda: global_indices)
+    assert unpack(dataset) == unpack(expected)
+
+    dataset.reshuffle(2)
+    assert dataset.get_global_indices().tolist() != global_indices.tolist()
+
+
+def test_iterable_dataset_block_shuffle():
+    dataset = IterableDataset(
+        pack(range(1000)),
+        10,
+        seed=3,
+        world_size=1,
+        rank=0,
+        shuffle_mode=ShuffleMode.block,
+        shuffle_block_size=10,
+        shuffle_buffer_size=50,
+    )
+    global_indices = dataset.get_global_indices()
+    assert sorted(global_indices.tolist()) == list(range(1000))
+    for start in range(0, 1000, 50):
+        window = global_indices[start : start + 50]
+        # Each window is made up of 5 whole blocks, in a shuffled order.
+        blocks = sorted(set((window // 10).tolist()))
+        assert len(blocks) == 5
+        assert sorted(window.tolist()) == [i for b in blocks for i in range(b * 10, b * 10 + 10)]
+        assert window.tolist() != sorted(window.tolist())
+    assert (global_indices[::50] // 10).tolist() != sorted((global_indices[::50] // 10).tolist())
+
+    # Restarting part way through gives the rest of the same order.
+    dataset.start_index = 730
+    assert unpack(dataset) == global_indices[730:].tolist()
+
+
+@pytest.mark.parametrize("num_workers", [None, 2])
+def test_iterable_dataset_adaptive_threads(monkeypatch, num_workers: Optional[int]):
+    if num_workers is not None:
+        monkeypatch.setattr(
+            torch.utils.data, "get_worker_info", lambda: MockWorkerInfo(id=1, num_workers=num_workers)
+        )
+    expected = IterableDataset(pack(range(103)), 8, seed=1, world_size=2, rank=1, num_threads=3)
+    dataset = IterableDataset(
+        pack(range(103)), 8, seed=1, world_size=2, rank=1, num_threads=3, adaptive_threads=True, max_threads=5
+    )
+    assert unpack(dataset) == unpack(expected)
@@ -0,0 +1,53 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+import olmo.data.memmap_dataset
+from olmo.data.manifest import DatasetManifest
+from olmo.data.memmap_dataset import MemMapDataset
+from olmo.exceptions import OLMoConfigurationError
+
+
+def test_dataset_manifest(tmp_path: Path, monkeypatch):
+    paths = []
+    for i, num_tokens in enumerate([32, 50, 16]):
+        path = tmp_path / f"tokens-{i}.npy"
+        np.arange(num_tokens, dtype=np.uint16).tofile(path)
+        paths.append(path)
+    mask_paths = []
+    for i, num_tokens in enumerate([32, 50, 16]):
+        path = tmp_path / f"mask-{i}.npy"
+        np.ones(num_tokens, dtype=np.bool_).tofile(path)
+        mask_paths.append(path)
+
+    manifest = DatasetManifest.build(paths, np.uint16).merge(DatasetManifest.build(mask_paths, np.bool_))
+    manifest.save(tmp_path / "manifest.jsonl")
+    with pytest.raises(FileExistsError):
+        manifest.save(tmp_path / "manifest.jsonl")
+    manifest = DatasetManifest.load(tmp_path / "manifest.jsonl")
+    assert len(manifest) == 6
+    assert manifest.get(paths[1], np.uint16).num_tokens == 50
+    assert manifest.verify() == []
+
+    expected = MemMapDataset(*paths, chunk_size=8, label_mask_paths=mask_paths).offsets  # type: ignore
+
+    def no_file_size(path):
+        raise AssertionError(f"file_size({path}) shouldn't be called")
+
+    def no_s3_clients(self):
+        raise AssertionError("S3 clients shouldn't be created with a manifest")
+
+    monkeypatch.setattr(olmo.data.memmap_dataset, "file_size", no_file_size)
+    monkeypatch.setattr(MemMapDataset, "_create_s3_clients", no_s3_clients)
+    dataset = MemMapDataset(*paths, chunk_size=8, label_mask_paths=mask_paths, manifest=manifest)  # type: ignore
+    assert dataset.offsets == expected == [(0, 4), (4, 10), (10, 12)]
+    assert dataset[5]["input_ids"].tolist() == list(range(8, 16))
+
+    with pytest.raises(OLMoConfigurationError):
+        MemMapDataset(*paths, chunk_size=8, memmap_dtype=np.uint32, manifest=manifest).offsets
+    with pytest.raises(OLMoConfigurationError):
+        MemMapDataset(tmp_path / "other.npy", chunk_size=8, manifest=manifest).offsets
+
+    np.arange(40, dtype=np.uint16).tofile(paths[0])
+    assert manifest.verify() == [str(paths[0])]
@@ -1,8 +1,23 @@
+import pickle
 from pathlib import Path
 from typing import List
 
 import numpy as np
+import pytest
+import torch
 
+from olmo.config import InstanceFilterConfig, PaddingDirection
+from olmo.data.collator import DataCollator
+from olmo.data.document_index import (
+    build_document_index,
+    document_index_path,
+    write_document_index,
+)
+from olmo.data.instance_filter import (
+    build_instance_filter_mask,
+    instance_filter_mask_path,
+    write_instance_filter_mask,
+)
 from olmo.data.memmap_dataset import MemMapDataset
 from olmo.tokenizer import Tokenizer
 
@@ -22,6 +37,20 @@ def test_mmap_dataset(tmp_path: Path):
     assert ds[7]["input_ids"].tolist() == [28, 29, 30, 31]
 
 
+def test_mmap_dataset_odd_file_size(tmp_path: Path):
+    # A trailing byte that doesn't make up a whole token is ignored.
+    data = np.array(list(range(18)), dtype=np.uint16).tobytes() + b"\x00"
+    (tmp_path / "mmap1.npy").write_bytes(data)
+
+    ds = MemMapDataset(tmp_path / "mmap1.npy", chunk_size=4)
+    assert len(ds) == 4
+    assert ds[3]["input_ids"].tolist() == [12, 13, 14, 15]
+    assert [instance["input_ids"].tolist() for instance in ds.__getitems__([0, 3])] == [
+        [0, 1, 2, 3],
+        [12, 13, 14, 15],
+    ]
+
+
 def test_mmap_dataset_with_label_mask(tmp_path: Path):
     mmap1 = np.memmap(tmp_path / "mmap1.npy", mode="w+", dtype=np.uint16, shape=(16,))
     mmap1[:] = np.array(list(range(16)), dtype=np.uint16)
@@ -106,3 +135,217 @@ def test_concat_mmap_datasets(tmp_path: Path):
     # Should get the same with negative index.
     assert ds[-1]["input_ids"].tolist() == [3, 4, 5]
     assert ds[-1]["metadata"]["label"] == "test2"
+
+
+def test_mmap_dataset_source_ids(tmp_path: Path):
+    paths = []
+    for i in range(3):
+        path = tmp_path / f"tokens{i}.npy"
+        np.arange(8, dtype=np.uint16).tofile(path)
+        paths.append(path)
+    label_a, label_b = {"label": "a"}, {"label": "b"}
+    dataset = MemMapDataset(
+        *paths,
+        chunk_size=4,
+        metadata=[label_a, label_b, label_a],
+        include_instance_metadata=False,
+        include_source_ids=True,
+    )
+    assert dataset.metadata_table == [label_a, label_b]
+    items = dataset.__getitems__([0, 2, 5])
+    assert [x["source_id"].item() for x in items] == [0, 1, 0]
+    assert all("metadata" not in x for x in items)
+    assert dataset[3]["source_id"].item() == 1
+
+    batch = DataCollator(
+        pad_direction=PaddingDirection.right, pad_token_id=0, metadata_table=dataset.metadata_table
+    )(items)
+    assert batch["source_id"].tolist() == [0, 1, 0]
+    assert batch["metadata"] == [label_a, label_b, label_a]
+
+
+def test_mmap_dataset_reuses_memmaps_per_process(tmp_path: Path):
+    mmap1 = np.memmap(tmp_path / "mmap1.npy", mode="w+", dtype=np.uint16, shape=(16,))
+    mmap1[:] = np.array(list(range(16)), dtype=np.uint16)
+    mmap1.flush()
+
+    mask_mmap1 = np.memmap(tmp_path / "mask_mmap1.npy", mode="w+", dtype=np.bool_, shape=(16,))
+    mask_mmap1[:] = np.array([True, False] * 8, dtype=np.bool_)
+    mask_mmap1.flush()
+    del mmap1, mask_mmap1
+
+    ds = MemMapDataset(
+        tmp_path / "mmap1.npy", chunk_size=4, label_mask_paths=[f"file://{tmp_path / 'mask_mmap1.npy'}"]
+    )
+    assert ds[1]["input_ids"].tolist() == [4, 5, 6, 7]
+    assert ds[1]["input_ids"].dtype == torch.long
+    assert ds[1]["label_mask"].tolist() == [True, False, True, False]
+    assert len(ds._memmaps) == 2
+    memmaps = dict(ds._memmaps)
+
+    # Handles should be reused on subsequent reads...
+    assert ds[2]["input_ids"].tolist() == [8, 9, 10, 11]
+    assert all(ds._memmaps[key] is memmap for key, memmap in memmaps.items())
+
+    # ...but not carried across pickling, or into a different process.
+    assert not pickle.loads(pickle.dumps(ds))._memmaps
+    ds._memmaps_pid = -1
+    assert ds[3]["input_ids"].tolist() == [12, 13, 14, 15]
+    assert all(ds._memmaps[key] is not memmap for key, memmap in memmaps.items())
+
+
+def test_mmap_dataset_memmap_index_lookup(tmp_path: Path):
+    sizes = [12, 0, 3, 9]
+    paths = []
+    for i, size in enumerate(sizes):
+        path = tmp_path / f"tokens{i}.npy"
+        with open(path, "wb") as f:
+            f.write(np.arange(size, dtype=np.uint16).tobytes())
+        paths.append(path)
+
+    ds = MemMapDataset(*paths, chunk_size=3)
+    assert ds.offsets == [(0, 4), (4, 4), (4, 5), (5, 8)]
+    assert ds.cumulative_offsets.tolist() == [0, 4, 4, 5, 8]
+
+    expected = [(0, 0), (0, 1), (0, 2), (0, 3), (2, 0), (3, 0), (3, 1), (3, 2)]
+    assert [ds.get_memmap_index(i) for i in range(len(ds))] == expected
+    assert ds.get_memmap_index(-1) == (3, 2)
+
+    memmap_indices, local_indices = ds.get_memmap_indices([7, 4, 0, -4, 3])
+    assert memmap_indices.tolist() == [3, 2, 0, 2, 0]
+    assert local_indices.tolist() == [2, 0, 0, 0, 3]
+
+    with pytest.raises(IndexError):
+        ds.get_memmap_index(8)
+    with pytest.raises(IndexError):
+        ds.get_memmap_indices([0, -9])
+
+
+def test_mmap_dataset_getitems(tmp_path: Path):
+    mmap1 = np.memmap(tmp_path / "mmap1.npy", mode="w+", dtype=np.uint16, shape=(16,))
+    mmap1[:] = np.array(list(range(16)), dtype=np.uint16)
+    mmap1.flush()
+    mmap2 = np.memmap(tmp_path / "mmap2.npy", mode="w+", dtype=np.uint16, shape=(16,))
+    mmap2[:] = np.array(list(range(16, 32)), dtype=np.uint16)
+    mmap2.flush()
+    mask_mmap1 = np.memmap(tmp_path / "mask_mmap1.npy", mode="w+", dtype=np.bool_, shape=(16,))
+    mask_mmap1[:] = np.arange(16) % 3 == 0
+    mask_mmap1.flush()
+    mask_mmap2 = np.memmap(tmp_path / "mask_mmap2.npy", mode="w+", dtype=np.bool_, shape=(16,))
+    mask_mmap2[:] = np.arange(16) % 2 == 0
+    mask_mmap2.flush()
+
+    ds = MemMapDataset(
+        tmp_path / "mmap1.npy",
+        tmp_path / "mmap2.npy",
+        chunk_size=4,
+        metadata=[{"label": "a"}, {"label": "b"}],
+        label_mask_paths=[tmp_path / "mask_mmap1.npy", tmp_path / "mask_mmap2.npy"],
+    )
+    indices = [5, 0, 1, 6, 1, -1, 3]
+    batch = ds.__getitems__(indices)
+    assert len(batch) == len(indices)
+    for index, item in zip(indices, batch):
+        expected = ds[index]
+        assert item.keys() == expected.keys()
+        assert item["input_ids"].dtype == torch.long
+        assert item["input_ids"].tolist() == expected["input_ids"].tolist()
+        assert item["label_mask"].tolist() == expected["label_mask"].tolist()
+        assert item["metadata"] == expected["metadata"]
+
+
+def test_mmap_dataset_getitems_remote(local_file_server):
+    np.arange(32, dtype=np.uint16).tofile(local_file_server.root / "tokens.npy")
+    (np.arange(32) % 2 == 0).tofile(local_file_server.root / "mask.npy")
+    ds = MemMapDataset(
+        local_file_server.url("tokens.npy"),
+        chunk_size=4,
+        label_mask_paths=[local_file_server.url("mask.npy")],
+    )
+    batch = ds.__getitems__([6, 0, 1, 2])
+    assert [x["input_ids"].tolist() for x in batch] == [
+        list(range(24, 28)),
+        list(range(0, 4)),
+        list(range(4, 8)),
+        list(range(8, 12)),
+    ]
+    assert all(x["label_mask"].tolist() == [True, False, True, False] for x in batch)
+    # One read for chunks 0-2 and one for chunk 6, for both the tokens and the mask.
+    assert len(local_file_server.get_requests()) == 4
+
+
+def test_mmap_dataset_instance_filter(tmp_path: Path):
+    tokens = np.random.default_rng(0).integers(0, 1000, size=(4, 64)).astype(np.uint16)
+    tokens[1, 8:48] = 7
+    tokens[2, 0:60] = np.tile([3, 4, 5], 20)
+    tokens.tofile(tmp_path / "tokens.npy")
+
+    ds = MemMapDataset(tmp_path / "tokens.npy", chunk_size=64, instance_filter_config=InstanceFilterConfig())
+    assert [ds[i]["instance_mask"] for i in range(4)] == [True, False, True, True]
+    assert [x["instance_mask"] for x in ds.__getitems__([0, 1, 2, 3])] == [True, False, True, True]
+
+    ds = MemMapDataset(
+        tmp_path / "tokens.npy",
+        chunk_size=64,
+        instance_filter_config=InstanceFilterConfig(repetition_max_count=16),
+    )
+    assert [x["instance_mask"] for x in ds.__getitems__([0, 1, 2, 3])] == [True, False, False, True]
+
+
+def test_mmap_dataset_precomputed_instance_filter(tmp_path: Path):
+    tokens = np.random.default_rng(0).integers(0, 1000, size=(11, 64)).astype(np.uint16)
+    tokens[1, 8:48] = 7
+    tokens[9, 0:60] = np.tile([3, 4, 5], 20)
+    tokens.tofile(tmp_path / "tokens.npy")
+
+    config = InstanceFilterConfig(repetition_max_count=16, precomputed=True)
+    mask_path = instance_filter_mask_path(tmp_path / "tokens.npy", config, 64, np.uint16)
+    ds = MemMapDataset(tmp_path / "tokens.npy", chunk_size=64, instance_filter_config=config)
+    with pytest.raises(FileNotFoundError):
+        ds[0]
+
+    bitmap = build_instance_filter_mask(tmp_path / "tokens.npy", config, 64, np.uint16, batch_size=4)
+    write_instance_filter_mask(bitmap, mask_path)
+    assert Path(mask_path).stat().st_size == 2
+    with pytest.raises(FileExistsError):
+        write_instance_filter_mask(bitmap, mask_path)
+
+    expected = [i not in (1, 9) for i in range(11)]
+    assert [ds[i]["instance_mask"] for i in range(11)] == expected
+    assert [x["instance_mask"] for x in ds.__getitems__([9, 1, 0, 10])] == [False, False, True, True]
+
+    # Masks for other filter settings are kept separately.
+    assert instance_filter_mask_path(tmp_path / "tokens.npy", InstanceFilterConfig(), 64, np.uint16) != mask_path
+
+    # Empty files and trailing bytes that don't make up a whole token are fine.
+    (tmp_path / "odd.npy").write_bytes(tokens.tobytes() + b"\x00")
+    odd_bitmap = build_instance_filter_mask(tmp_path / "odd.npy", config, 64, np.uint16, batch_size=4)
+    assert odd_bitmap.tolist() == bitmap.tolist()
+    (tmp_path / "empty.npy").write_bytes(b"")
+    assert build_instance_filter_mask(tmp_path / "empty.npy", config, 64, np.uint16).size == 0
+
+
+def test_mmap_dataset_document_index(tmp_path: Path):
+    tokens = np.random.default_rng(0).integers(1, 1000, size=(6, 32)).astype(np.uint32)
+    tokens[0, [3, 10, 31]] = 0
+    tokens[2, 5] = 0
+    tokens[5, 0] = 0
+    tokens.tofile(tmp_path / "tokens.npy")
+    write_document_index(
+        build_document_index(tmp_path / "tokens.npy", 0, np.uint32, block_size=50),
+        document_index_path(tmp_path / "tokens.npy", 0),
+    )
+
+    kwargs = dict(chunk_size=32, memmap_dtype=np.uint32, generate_doc_lengths=True, eos_token_id=0)
+    expected = MemMapDataset(tmp_path / "tokens.npy", **kwargs)  # type: ignore
+    ds = MemMapDataset(tmp_path / "tokens.npy", use_document_index=True, **kwargs)  # type: ignore
+    for i in range(len(ds)):
+        assert ds[i]["doc_lens"].tolist() == expected[i]["doc_lens"].tolist()
+    assert ds[0]["doc_lens"].tolist() == [4, 7, 21]
+    assert [x["doc_lens"].tolist() for x in ds.__getitems__([1, 5])] == [[32], [1, 31]]
+
+    # Empty files and trailing bytes that don't make up a whole token are fine.
+    (tmp_path / "odd.npy").write_bytes(tokens.tobytes() + b"\x00\x00")
+    assert build_document_index(tmp_path / "odd.npy", 0, np.uint32).tolist() == [3, 10, 31, 69, 160]
+    (tmp_path / "empty.npy").write_bytes(b"")
+    assert build_document_index(tmp_path / "empty.npy", 0, np.uint32).size == 0
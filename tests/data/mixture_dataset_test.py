@@ -0,0 +1,55 @@
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from olmo.config import DataConfig
+from olmo.data.memmap_dataset import MemMapDataset
+from olmo.data.mixture_dataset import MixtureDataset
+from olmo.exceptions import OLMoConfigurationError
+
+
+def make_dataset(tmp_path: Path) -> MemMapDataset:
+    # Three files with 4, 6, and 10 instances of 2 tokens, where each instance is [i, i].
+    paths = []
+    start = 0
+    for i, num_instances in enumerate([4, 6, 10]):
+        path = tmp_path / f"{i}.npy"
+        np.repeat(np.arange(start, start + num_instances, dtype=np.uint16), 2).tofile(path)
+        paths.append(path)
+        start += num_instances
+    return MemMapDataset(*paths, chunk_size=2)
+
+
+def test_mixture_dataset(tmp_path: Path):
+    dataset = MixtureDataset(make_dataset(tmp_path), [2, 1], [2.0, 0.5], seed=1)
+    assert len(dataset) == 2 * 10 + 5
+
+    counts = Counter(int(x["input_ids"][0]) for x in dataset.__getitems__(list(range(len(dataset)))))
+    assert all(counts[i] == 2 for i in range(10))
+    # Half of the last source, without duplicates.
+    assert sum(counts[i] for i in range(10, 20)) == 5
+    assert all(counts[i] <= 1 for i in range(10, 20))
+
+    assert dataset[3]["input_ids"].tolist() == [3, 3]
+    assert dataset[13]["input_ids"].tolist() == [3, 3]
+    assert dataset[-1]["input_ids"].tolist() == dataset[len(dataset) - 1]["input_ids"].tolist()
+    with pytest.raises(IndexError):
+        dataset[len(dataset)]
+
+
+def test_mixture_dataset_from_data_config(tmp_path: Path):
+    memmap_dataset = make_dataset(tmp_path)
+    data_config = DataConfig(datasets={"a": ["0.npy", "1.npy"], "b": ["2.npy"]})
+    assert MixtureDataset.from_data_config(memmap_dataset, data_config) is memmap_dataset
+
+    data_config.dataset_weights = {"b": 0.3}
+    dataset = MixtureDataset.from_data_config(memmap_dataset, data_config)
+    assert isinstance(dataset, MixtureDataset)
+    assert dataset.weights == [1.0, 0.3]
+    assert len(dataset) == 10 + 3
+
+    data_config.dataset_weights = {"c": 2.0}
+    with pytest.raises(OLMoConfigurationError):
+        MixtureDataset.from_data_config(memmap_dataset, data_config)
@@ -0,0 +1,71 @@
+from pathlib import Path
+
+import numpy as np
+
+from olmo.config import InstanceFilterConfig
+from olmo.data import PackedMemMapDataset
+from olmo.data.collator import DataCollator
+from olmo.data.document_index import build_document_index
+from olmo.data.packing import build_packed_index, packed_index_path, write_packed_index
+
+
+def test_packed_mmap_dataset(tmp_path: Path):
+    eos, pad = 0, 99
+    docs = [[1, 2, eos], [3, 4, 5, eos], [8, eos], [9, 10, 11, 12, 13, 14, 15, 16, 17, 18, eos]]
+    paths = []
+    for i in range(2):
+        path = tmp_path / f"tokens-{i}.npy"
+        np.array([t for doc in docs[2 * i : 2 * i + 2] for t in doc], dtype=np.uint16).tofile(path)
+        mask_path = tmp_path / f"mask-{i}.npy"
+        np.array([t % 2 == 0 for doc in docs[2 * i : 2 * i + 2] for t in doc], dtype=np.bool_).tofile(mask_path)
+        num_tokens = len(np.fromfile(path, dtype=np.uint16))
+        pieces, instance_offsets = build_packed_index(build_document_index(path, eos, np.uint16), num_tokens, 8)
+        write_packed_index(pieces, instance_offsets, packed_index_path(path, 8, eos))
+        paths.append(path)
+
+    dataset = PackedMemMapDataset(
+        *paths,
+        chunk_size=8,
+        pad_token_id=pad,
+        eos_token_id=eos,
+        generate_doc_lengths=True,
+        label_mask_paths=[tmp_path / "mask-0.npy", tmp_path / "mask-1.npy"],  # type: ignore
+    )
+    # The first file fits in one instance. In the second, the long document is split into 8 + 3 tokens
+    # and the remainder is packed with the short document.
+    assert dataset.offsets == [(0, 1), (1, 3)]
+    instances = dataset.__getitems__([0, 1, 2])
+    assert [x["input_ids"].tolist() for x in instances] == [
+        [1, 2, eos, 3, 4, 5, eos, pad],
+        [9, 10, 11, 12, 13, 14, 15, 16],
+        [8, eos, 17, 18, eos, pad, pad, pad],
+    ]
+    assert [x["doc_lens"].tolist() for x in instances] == [[3, 4, 1], [8], [2, 3, 3]]
+    assert instances[2]["label_mask"].tolist() == [True, True, False, True, True, False, False, False]
+    assert dataset[2]["input_ids"].tolist() == instances[2]["input_ids"].tolist()
+
+    batch = DataCollator(pad_direction="right", pad_token_id=pad)(instances)  # type: ignore
+    assert batch["max_doc_lens"] == [4, 8, 3]
+
+
+def test_packed_mmap_dataset_instance_filter(tmp_path: Path):
+    eos, pad = 0, 1
+    docs = np.random.default_rng(0).integers(2, 1000, size=(2, 100)).astype(np.uint16)
+    docs[:, -1] = eos
+    docs[1, 8:48] = 7
+    paths = []
+    for i, doc in enumerate(docs):
+        path = tmp_path / f"tokens-{i}.npy"
+        doc.tofile(path)
+        pieces, instance_offsets = build_packed_index(build_document_index(path, eos, np.uint16), len(doc), 256)
+        write_packed_index(pieces, instance_offsets, packed_index_path(path, 256, eos))
+        paths.append(path)
+
+    dataset = PackedMemMapDataset(
+        *paths, chunk_size=256, pad_token_id=pad, eos_token_id=eos, instance_filter_config=InstanceFilterConfig()
+    )
+    # Both bins are mostly padding, which doesn't count as repetitions.
+    instances = dataset.__getitems__([0, 1])
+    assert [x["input_ids"].tolist().count(pad) for x in instances] == [156, 156]
+    assert [x["instance_mask"] for x in instances] == [True, False]
+    assert dataset[0]["instance_mask"]
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from olmo.data.packing import (
+    build_packed_index,
+    get_document_spans,
+    pack_documents,
+    read_packed_index,
+    read_packed_index_size,
+    write_packed_index,
+)
+
+
+def test_get_document_spans():
+    assert get_document_spans(np.array([2, 5]), 6).tolist() == [[0, 3], [3, 3]]
+    assert get_document_spans(np.array([2, 5]), 9).tolist() == [[0, 3], [3, 3], [6, 3]]
+    assert get_document_spans(np.array([], dtype=np.int64), 4).tolist() == [[0, 4]]
+
+
+def test_pack_documents():
+    lengths = np.array([5, 3, 7, 2, 8, 1, 6, 4])
+    instances = pack_documents(lengths, 8)
+    assert sorted(doc for instance in instances for doc in instance) == list(range(len(lengths)))
+    assert all(lengths[instance].sum() <= 8 for instance in instances)
+    # 36 tokens can't fit in fewer than 5 instances of 8.
+    assert len(instances) == 5
+    assert pack_documents(np.array([], dtype=np.int64), 8) == []
+    with pytest.raises(ValueError):
+        pack_documents(np.array([9]), 8)
+
+
+def test_build_packed_index(tmp_path):
+    rng = np.random.default_rng(0)
+    lengths = rng.integers(1, 40, size=200)
+    eos_offsets = np.cumsum(lengths) - 1
+    num_tokens = int(lengths.sum()) + 5
+    pieces, instance_offsets = build_packed_index(eos_offsets, num_tokens, 16)
+
+    # Every token is in exactly one piece and no instance is too long.
+    covered = np.zeros(num_tokens, dtype=np.int64)
+    for start, length in pieces.tolist():
+        covered[start : start + length] += 1
+    assert (covered == 1).all()
+    instance_lengths = np.add.reduceat(pieces[:, 1], instance_offsets[:-1])
+    assert instance_lengths.max() <= 16
+    assert len(instance_lengths) < num_tokens / 16 * 1.05
+
+    write_packed_index(pieces, instance_offsets, tmp_path / "index")
+    assert read_packed_index_size(tmp_path / "index") == len(instance_offsets) - 1
+    read_pieces, read_instance_offsets = read_packed_index(tmp_path / "index")
+    assert read_pieces.tolist() == pieces.tolist()
+    assert read_instance_offsets.tolist() == instance_offsets.tolist()
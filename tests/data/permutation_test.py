@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+from olmo.data.permutation import FeistelPermutation
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 17, 1000, 4097])
+def test_feistel_permutation_is_a_bijection(size: int):
+    permutation = FeistelPermutation(size, seed=0)
+    assert sorted(permutation(np.arange(size)).tolist()) == list(range(size))
+
+
+def test_feistel_permutation_seeds():
+    positions = np.arange(1000)
+    a = FeistelPermutation(1000, seed=np.array([0, 1]))(positions)
+    b = FeistelPermutation(1000, seed=np.array([0, 1]))(positions)
+    c = FeistelPermutation(1000, seed=np.array([0, 2]))(positions)
+    assert a.tolist() == b.tolist()
+    assert a.tolist() != c.tolist()
+    # Looking up a few positions gives the same result as the whole permutation.
+    assert FeistelPermutation(1000, seed=np.array([0, 1]))(np.array([999, 3])).tolist() == [a[999], a[3]]
+
+
+def test_feistel_permutation_large():
+    permutation = FeistelPermutation(2**40 + 7, seed=0)
+    values = permutation(np.arange(2**40 - 5, 2**40 + 7))
+    assert len(set(values.tolist())) == 12
+    assert (values < 2**40 + 7).all()
+    with pytest.raises(IndexError):
+        permutation(np.array([2**40 + 7]))
+
+
+def test_feistel_permutation_tweaks():
+    permutation = FeistelPermutation(100, seed=0)
+    positions = np.arange(100)
+    by_tweak = [permutation(positions, tweak) for tweak in range(3)]
+    for values in by_tweak:
+        assert sorted(values.tolist()) == list(range(100))
+    assert by_tweak[0].tolist() != by_tweak[1].tolist()
+    # Tweaks can differ per position.
+    tweaks = positions % 3
+    assert permutation(positions, tweaks).tolist() == [by_tweak[t][i] for i, t in enumerate(tweaks)]
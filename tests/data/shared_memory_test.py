@@ -0,0 +1,76 @@
+from typing import Any, Dict, List
+
+import torch
+from torch.utils.data import DataLoader
+
+from olmo.config import PaddingDirection
+from olmo.data import (
+    DataCollator,
+    IterableDataset,
+    SharedMemoryBatchRing,
+    SharedMemoryDataLoader,
+)
+
+
+def collect(data_loader: DataLoader) -> List[Dict[str, Any]]:
+    # Batches from a 'SharedMemoryDataLoader' are only valid until the next one, so copy them.
+    return [
+        {k: v.clone() if isinstance(v, torch.Tensor) else v for k, v in batch.items()} for batch in data_loader
+    ]
+
+
+def test_shared_memory_data_loader():
+    instances = [
+        {
+            "input_ids": torch.arange(i, i + 8),
+            "doc_lens": torch.tensor([4, 4] if i % 2 else [8], dtype=torch.int32),
+        }
+        for i in range(50)
+    ]
+    dataset = IterableDataset(instances, 4, world_size=1, rank=0, seed=0, num_threads=0)  # type: ignore
+    collator = DataCollator(pad_direction=PaddingDirection.right, pad_token_id=0)
+    ring = SharedMemoryBatchRing(
+        {"input_ids": ((8,), torch.long), "index": ((), torch.long), "doc_lens": ((8,), torch.int32)},
+        batch_size=4,
+        num_workers=2,
+        slots_per_worker=3,
+    )
+    kwargs: Dict[str, Any] = dict(batch_size=4, num_workers=2, prefetch_factor=2)
+    data_loader = SharedMemoryDataLoader(dataset, ring=ring, collate_fn=collator, **kwargs)
+    expected = collect(DataLoader(dataset, collate_fn=collator, **kwargs))  # type: ignore
+    for _ in range(2):
+        batches = collect(data_loader)
+        assert len(batches) == len(expected)
+        for batch, expected_batch in zip(batches, expected):
+            assert batch.keys() == expected_batch.keys()
+            for key in batch.keys():
+                if isinstance(batch[key], torch.Tensor):
+                    assert batch[key].tolist() == expected_batch[key].tolist()
+                else:
+                    assert batch[key] == expected_batch[key]
+
+
+def test_shared_memory_batch_ring_fallback():
+    ring = SharedMemoryBatchRing(
+        {"input_ids": ((8,), torch.long)}, batch_size=4, num_workers=1, slots_per_worker=2
+    )
+    batch = {"input_ids": torch.ones(2, 8, dtype=torch.long), "max_doc_lens": [8, 8]}
+    batch_slot = ring.put(batch, 0)
+    assert not isinstance(batch_slot, dict)
+    assert ring.get(batch_slot)["input_ids"].tolist() == batch["input_ids"].tolist()
+    assert ring.get(batch_slot)["max_doc_lens"] == [8, 8]
+
+    # Batches that don't fit are passed through as is.
+    for too_big in (
+        {"input_ids": torch.ones(5, 8, dtype=torch.long)},
+        {"input_ids": torch.ones(2, 9, dtype=torch.long)},
+        {"input_ids": torch.ones(2, 8, dtype=torch.long), "label_mask": torch.ones(2, 8, dtype=torch.bool)},
+    ):
+        assert ring.put(too_big, 0) is too_big
+
+    # So are batches whose slot isn't released in time.
+    ring.timeout = 0.01
+    assert not isinstance(ring.put(batch, 0), dict)
+    assert ring.put(batch, 0) is batch
+    ring.release(batch_slot)
+    assert not isinstance(ring.put(batch, 0), dict)
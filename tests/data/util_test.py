@@ -1,6 +1,13 @@
+import numpy as np
+import pytest
 import torch
 
-from olmo.data.util import get_document_lengths
+from olmo.data.util import (
+    find_max_repetitions,
+    find_periodic_sequences,
+    get_document_lengths,
+    get_document_lengths_from_offsets,
+)
 
 
 def test_get_cumulative_document_lengths():
@@ -15,3 +22,46 @@ def test_get_cumulative_document_lengths():
     assert get_document_lengths(
         torch.tensor([3, 4, 5, 5, eos_token_id, 6, 5, eos_token_id, 3, 5, eos_token_id]), eos_token_id=eos_token_id
     ).tolist() == [5, 3, 3]
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_find_max_repetitions_matches_find_periodic_sequences(seed: int):
+    rng = np.random.default_rng(seed)
+    for _ in range(500):
+        length = int(rng.integers(3, 200))
+        vocab_size = int(rng.integers(2, 6))
+        arr = rng.integers(0, vocab_size, size=length)
+        # Plant some repeated sequences.
+        for _ in range(int(rng.integers(0, 3))):
+            pattern = rng.integers(0, vocab_size, size=int(rng.integers(1, 8)))
+            start = int(rng.integers(0, length))
+            repeated = np.tile(pattern, int(rng.integers(2, 20)))[: length - start]
+            arr[start : start + len(repeated)] = repeated
+        max_period, min_period = int(rng.integers(1, 15)), int(rng.integers(1, 4))
+
+        expected = max(
+            (m.times for m in find_periodic_sequences(arr, max_period=max_period, min_period=min_period)),
+            default=0,
+        )
+        assert find_max_repetitions(arr, max_period=max_period, min_period=min_period) == expected
+
+
+def test_find_max_repetitions_batched():
+    batch = np.random.default_rng(0).integers(0, 3, size=(8, 64))
+    batch[3, 10:40] = np.tile([1, 2], 15)
+    expected = [find_max_repetitions(row, max_period=13) for row in batch]
+    assert find_max_repetitions(batch, max_period=13).tolist() == expected
+    assert expected[3] >= 15
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_get_document_lengths_from_offsets(seed: int):
+    rng = np.random.default_rng(seed)
+    eos_token_id = 0
+    tokens = rng.integers(0, 8, size=1000)
+    eos_offsets = np.flatnonzero(tokens == eos_token_id)
+    for start, end in [(0, 100), (100, 200), (37, 64), (990, 1000), (0, 1000)]:
+        expected = get_document_lengths(torch.from_numpy(tokens[start:end]), eos_token_id)
+        actual = get_document_lengths_from_offsets(eos_offsets, start, end)
+        assert actual.dtype == expected.dtype
+        assert actual.tolist() == expected.tolist()
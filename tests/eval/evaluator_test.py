@@ -0,0 +1,28 @@
+import pytest
+import torch
+from torch.utils.data import DataLoader
+from torchmetrics import MeanMetric
+
+from olmo.config import EvaluatorType
+from olmo.eval import Evaluator
+
+
+def test_lm_evaluator_labels_from_source_ids():
+    evaluator = Evaluator(
+        label="test",
+        type=EvaluatorType.lm,
+        eval_loader=DataLoader([]),
+        eval_metric={"a": MeanMetric(), "b": MeanMetric()},
+        metadata_table=[{"label": "a"}, {"label": "b"}],
+    )
+    ce_loss = torch.tensor([1.0, 2.0, 3.0, 6.0])
+    evaluator.update_metrics({"source_id": torch.tensor([0, 1, 0, 1])}, ce_loss, torch.empty(0))
+    metrics = evaluator.compute_metrics()
+    assert metrics["eval/a/CrossEntropyLoss"] == pytest.approx(2.0)
+    assert metrics["eval/b/CrossEntropyLoss"] == pytest.approx(4.0)
+
+    # Batches with the metadata itself work too.
+    evaluator.reset_metrics()
+    batch = {"metadata": [{"label": "a"}, {"label": "b"}, {"label": "a"}, {"label": "b"}]}
+    evaluator.update_metrics(batch, ce_loss, torch.empty(0))
+    assert evaluator.compute_metrics() == metrics
@@ -0,0 +1,114 @@
+from typing import Any, Dict, List
+
+import pytest
+import torch
+
+from olmo.config import ModelConfig
+from olmo.eval import (
+    DocumentDistributedSampler,
+    ICLMetric,
+    continuation_logits,
+    continuation_positions,
+)
+from olmo.eval.downstream import ICLMultiChoiceTaskDataset
+from olmo.model import OLMo
+from olmo.tokenizer import Tokenizer
+
+
+class ToyTask(ICLMultiChoiceTaskDataset):
+    metric_type = "acc"
+
+    def __init__(self, tokenizer: Tokenizer, docs: List[Dict[str, Any]]):
+        # Skip loading a dataset from the hub.
+        self.tokenizer = tokenizer
+        self.dataset_path = "toy"
+        self.dataset_name = None
+        self.model_ctx_len = 2048
+        self.prompts = [None]
+        self.current_prompt = None
+        self.log_instances = 0
+        self.samples = []
+        self.dataset = docs
+        self.prep_examples()
+
+    def doc_to_text(self, doc) -> str:
+        return doc["question"]
+
+    def doc_to_continuations(self, doc) -> List[str]:
+        return [" " + choice for choice in doc["choices"]]
+
+    def doc_to_label(self, doc) -> int:
+        return doc["label"]
+
+
+@pytest.fixture(scope="module")
+def task() -> ToyTask:
+    tokenizer = Tokenizer.from_file("test_fixtures/test-olmo-model/tokenizer.json", eos_token_id=50256)
+    docs = [
+        {
+            "question": "The capital of France is",
+            "choices": ["Paris", "Berlin", "a large city in Spain"],
+            "label": 0,
+        },
+        {"question": "Question: what color is the sky?\nAnswer:", "choices": ["blue", "green"], "label": 0},
+        {"question": "2 + 2 =", "choices": ["4", "five", "22", "nothing at all"], "label": 0},
+    ]
+    return ToyTask(tokenizer, docs)
+
+
+@pytest.mark.parametrize("metric_type", ["acc", "len_norm", "bpb"])
+def test_continuation_logits(task: ToyTask, metric_type: str):
+    torch.manual_seed(0)
+    model = OLMo(
+        ModelConfig(d_model=64, n_heads=4, n_layers=2, rope=True, vocab_size=50257, embedding_size=50304)
+    ).eval()
+    batch = task.collate_fn([task[i] for i in range(len(task))])
+
+    with torch.no_grad():
+        logits = model(batch["input_ids"]).logits
+        positions_logits = model(batch["input_ids"], logits_positions=continuation_positions(batch)).logits
+        cont_logits = continuation_logits(model, batch)
+    assert cont_logits.shape == (len(task), batch["cont_len"].max(), logits.shape[-1])
+    assert positions_logits.shape == cont_logits.shape
+
+    expected = ICLMetric(metric_type=metric_type)
+    expected.update(batch, logits)
+    for continuation_only_logits in (positions_logits, cont_logits):
+        metric = ICLMetric(metric_type=metric_type)
+        metric.update(batch, continuation_only_logits, continuation_logits_only=True)
+        torch.testing.assert_close(torch.stack(metric.loglikelihoods), torch.stack(expected.loglikelihoods))
+        assert metric.compute() == expected.compute()
+
+
+def test_continuation_logits_single_token_continuations(task: ToyTask):
+    torch.manual_seed(0)
+    model = OLMo(
+        ModelConfig(d_model=64, n_heads=4, n_layers=2, rope=True, vocab_size=50257, embedding_size=50304)
+    ).eval()
+    instances = [task[i] for i in range(len(task)) if task[i]["cont_len"] == 1]
+    assert len(instances) > 1
+    batch = task.collate_fn(instances)
+
+    # The continuation pass still runs, so that every rank runs as many forward passes under FSDP.
+    num_forward_passes = 0
+
+    def count_forward_pass(module, args):
+        nonlocal num_forward_passes
+        num_forward_passes += 1
+
+    with torch.no_grad():
+        expected = model(batch["input_ids"], logits_positions=continuation_positions(batch)).logits
+        model.register_forward_pre_hook(count_forward_pass)
+        cont_logits = continuation_logits(model, batch)
+    assert num_forward_passes == 2
+    torch.testing.assert_close(cont_logits, expected)
+
+
+def test_document_distributed_sampler(task: ToyTask):
+    samplers = [DocumentDistributedSampler(task, num_replicas=2, rank=rank) for rank in range(2)]
+    assert len(samplers[0]) == len(samplers[1])
+    for sampler in samplers:
+        doc_ids = [task[i]["doc_id"] for i in sampler]
+        # The instances of each document are next to each other.
+        assert doc_ids == sorted(doc_ids, key=doc_ids.index)
+    assert {i for sampler in samplers for i in sampler} == set(range(len(task)))
@@ -5,7 +5,15 @@ import torch
 import torch.nn.functional as F
 from torch.nn import CrossEntropyLoss
 
-from olmo import BlockType, LayerNorm, OLMo, Tokenizer, TrainConfig
+from olmo import (
+    BlockType,
+    LayerNorm,
+    OLMo,
+    PagedKVCache,
+    StaticKVCache,
+    Tokenizer,
+    TrainConfig,
+)
 from olmo.config import ModelConfig, PaddingDirection
 from olmo.data import DataCollator
 
@@ -501,3 +509,148 @@ def test_block_groups():
         no_block_groups_output = model_without_block_groups(input_ids)
 
     torch.testing.assert_close(block_groups_output, no_block_groups_output)
+
+
+@pytest.mark.parametrize(
+    "alibi, rope, n_kv_heads",
+    [
+        pytest.param(True, False, None, id="alibi"),
+        pytest.param(False, True, None, id="rope"),
+        pytest.param(False, True, 1, id="rope-mqa"),
+        pytest.param(False, False, None, id="abs-emb"),
+    ],
+)
+def test_static_kv_cache(alibi: bool, rope: bool, n_kv_heads: Optional[int]):
+    torch.manual_seed(0)
+    model = OLMo(
+        ModelConfig(
+            d_model=64, n_heads=4, n_kv_heads=n_kv_heads, n_layers=3, alibi=alibi, rope=rope, vocab_size=64
+        )
+    ).eval()
+    input_ids = torch.randint(0, 64, (2, 12))
+    attention_mask = torch.ones_like(input_ids)
+    attention_mask[0, :3] = 0
+
+    with torch.no_grad():
+        expected = model(input_ids, attention_mask=attention_mask).logits
+
+        # Prefill 8 positions, then decode the rest one position at a time.
+        cache = StaticKVCache(model.config.n_layers, batch_size=2, max_length=12)
+        logits = [model(input_ids[:, :8], attention_mask=attention_mask[:, :8], past_key_values=cache).logits]
+        assert cache.length == 8
+        for i in range(8, 12):
+            logits.append(
+                model(
+                    input_ids[:, i : i + 1], attention_mask=attention_mask[:, : i + 1], past_key_values=cache
+                ).logits
+            )
+        assert cache.length == 12
+
+    # Padding positions attend to nothing, so only the others are comparable.
+    mask = attention_mask.bool()
+    torch.testing.assert_close(torch.cat(logits, dim=1)[mask], expected[mask])
+
+    with pytest.raises(ValueError):
+        model(input_ids[:, :1], past_key_values=cache)
+
+
+@pytest.mark.parametrize(
+    "alibi, rope, n_kv_heads",
+    [
+        pytest.param(True, False, None, id="alibi"),
+        pytest.param(False, True, None, id="rope"),
+        pytest.param(False, True, 1, id="rope-mqa"),
+        pytest.param(False, False, None, id="abs-emb"),
+    ],
+)
+def test_paged_kv_cache(alibi: bool, rope: bool, n_kv_heads: Optional[int]):
+    torch.manual_seed(0)
+    model = OLMo(
+        ModelConfig(
+            d_model=64, n_heads=4, n_kv_heads=n_kv_heads, n_layers=3, alibi=alibi, rope=rope, vocab_size=64
+        )
+    ).eval()
+    sequences = [torch.randint(0, 64, (13,)), torch.randint(0, 64, (9,))]
+    page_tables = [[7, 2, 5, 0], [3, 9, 1]]
+    # The number of cached and new positions of each sequence in each step, mixing prefill and decoding.
+    steps = [[(0, 10), (0, 3)], [(10, 1), (3, 6)], [(11, 2)]]
+
+    with torch.no_grad():
+        expected = [model(sequence.unsqueeze(0)).logits[0] for sequence in sequences]
+        cache = PagedKVCache(model.config.n_layers, num_pages=10, page_size=4)
+        for step in steps:
+            seq_len = max(num_new for _, num_new in step)
+            input_ids = torch.zeros((len(step), seq_len), dtype=torch.long)
+            for i, (past, num_new) in enumerate(step):
+                input_ids[i, seq_len - num_new :] = sequences[i][past : past + num_new]
+            cache.schedule(
+                page_tables[: len(step)],
+                [past for past, _ in step],
+                [num_new for _, num_new in step],
+                input_ids.device,
+            )
+            logits = model(input_ids, past_key_values=cache).logits  # type: ignore
+            for i, (past, num_new) in enumerate(step):
+                torch.testing.assert_close(logits[i, seq_len - num_new :], expected[i][past : past + num_new])
+
+
+def test_logits_positions():
+    torch.manual_seed(0)
+    model = OLMo(ModelConfig(d_model=64, n_heads=4, n_layers=2, rope=True, vocab_size=64)).eval()
+    input_ids = torch.randint(0, 64, (3, 10))
+    with torch.no_grad():
+        logits = model(input_ids).logits
+
+        positions = torch.tensor([[0, 4], [9, 9], [3, 2]])
+        positions_logits = model(input_ids, logits_positions=positions).logits
+        assert positions_logits.shape == (3, 2, logits.shape[-1])
+        torch.testing.assert_close(positions_logits, logits.gather(1, positions[..., None].expand(-1, -1, 50304)))
+
+        # The same positions for every sequence.
+        torch.testing.assert_close(model(input_ids, logits_positions=torch.tensor([5])).logits, logits[:, 5:6])
+
+        mask = torch.zeros_like(input_ids, dtype=torch.bool)
+        mask[0, 1:3] = mask[2, 7] = True
+        torch.testing.assert_close(model(input_ids, logits_positions=mask).logits, logits[mask])
+
+
+@pytest.mark.parametrize("weight_tying", (True, False))
+def test_labels_loss(weight_tying):
+    torch.manual_seed(0)
+    model = OLMo(
+        ModelConfig(
+            d_model=64,
+            n_heads=4,
+            n_layers=2,
+            rope=True,
+            vocab_size=64,
+            embedding_size=64,
+            weight_tying=weight_tying,
+            scale_logits=True,
+            attention_dropout=0.0,
+            residual_dropout=0.0,
+            embedding_dropout=0.0,
+        )
+    )
+    input_ids = torch.randint(0, 64, (3, 10))
+    labels = torch.cat([input_ids[:, 1:], torch.full((3, 1), -100)], dim=1)
+    labels[1, :4] = -100
+
+    logits = model(input_ids).logits
+    loss = F.cross_entropy(logits.view(-1, 64), labels.view(-1), reduction="sum")
+    z_loss = (logits.logsumexp(-1).pow(2) * (labels != -100)).sum()
+    grads = torch.autograd.grad(loss + z_loss, list(model.parameters()))
+
+    output = model(input_ids, labels=labels, loss_reduction="sum", compute_z_loss=True, loss_chunk_size=7)
+    assert output.logits is None
+    assert output.z_loss is not None
+    torch.testing.assert_close(output.loss, loss)
+    torch.testing.assert_close(output.z_loss, 1e-4 * z_loss)
+    labels_grads = torch.autograd.grad(output.loss + 1e4 * output.z_loss, list(model.parameters()))
+    for labels_grad, grad in zip(labels_grads, grads):
+        torch.testing.assert_close(labels_grad, grad, atol=1e-5, rtol=1e-4)
+
+    # Per-position losses.
+    output = model(input_ids, labels=labels, loss_reduction="none")
+    assert output.loss.shape == (3, 10)
+    torch.testing.assert_close(output.loss.sum(), loss)
@@ -0,0 +1,151 @@
+import json
+import urllib.error
+import urllib.request
+from typing import List
+
+import pytest
+import torch
+
+from olmo.config import ModelConfig
+from olmo.model import OLMo
+from olmo.serving import GenerationEngine, GenerationServer, SamplingParams
+from olmo.tokenizer import Tokenizer
+
+
+@pytest.fixture(scope="module")
+def model() -> OLMo:
+    torch.manual_seed(0)
+    config = ModelConfig(
+        d_model=64,
+        n_heads=4,
+        n_kv_heads=2,
+        n_layers=2,
+        rope=True,
+        max_sequence_length=64,
+        vocab_size=50280,
+        embedding_size=50304,
+        eos_token_id=50256,
+        init_device="cpu",
+    )
+    return OLMo(config).eval()
+
+
+def greedy(model: OLMo, prompt: List[int], max_tokens: int) -> List[int]:
+    token_ids = list(prompt)
+    with torch.no_grad():
+        for _ in range(max_tokens):
+            logits = model(torch.tensor([token_ids])).logits[0, -1, : model.config.vocab_size]
+            token_ids.append(int(logits.argmax()))
+    return token_ids[len(prompt) :]
+
+
+@pytest.mark.parametrize(
+    "num_pages, max_num_seqs, max_num_batched_tokens",
+    [
+        pytest.param(None, 8, 256, id="default"),
+        pytest.param(None, 3, 256, id="few-seqs"),
+        pytest.param(None, 8, 7, id="chunked-prefill"),
+        # Not enough pages for all sequences at once.
+        pytest.param(6, 8, 256, id="preemption"),
+    ],
+)
+def test_generation_engine(model: OLMo, num_pages, max_num_seqs: int, max_num_batched_tokens: int):
+    engine = GenerationEngine(
+        model,
+        page_size=4,
+        num_pages=num_pages,
+        max_num_seqs=max_num_seqs,
+        max_num_batched_tokens=max_num_batched_tokens,
+    )
+    prompts = [list(range(100 + i, 100 + i + length)) for i, length in enumerate([3, 11, 1, 6, 9, 2])]
+    params = SamplingParams(max_tokens=5, temperature=0.0, ignore_eos=True)
+    outputs = engine.generate(prompts, params)
+
+    assert [output.prompt_token_ids for output in outputs] == prompts
+    for prompt, output in zip(prompts, outputs):
+        assert output.token_ids == greedy(model, prompt, 5)
+        assert output.finish_reason == "length"
+    assert not engine.has_unfinished_requests()
+    assert len(engine.scheduler.free_pages) == engine.cache.num_pages
+
+
+def test_generation_engine_sampling(model: OLMo):
+    engine = GenerationEngine(model, page_size=4, max_num_seqs=4, seed=0)
+    prompts = [[1, 2, 3], [4, 5]]
+    expected = engine.generate(prompts, SamplingParams(max_tokens=4, temperature=0.0, ignore_eos=True))
+    # Only the most likely token is left with top-k of 1.
+    top_1 = engine.generate(prompts, SamplingParams(max_tokens=4, temperature=2.0, top_k=1, ignore_eos=True))
+    assert [output.token_ids for output in top_1] == [output.token_ids for output in expected]
+
+    stop_token_id = expected[1].token_ids[1]
+    outputs = engine.generate(
+        prompts, SamplingParams(max_tokens=4, temperature=0.0, stop_token_ids=[stop_token_id])
+    )
+    assert outputs[1].token_ids == expected[1].token_ids[: expected[1].token_ids.index(stop_token_id) + 1]
+    assert outputs[1].finish_reason == "stop"
+
+    sampled = engine.generate(prompts, SamplingParams(max_tokens=4, top_p=0.9, ignore_eos=True))
+    assert all(len(output.token_ids) == 4 for output in sampled)
+
+
+def test_generation_engine_cache_memory(model: OLMo):
+    # Each page holds the keys and values of 4 positions of 2 blocks, with 2 heads of 16 floats.
+    page_bytes = 2 * 2 * 4 * 2 * 16 * 4
+    engine = GenerationEngine(model, page_size=4, cache_memory_gb=10 * page_bytes / 1024**3)
+    assert engine.cache.num_pages == 10
+    assert all(keys is not None and keys.shape == (40, 2, 16) for keys in engine.cache.keys)
+    outputs = engine.generate([[1, 2, 3]], SamplingParams(max_tokens=3, temperature=0.0, ignore_eos=True))
+    assert outputs[0].token_ids == greedy(model, [1, 2, 3], 3)
+
+    # The default is capped at enough pages for `max_num_seqs` sequences of the maximum length.
+    assert GenerationEngine(model, page_size=4, max_num_seqs=2).cache.num_pages == 32
+
+    with pytest.raises(ValueError, match="at least one page"):
+        GenerationEngine(model, page_size=4, cache_memory_gb=page_bytes / 2 / 1024**3)
+
+
+def test_generation_engine_invalid_token_ids(model: OLMo):
+    engine = GenerationEngine(model, page_size=4, max_num_seqs=4)
+    params = SamplingParams(max_tokens=3, temperature=0.0, ignore_eos=True)
+    request_id = engine.add_request([1, 2, 3], params)
+    for prompt in ([4, model.config.vocab_size], [-1, 5]):
+        with pytest.raises(ValueError, match="vocabulary"):
+            engine.add_request(prompt, params)
+
+    outputs = []
+    while engine.has_unfinished_requests():
+        outputs.extend(engine.step())
+    assert [output.request_id for output in outputs] == [request_id]
+    assert outputs[0].token_ids == greedy(model, [1, 2, 3], 3)
+    assert len(engine.scheduler.free_pages) == engine.cache.num_pages
+
+
+def test_generation_server(model: OLMo):
+    tokenizer = Tokenizer.from_file("test_fixtures/test-olmo-model/tokenizer.json", eos_token_id=50256)
+    engine = GenerationEngine(model, page_size=4, max_num_seqs=4)
+    with GenerationServer(engine, tokenizer, model_name="test") as server:
+
+        def post(body):
+            request = urllib.request.Request(
+                f"{server.url}/v1/completions",
+                data=json.dumps(body).encode(),
+                headers={"Content-Type": "application/json"},
+            )
+            with urllib.request.urlopen(request) as response:
+                return json.load(response)
+
+        response = post({"prompt": ["Hello", [1, 2, 3]], "max_tokens": 3, "temperature": 0, "ignore_eos": True})
+        assert response["model"] == "test"
+        assert [choice["index"] for choice in response["choices"]] == [0, 1]
+        prompt_token_ids = tokenizer.encode("Hello", add_special_tokens=False)
+        assert response["usage"]["prompt_tokens"] == len(prompt_token_ids) + 3
+        assert response["usage"]["completion_tokens"] == 6
+        assert response["choices"][1]["text"] == tokenizer.decode(greedy(model, [1, 2, 3], 3))
+
+        with pytest.raises(urllib.error.HTTPError) as e:
+            post({"prompt": "Hello", "stream": True})
+        assert e.value.code == 400
+
+        with pytest.raises(urllib.error.HTTPError) as e:
+            post({"prompt": [1, model.config.vocab_size]})
+        assert e.value.code == 400
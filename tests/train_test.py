@@ -2,6 +2,7 @@ import pytest
 import torch
 from torch.testing import assert_close
 
+from olmo.loss import chunked_cross_entropy_loss
 from olmo.train import cross_entropy_loss, fused_loss_fn
 
 
@@ -21,3 +22,38 @@ def test_fused_loss(batch_size, seq_len, vocab_size, z_loss_multiplier):
     # Note: This is allowing for very big differences!
     assert_close(loss, f_loss, atol=1e-2, rtol=1e-3)
     assert_close(z_loss, f_z_loss, atol=1e-2, rtol=1e-3)
+
+
+@pytest.mark.parametrize("reduction", ("mean", "sum", "none"))
+@pytest.mark.parametrize("bias", (False, True))
+@pytest.mark.parametrize("logit_scale", (1.0, 0.125))
+def test_chunked_loss(reduction, bias, logit_scale):
+    torch.manual_seed(0)
+    x = torch.randn(75, 32, requires_grad=True)
+    weight = torch.randn(100, 32, requires_grad=True)
+    b = torch.randn(100, requires_grad=True) if bias else None
+    labels = torch.randint(0, 100, (75,))
+    labels[::7] = -100
+    params = [x, weight] + ([b] if b is not None else [])
+
+    logits = logit_scale * torch.nn.functional.linear(x, weight, b)
+    loss, z_loss = cross_entropy_loss(logits, labels, reduction=reduction, compute_z_loss=True)
+    grads = torch.autograd.grad(loss.sum() + 10 * z_loss.sum(), params)
+
+    c_loss, c_z_loss = chunked_cross_entropy_loss(
+        x,
+        weight,
+        labels,
+        bias=b,
+        reduction=reduction,
+        compute_z_loss=True,
+        logit_scale=logit_scale,
+        chunk_size=16,
+    )
+    assert c_z_loss is not None
+    c_grads = torch.autograd.grad(c_loss.sum() + 10 * c_z_loss.sum(), params)
+
+    assert_close(c_loss, loss)
+    assert_close(c_z_loss, z_loss)
+    for c_grad, grad in zip(c_grads, grads):
+        assert_close(c_grad, grad, atol=1e-5, rtol=1e-4)
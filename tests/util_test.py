@@ -1,4 +1,11 @@
+import concurrent.futures
+import time
+
+import pytest
+
 from olmo import util
+from olmo.config import DataConfig
+from olmo.exceptions import OLMoConfigurationError, OLMoThreadError
 
 
 def test_dir_is_empty(tmp_path):
@@ -40,3 +47,109 @@ def test_flatten_dict():
         "b.f": 1,
         "c": 2,
     }
+
+
+def test_get_bytes_ranges(local_file_server, tmp_path):
+    data = bytes(range(256)) * 4
+    (local_file_server.root / "data.bin").write_bytes(data)
+    (tmp_path / "data.bin").write_bytes(data)
+    ranges = [(0, 10), (1000, 24), (300, 1), (10, 10)]
+    expected = [data[start : start + length] for start, length in ranges]
+
+    assert util.get_bytes_ranges(tmp_path / "data.bin", ranges) == expected
+    assert util.get_bytes_ranges(f"file://{tmp_path / 'data.bin'}", ranges) == expected
+    assert util.get_bytes_ranges(local_file_server.url("data.bin"), ranges) == expected
+    assert sorted(r[2] for r in local_file_server.get_requests()) == sorted(
+        f"bytes={start}-{start + length - 1}" for start, length in ranges
+    )
+
+    assert util.get_bytes_ranges_multi(
+        [(local_file_server.url("data.bin"), 5, 5), (tmp_path / "data.bin", 7, 3)], num_threads=2
+    ) == [data[5:10], data[7:10]]
+
+
+def test_latency_histogram():
+    histogram = util.LatencyHistogram(min_count=10, max_count=100)
+    for _ in range(9):
+        histogram.record(0.01)
+    assert histogram.percentile(50) is None
+    histogram.record(1.0)
+    assert 0.01 <= histogram.percentile(50) < 0.015
+    assert 1.0 <= histogram.percentile(100) < 1.25
+
+    # Old samples should decay away.
+    for _ in range(200):
+        histogram.record(0.5)
+    assert 0.5 <= histogram.percentile(10) < 0.65
+
+
+def test_hedged_range_requests(local_file_server, monkeypatch):
+    data = bytes(range(256))
+    (local_file_server.root / "data.bin").write_bytes(data)
+    url = local_file_server.url("data.bin")
+    monkeypatch.setenv("OLMO_STORAGE_HEDGE_PERCENTILE", "90")
+    histogram = util.LatencyHistogram()
+    monkeypatch.setattr(util, "get_latency_histogram", lambda backend: histogram)
+
+    # Requests aren't hedged until we know what normal latency looks like.
+    local_file_server.delays = [0.2]
+    assert util.get_bytes_range(url, 0, 16) == data[:16]
+    assert len(local_file_server.get_requests()) == 1
+    for _ in range(histogram.min_count):
+        util.get_bytes_range(url, 0, 16)
+    num_requests = len(local_file_server.get_requests())
+
+    # Now a slow request should be raced by a duplicate that wins.
+    local_file_server.delays = [5.0]
+    start = time.monotonic()
+    assert util.get_bytes_range(url, 16, 16) == data[16:32]
+    assert time.monotonic() - start < 2.0
+    assert [r[2] for r in local_file_server.get_requests()[num_requests:]] == ["bytes=16-31"] * 2
+
+    # Time spent queued behind other reads doesn't count, so a fast request isn't hedged.
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(util, "_get_hedge_executor", lambda pid: executor)
+    executor.submit(time.sleep, 0.5)
+    num_requests = len(local_file_server.get_requests())
+    assert util.get_bytes_range(url, 32, 16) == data[32:48]
+    assert len(local_file_server.get_requests()) == num_requests + 1
+    executor.shutdown()
+
+
+def test_adaptive_threaded_map():
+    def slow(i: int) -> int:
+        time.sleep(0.005)
+        return i
+
+    # Results come in order, and the pool grows to keep up.
+    start = time.monotonic()
+    assert list(util.adaptive_threaded_map(slow, 200, max_threads=8, adjust_interval=4)) == list(range(200))
+    assert time.monotonic() - start < 200 * 0.005 / 2
+
+    assert list(util.adaptive_threaded_map(slow, 0)) == []
+
+    def fail(i: int) -> int:
+        if i == 3:
+            raise ValueError(i)
+        return i
+
+    results = []
+    with pytest.raises(OLMoThreadError):
+        for x in util.adaptive_threaded_map(fail, 10, initial_threads=4):
+            results.append(x)
+    assert results == [0, 1, 2]
+
+
+def test_file_exists_and_data_config_paths(tmp_path):
+    (tmp_path / "a.npy").write_bytes(b"\x00" * 4)
+    assert util.file_exists(tmp_path / "a.npy")
+    assert not util.file_exists(tmp_path / "b.npy")
+
+    assert util.data_config_paths(DataConfig(paths=["x.npy", "y.npy"])) == ["x.npy", "y.npy"]
+    assert util.data_config_paths(DataConfig(datasets={"b": ["z.npy"], "a": ["x.npy", "y.npy"]})) == [
+        "x.npy",
+        "y.npy",
+        "z.npy",
+    ]
+    with pytest.raises(OLMoConfigurationError):
+        util.data_config_paths(DataConfig())